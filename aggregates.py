@@ -0,0 +1,232 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+from time import sleep
+import argparse
+import logging
+import re
+
+from ledger import Ledger, ShardReader
+from shardstore import list_shards
+from trending import hashtags
+
+logging.basicConfig(filename='neo4j_errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
+
+# Candidate accounts with the names that count as a tweet being about them
+CANDIDATES = {'JoeBiden': (939091, ['Joe Biden', 'Biden']),
+              'BernieSanders': (216776631, ['Bernie Sanders', 'Sanders', 'Bernie']),
+              'ewarren': (357606935, ['Elizabeth Warren', 'Warren']),
+              'amyklobuchar': (33537967, ['Amy Klobuchar', 'Klobuchar']),
+              'MikeBloomberg': (16581604, ['Michael Bloomberg', 'Bloomberg']),
+              'AndrewYang': (2228878592, ['Andrew Yang', 'Yang']),
+              'TulsiGabbard': (26637348, ['Tulsi Gabbard', 'Gabbard']),
+              'PeteButtigieg': (226222147, ['Pete Buttigieg', 'Buttigieg'])}
+BINS = 10
+COLUMNS = ['tweets', 'scored', 'sentiment_sum', 'sentiment_squares'] + [f'bin_{i}' for i in range(BINS)]
+
+SCHEMA = [f'''CREATE TABLE IF NOT EXISTS buckets (
+                  candidate TEXT NOT NULL, kind TEXT NOT NULL, bucket INTEGER NOT NULL,
+                  {', '.join(f"{column} {'REAL' if column.startswith('sentiment') else 'INTEGER'} NOT NULL DEFAULT 0"
+                             for column in COLUMNS)},
+                  PRIMARY KEY (candidate, kind, bucket))''',
+          '''CREATE TABLE IF NOT EXISTS terms (
+                  candidate TEXT NOT NULL, kind TEXT NOT NULL, bucket INTEGER NOT NULL, type TEXT NOT NULL,
+                  term TEXT NOT NULL, count INTEGER NOT NULL,
+                  PRIMARY KEY (candidate, kind, bucket, type, term))''']
+BUCKET_UPSERT = f'''INSERT INTO buckets (candidate, kind, bucket, {', '.join(COLUMNS)})
+                    VALUES (?, ?, ?, {', '.join('?' for _ in COLUMNS)})
+                    ON CONFLICT(candidate, kind, bucket) DO UPDATE SET
+                    {', '.join(f'{column} = {column} + excluded.{column}' for column in COLUMNS)}'''
+TERM_UPSERT = '''INSERT INTO terms (candidate, kind, bucket, type, term, count) VALUES (?, ?, ?, ?, ?, ?)
+                 ON CONFLICT(candidate, kind, bucket, type, term) DO UPDATE SET count = count + excluded.count'''
+
+
+def _pattern(names):
+    return re.compile(r'\b(?:' + '|'.join(re.escape(name) for name in names) + r')\b', re.IGNORECASE)
+
+
+PATTERNS = {candidate: (user_id, _pattern(names)) for candidate, (user_id, names) in CANDIDATES.items()}
+BY_ID = {user_id: candidate for candidate, (user_id, _) in CANDIDATES.items()}
+
+
+def candidates_of(tweet):
+    """Return {candidate: 'by' or 'about'} for the candidates a tweet dict was posted by or refers to.
+
+    A tweet refers to a candidate by mentioning, retweeting or quoting them or by naming them in its text.
+    """
+    found = {}
+    user = tweet.get('user') or {}
+    author = BY_ID.get(tweet.get('user_id', user.get('id')))
+    if author:
+        found[author] = 'by'
+    source = tweet.get('retweeted_status') or tweet
+    referenced = {mention.get('id') for mention in ((source.get('entities') or {}).get('user_mentions') or [])}
+    for status in (tweet.get('retweeted_status'), tweet.get('quoted_status')):
+        if status:
+            referenced.add(status.get('user_id', (status.get('user') or {}).get('id')))
+    text = source.get('text') or ''
+    for candidate, (user_id, pattern) in PATTERNS.items():
+        if candidate not in found and (user_id in referenced or pattern.search(text)):
+            found[candidate] = 'about'
+    return found
+
+
+class Aggregator:
+    """Per candidate and time bucket totals of a stream of tweet dicts, kept in memory until flush().
+
+    For every candidate a tweet is by or about it adds to that hour's tweet count, sentiment sum, sum of squares and
+    a BINS bin histogram of compound scores (with a sentiment function), and to its word and hashtag counts. Term
+    counts are exact however often flush() is called; read_terms picks the top terms when they are read. Every
+    distinct term of every bucket is a row of the terms table, so it grows with the vocabulary each hour until
+    prune_terms drops the rare terms of older buckets.
+    """
+
+    def __init__(self, sentiment=None, tokenize=None, bucket_seconds=3600):
+        self.sentiment = sentiment
+        self.tokenize = tokenize
+        self.bucket_seconds = bucket_seconds
+        self.rows = defaultdict(lambda: [0] * len(COLUMNS))
+        self.terms = defaultdict(Counter)
+        self.tweets = 0
+
+    def add(self, tweet):
+        """Count a tweet dict, returning the candidates it was counted for"""
+        found = candidates_of(tweet)
+        if not found or tweet.get('timestamp') is None:
+            return found
+        self.tweets += 1
+        bucket = int(tweet['timestamp'] // self.bucket_seconds * self.bucket_seconds)
+        text = (tweet.get('retweeted_status') or tweet).get('text') or ''
+        score = self.sentiment(text) if self.sentiment and text else None
+        words = self.tokenize(text) if self.tokenize and text else []
+        tags = [tag.lower() for tag in hashtags(tweet)]
+        for candidate, kind in found.items():
+            key = (candidate, kind, bucket)
+            row = self.rows[key]
+            row[0] += 1
+            if score is not None:
+                row[1] += 1
+                row[2] += score
+                row[3] += score * score
+                row[4 + min(BINS - 1, int((score + 1) / 2 * BINS))] += 1
+            self.terms[key + ('word',)].update(words)
+            self.terms[key + ('hashtag',)].update(tags)
+        return found
+
+    def flush(self, conn):
+        """Add the pending totals to the tables of an sqlite3 connection, without committing"""
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.executemany(BUCKET_UPSERT, [key + tuple(row) for key, row in self.rows.items()])
+        conn.executemany(TERM_UPSERT, [key + (term, count) for key, counts in self.terms.items()
+                                       for term, count in counts.items()])
+        self.rows.clear()
+        self.terms.clear()
+
+
+def vader_sentiment():
+    """Compound VADER score of stripped text, as the graph's Tweet.sentiment is scored"""
+    from sentiment import SentimentScorer
+    from textclean import strip
+    analyzer = SentimentScorer().analyzer
+    return lambda text: analyzer.polarity_scores(strip(text))['compound']
+
+
+def materialize(path, db, sentiment=True, words=True, checkpoint=5000):
+    """Fold every shard line not yet aggregated into the tables of db. Returns the number of tweets counted.
+
+    The aggregated offsets are kept in db too, committed together with the totals, so each line is counted once
+    however often the job is run.
+    """
+    from tokenizer import CachedTokenizer
+    aggregator = Aggregator(vader_sentiment() if sentiment else None, CachedTokenizer().tweet_tokens if words else None)
+    ledger = Ledger(db)
+    counted = 0
+    list_of_files = list_shards(path)
+    latest_file = list_of_files[-1] if list_of_files else None
+    for filename, offset in ledger.pending(list_of_files):
+        reader = ShardReader(filename, offset, final=filename != latest_file)
+        for line in reader:
+            try:
+                aggregator.add(line)
+            except Exception as e:
+                logging.error(f'Error on aggregate: {e}\nFailed tweet: {line}')
+            if reader.lines % checkpoint == 0:
+                aggregator.flush(ledger.conn)
+                ledger.checkpoint(filename, reader.offset)
+        aggregator.flush(ledger.conn)
+        ledger.checkpoint(filename, reader.offset, complete=filename != latest_file)
+        counted += aggregator.tweets
+        aggregator.tweets = 0
+    ledger.close()
+    return counted
+
+
+def prune_terms(db, min_count=2, keep=24 * 3600):
+    """Delete the terms counted fewer than min_count times in a bucket from buckets starting more than keep seconds
+    before the newest one, which no longer receive tweets as the stream runs. Returns the number of rows deleted.
+
+    Top terms are unaffected, but a pruned term that a late shard adds to again restarts its count at zero.
+    """
+    import sqlite3
+    with sqlite3.connect(db) as conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        return conn.execute('DELETE FROM terms WHERE count < ? AND bucket < (SELECT MAX(bucket) FROM terms) - ?',
+                            (min_count, keep)).rowcount
+
+
+def _where(candidate=None, kind=None, start=None, end=None):
+    clauses, params = [], []
+    for clause, value in (('candidate = ?', candidate), ('kind = ?', kind), ('bucket >= ?', start),
+                          ('bucket < ?', end)):
+        if value is not None:
+            clauses.append(clause)
+            params.append(value.timestamp() if isinstance(value, datetime) else value)
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+def read_buckets(db='Data/aggregates.db', candidate=None, kind=None, start=None, end=None):
+    """DataFrame of the hourly totals, with the bucket as datetime64 and mean and std of sentiment added"""
+    import sqlite3
+    import numpy as np
+    import pandas as pd
+    where, params = _where(candidate, kind, start, end)
+    with sqlite3.connect(db) as conn:
+        df = pd.read_sql_query(f'SELECT * FROM buckets{where} ORDER BY bucket', conn, params=params)
+    df['candidate'] = df.candidate.astype('category')
+    df['bucket'] = pd.to_datetime(df.bucket, unit='s')
+    scored = df.scored.where(df.scored > 0)
+    df['sentiment'] = df.sentiment_sum / scored
+    df['sentiment_std'] = np.sqrt((df.sentiment_squares / scored - df.sentiment ** 2).clip(lower=0))
+    return df
+
+
+def read_terms(db='Data/aggregates.db', candidate=None, kind=None, term_type='word', top=200, start=None, end=None):
+    """{term: count} of the top words (or hashtags) by or about a candidate, e.g. for create_wordcloud"""
+    import sqlite3
+    where, params = _where(candidate, kind, start, end)
+    where += (' AND' if where else ' WHERE') + ' type = ?'
+    with sqlite3.connect(db) as conn:
+        rows = conn.execute(f'SELECT term, SUM(count) AS total FROM terms{where} GROUP BY term '
+                            f'ORDER BY total DESC LIMIT ?', params + [term_type, top]).fetchall()
+    return dict(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Maintain per candidate, per hour aggregates of captured tweets.')
+    parser.add_argument('--path', default='Data/Primary/')
+    parser.add_argument('--db', default='Data/aggregates.db', help='SQLite file holding the aggregates')
+    parser.add_argument('--no-sentiment', action='store_true', help='Skip VADER scoring')
+    parser.add_argument('--no-words', action='store_true', help='Skip counting words')
+    parser.add_argument('--follow', type=float, default=0, help='Keep running, aggregating new tweets this often')
+    parser.add_argument('--prune', type=int, default=2,
+                        help='Drop terms counted fewer times than this in buckets over a day old, 0 to keep all')
+    args = parser.parse_args()
+
+    while True:
+        counted = materialize(args.path, args.db, sentiment=not args.no_sentiment, words=not args.no_words)
+        pruned = prune_terms(args.db, args.prune) if args.prune else 0
+        print(f'{datetime.now()}: {counted} tweets aggregated, {pruned} rare terms pruned')
+        if not args.follow:
+            break
+        sleep(args.follow)
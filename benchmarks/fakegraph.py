@@ -0,0 +1,86 @@
+"""In-memory stand-in for a py2neo Graph that records every round trip instead of talking to Neo4j.
+
+It implements what graphprocess, bulkload and ingest call: Graph.begin/run/schema and Transaction.run/merge/
+evaluate/commit/rollback/finished. Each statement and each commit counts as one round trip; rtt adds a fixed delay
+to every round trip to model the network and server.
+"""
+from collections import Counter
+from threading import Lock
+from time import sleep
+
+
+class RecordingSchema:
+    def __init__(self):
+        self.constraints = {}
+        self.indexes = {}
+
+    def get_uniqueness_constraints(self, label):
+        return self.constraints.get(label, [])
+
+    def create_uniqueness_constraint(self, label, key):
+        self.constraints.setdefault(label, []).append((key,))
+
+    def get_indexes(self, label):
+        return self.indexes.get(label, [])
+
+    def create_index(self, label, *keys):
+        self.indexes.setdefault(label, []).append(keys)
+
+
+class RecordingTransaction:
+    def __init__(self, graph):
+        self.graph = graph
+        self._finished = False
+
+    def run(self, query, parameters=None, **kwparameters):
+        params = dict(parameters or {}, **kwparameters)
+        self.graph.record('run', query, len(params.get('rows', ())) or 1)
+        return []
+
+    def evaluate(self, query, parameters=None, **kwparameters):
+        self.run(query, parameters, **kwparameters)
+
+    def merge(self, subgraph, primary_label=None, primary_key=None):
+        self.graph.record('merge', type(subgraph).__name__, 1)
+
+    def commit(self):
+        self.graph.record('commit', None, 0)
+        self._finished = True
+
+    def rollback(self):
+        self._finished = True
+
+    def finished(self):
+        return self._finished
+
+
+class RecordingGraph:
+    """Counts round trips, statements by query text and rows sent. Safe to share between writer threads."""
+
+    def __init__(self, rtt=0.0):
+        self.rtt = rtt
+        self.schema = RecordingSchema()
+        self.lock = Lock()
+        self.round_trips = 0
+        self.rows = 0
+        self.statements = Counter()
+
+    def record(self, kind, query, rows):
+        with self.lock:
+            self.round_trips += 1
+            self.rows += rows
+            self.statements[(kind, query)] += 1
+        if self.rtt:
+            sleep(self.rtt)
+
+    def begin(self, autocommit=False):
+        return RecordingTransaction(self)
+
+    def run(self, query, parameters=None, **kwparameters):
+        return RecordingTransaction(self).run(query, parameters, **kwparameters)
+
+    def evaluate(self, query, parameters=None, **kwparameters):
+        return self.run(query, parameters, **kwparameters)
+
+    def stats(self):
+        return {'round_trips': self.round_trips, 'rows': self.rows, 'distinct_queries': len(self.statements)}
@@ -0,0 +1,46 @@
+"""Measure the cold-start cost of importing get_sentiment, and of the libraries it now loads on first use.
+
+Each import runs in a fresh interpreter so nothing is cached between runs.
+
+    python benchmarks/import_time.py --repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What importing get_sentiment used to pay for before anything was called
+LAZY = ['py2neo', 'tweepy', 'pandas', 'nltk', 'matplotlib.pyplot', 'wordcloud']
+
+
+def cold_import(statement, repeat):
+    """Median seconds a fresh interpreter takes to run statement, or None if it fails"""
+    code = f'from time import perf_counter; start = perf_counter(); {statement}; print(perf_counter() - start)'
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+        if result.returncode:
+            return None
+        times.append(float(result.stdout.split()[-1]))
+    return median(times)
+
+
+def report(name, seconds):
+    print(f'{name:<40} ' + ('not importable here' if seconds is None else f'{seconds * 1000:>9.1f} ms'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    report('import get_sentiment', cold_import('import get_sentiment', args.repeat))
+    report('from get_sentiment import strip_tweets', cold_import('from get_sentiment import strip_tweets', args.repeat))
+    deferred = [cold_import(f'import {module}', args.repeat) for module in LAZY]
+    for module, seconds in zip(LAZY, deferred):
+        report(f'  deferred: import {module}', seconds)
+    print(f'{"  deferred total":<40} {sum(s for s in deferred if s is not None) * 1000:>9.1f} ms '
+          f'(plus connecting to Neo4j and downloading wordnet)')
@@ -0,0 +1,218 @@
+"""End-to-end ingest benchmark: status_to_dict -> jsonl shard -> decode -> transform -> graph writes.
+
+Synthetic statuses from benchmarks/synthetic.py go through every stage of the pipeline. Writes go to a recording
+fake of the py2neo Graph (benchmarks/fakegraph.py), or to a real Neo4j with --neo4j. Each write mode runs in a fresh
+process so peak RSS is its own. Results are compared with the baseline stored for the same workload in
+benchmarks/baselines/ingest_pipeline.json (or --baseline), and a metric worse by more than --tolerance makes the exit
+status 1. Round trips and rows per tweet are exact; timings depend on the machine, so store a baseline of your own
+with --save-baseline before comparing changes on another one.
+
+    python benchmarks/ingest_pipeline.py --tweets 20000
+    python benchmarks/ingest_pipeline.py --tweets 20000 --rtt 0.0005 --save-baseline
+    python benchmarks/ingest_pipeline.py --neo4j bolt://localhost:7687 --auth neo4j:password   # writes to that DB
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+# The repo goes first so its modules win over benchmark scripts of the same name
+sys.path.insert(0, BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+BASELINE = os.path.join(BENCHMARKS, 'baselines', 'ingest_pipeline.json')
+MODES = ['push_tweet', 'bulkload', 'bulkload_cache', 'ingest']
+# Metrics where bigger is better, the rest regress when they grow
+HIGHER_IS_BETTER = {'tweets_per_s', 'convert_per_s', 'encode_per_s', 'decode_per_s', 'transform_per_s'}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def make_graph(args):
+    if args.neo4j:
+        from py2neo import Graph
+        user, password = args.auth.split(':', 1)
+        return Graph(args.neo4j, auth=(user, password))
+    from fakegraph import RecordingGraph
+    return RecordingGraph(args.rtt)
+
+
+def run_mode(mode, args):
+    """Run one write mode over freshly generated statuses and return its metrics"""
+    from tweepy.models import Status
+    import graphprocess
+    import graphstream
+    import ingest
+    from bulkload import BulkLoader, tweet_ops
+    from ledger import Ledger, ShardReader
+    from nodecache import NodeCache
+    from shardstore import BlockWriter
+    from synthetic import SyntheticStream
+
+    graph = make_graph(args)
+    graphprocess.graph = ingest.graph = graph
+    raw = SyntheticStream(args.seed).take(args.tweets)
+    metrics = {}
+
+    start = perf_counter()
+    statuses = [Status.parse(None, status) for status in raw]
+    records = [graphstream.status_to_dict(status) for status in statuses]
+    records = [record for record in records if record]
+    metrics['convert_per_s'] = len(raw) / (perf_counter() - start)
+    del raw, statuses
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shard = os.path.join(tmp, 'Tweets-3-3-12-00.jsonl')
+        start = perf_counter()
+        writer = BlockWriter(shard)
+        for record in records:
+            writer.write(record)
+        writer.close()
+        metrics['encode_per_s'] = len(records) / (perf_counter() - start)
+        metrics['shard_bytes_per_tweet'] = os.path.getsize(shard) / len(records)
+        del records
+
+        start = perf_counter()
+        lines = list(ShardReader(shard))
+        metrics['decode_per_s'] = len(lines) / (perf_counter() - start)
+
+        # tweet_ops may consume its input, so it gets copies made outside the timing
+        copies = [json.loads(json.dumps(line)) for line in lines]
+        start = perf_counter()
+        for line in copies:
+            try:
+                tweet_ops(line)
+            except Exception:
+                pass
+        metrics['transform_per_s'] = len(lines) / (perf_counter() - start)
+        del copies
+
+        latencies = []
+        errors = 0
+        start = perf_counter()
+        if mode == 'ingest':
+            ingest.create_constraints(graph)
+            ingest.ingest([shard], Ledger(os.path.join(tmp, 'ledger.db')), workers=args.workers,
+                          sessions=args.sessions, batch_size=args.batch_size, cache=NodeCache())
+        else:
+            if mode == 'push_tweet':
+                push, loader = graphprocess.push_tweet, None
+            else:
+                cache = NodeCache() if mode == 'bulkload_cache' else None
+                loader = BulkLoader(graph, batch_size=args.batch_size, cache=cache)
+                push = loader.push
+            for line in ShardReader(shard):
+                tick = perf_counter()
+                try:
+                    push(line)
+                except Exception:
+                    errors += 1
+                latencies.append(perf_counter() - tick)
+            if loader:
+                tick = perf_counter()
+                loader.close()
+                latencies[-1] += perf_counter() - tick
+        elapsed = perf_counter() - start
+
+    metrics['tweets_per_s'] = len(lines) / elapsed
+    metrics['p50_ms'] = percentile(latencies, 0.5) * 1000 if latencies else None
+    metrics['p99_ms'] = percentile(latencies, 0.99) * 1000 if latencies else None
+    metrics['errors'] = errors
+    if hasattr(graph, 'round_trips'):
+        metrics['round_trips_per_tweet'] = graph.round_trips / len(lines)
+        metrics['rows_per_tweet'] = graph.rows / len(lines)
+    metrics['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return metrics
+
+
+def compare(results, baseline, tolerance):
+    """Return descriptions of every metric that is worse than the baseline by more than tolerance"""
+    regressions = []
+    for mode, metrics in results.items():
+        for name, value in metrics.items():
+            before = baseline.get(mode, {}).get(name)
+            if value is None or not before or name == 'errors':
+                continue
+            change = value / before - 1
+            if (change < -tolerance) if name in HIGHER_IS_BETTER else (change > tolerance):
+                regressions.append(f'{mode} {name}: {before:.4g} -> {value:.4g} ({change:+.0%})')
+    return regressions
+
+
+def report(results):
+    columns = ['tweets_per_s', 'p50_ms', 'p99_ms', 'round_trips_per_tweet', 'rows_per_tweet', 'peak_rss_mb']
+    print(f'{"mode":<16}' + ''.join(f'{column:>22}' for column in columns))
+    for mode, metrics in results.items():
+        cells = [metrics.get(column) for column in columns]
+        print(f'{mode:<16}' + ''.join(f'{"-" if cell is None else format(cell, ",.3f"):>22}' for cell in cells))
+    first = next(iter(results.values()))
+    print('stages (tweets/s): ' + ', '.join(f'{name[:-6]} {first[name]:,.0f}' for name in
+                                               ('convert_per_s', 'encode_per_s', 'decode_per_s', 'transform_per_s')))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tweets', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=2, help='Parse processes for the ingest mode')
+    parser.add_argument('--sessions', type=int, default=4, help='Writer sessions for the ingest mode')
+    parser.add_argument('--rtt', type=float, default=0.0, help='Seconds the fake graph waits per round trip')
+    parser.add_argument('--neo4j', help='Write to this Neo4j instead of the fake graph (adds synthetic data to it)')
+    parser.add_argument('--auth', default='neo4j:password')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed relative change before a regression')
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args.child, args)))
+        sys.exit()
+
+    results = {}
+    for mode in args.modes:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode] + sys.argv[1:],
+                               capture_output=True, text=True, cwd=tempfile.gettempdir())
+        if child.returncode:
+            print(f'{mode} failed:\n{child.stderr}')
+            continue
+        results[mode] = json.loads(child.stdout.strip().splitlines()[-1])
+    if not results:
+        sys.exit(1)
+    report(results)
+
+    # Baselines are kept per workload so runs of different sizes or targets are never compared
+    workload = f'{args.tweets} tweets, seed {args.seed}, batch {args.batch_size}, ' + \
+               (f'neo4j {args.neo4j}' if args.neo4j else f'fake graph rtt {args.rtt}')
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines.setdefault(workload, {}).update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f'Baseline saved for: {workload}')
+    elif workload in baselines:
+        regressions = compare(results, baselines[workload], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions against the baseline for: {workload}')
+    else:
+        print(f'No baseline stored for: {workload} (use --save-baseline)')
@@ -0,0 +1,95 @@
+"""Compare the old list-of-dicts read_cypher with the paged, typed cypherframe: time, peak memory and frame size.
+
+Records come from an in-memory cursor shaped like the notebook's candidate tweets query, so no database is needed.
+
+    python benchmarks/read_cypher.py --rows 1000000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+from cypherframe import cypher_frame  # noqa: E402
+
+KEYS = ['name', 'followers', 'text', 'timestamp']
+NAMES = ['BernieSanders', 'ewarren', 'JoeBiden', 'MikeBloomberg', 'PeteButtigieg', 'AndrewYang', 'amyklobuchar',
+         'TulsiGabbard']
+
+
+class Cursor:
+    """Iterates record tuples like a py2neo Cursor, generating them lazily as the Bolt driver would"""
+
+    def __init__(self, rows, seed=0):
+        self.rows = rows
+        self.seed = seed
+
+    def keys(self):
+        return KEYS
+
+    def __iter__(self):
+        r = random.Random(self.seed)
+        for i in range(self.rows):
+            name = r.choice(NAMES)
+            yield (name, 1000000 + len(name), f'tweet {i} about the primary #SuperTuesday', 1.583e9 + i * 0.1)
+
+
+class Graph:
+    def __init__(self, rows):
+        self.rows = rows
+        self.runs = 0
+
+    def run(self, cypher, parameters=None):
+        self.runs += 1
+        return Cursor(self.rows)
+
+
+def legacy(graph, cypher):
+    """read_cypher before cypherframe, plus the timestamp conversion the notebook then had to do"""
+    results = graph.run(cypher)
+    resrows = [{'name': i[0], 'followers': i[1], 'text': i[2], 'timestamp': i[3]} for i in results]
+    df = pd.DataFrame(resrows)
+    df['timestamp'] = pd.to_datetime(df.timestamp, unit='s')
+    return df
+
+
+def measure(build):
+    """Time a build, then run it again under tracemalloc for its peak memory"""
+    gc.collect()
+    start = perf_counter()
+    df = build()
+    elapsed = perf_counter() - start
+    del df
+    gc.collect()
+    tracemalloc.start()
+    df = build()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return df, elapsed, peak / 2 ** 20, df.memory_usage(deep=True).sum() / 2 ** 20
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--page-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    graph = Graph(args.rows)
+    query = 'MATCH (u:Candidate)-[r]-(t:Tweet) RETURN u.screen_name as name, ...'
+    results = {'list of dicts': measure(lambda: legacy(graph, query)),
+               'paged, typed': measure(lambda: cypher_frame(graph, query, page_size=args.page_size))}
+    with tempfile.TemporaryDirectory() as cache:
+        cypher_frame(graph, query, page_size=args.page_size, cache_dir=cache)
+        results['disk cache hit'] = measure(lambda: cypher_frame(graph, query, cache_dir=cache))
+
+    print(f'{args.rows:,} rows')
+    print(f'{"":<16}{"seconds":>10}{"peak MB":>10}{"frame MB":>10}')
+    for name, (df, elapsed, peak, size) in results.items():
+        print(f'{name:<16}{elapsed:>10.2f}{peak:>10.0f}{size:>10.0f}')
+    print(dict(results['paged, typed'][0].dtypes.astype(str)))
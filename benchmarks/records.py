@@ -0,0 +1,105 @@
+"""Compare the slotted records.Tweet path with the dict/py2neo Node path: memory per tweet and decode throughput.
+
+    python benchmarks/records.py Data/Primary/Tweets-3-3-20-00.jsonl [...]
+"""
+import argparse
+import copy
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from itertools import islice
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bulkload import dict_ops, tweet_ops, TweetBatch  # noqa: E402
+from records import Tweet, Unmodelled  # noqa: E402
+from shardstore import open_shard, loads  # noqa: E402
+from graphprocess import separate_children  # noqa: E402
+
+
+def sample_lines(n):
+    """A retweet of a quote, a quote and a plain tweet with a few entities each, with distinct ids"""
+    lines = []
+    for i in range(n):
+        user = {'screen_name': f'user{i % 997}', 'followers_count': i, 'verified': False, 'created_at': 1.5e9,
+                'id': i % 997, 'lang': 'en'}
+        entities = {'hashtags': [{'text': 'SuperTuesday', 'indices': [0, 13]}],
+                    'user_mentions': [{'screen_name': 'BernieSanders', 'name': 'Bernie Sanders', 'id': 216776631,
+                                       'id_str': '216776631', 'indices': [15, 29]}],
+                    'urls': [{'url': 'https://t.co/abc', 'expanded_url': 'https://berniesanders.com',
+                              'display_url': 'berniesanders.com', 'indices': [30, 53]}], 'symbols': []}
+        tweet = {'timestamp': 1.583e9 + i, 'text': '#SuperTuesday @BernieSanders https://t.co/abc let us go',
+                 'entities': entities, 'lang': 'en', 'retweet_count': 0, 'favorite_count': 0, 'user_id': user['id'],
+                 'coordinates': None, 'id': 10 ** 18 + i, 'user': user}
+        if i % 3 == 0:
+            tweet['quoted_status'] = copy.deepcopy(tweet)
+            tweet['quoted_status']['id'] -= 1
+        if i % 3 == 1:
+            retweeted = copy.deepcopy(tweet)
+            retweeted['id'] -= 2
+            tweet['retweeted_status'] = retweeted
+        lines.append(json.dumps(tweet).encode())
+    return lines
+
+
+def shard_lines(filenames, limit):
+    def lines():
+        for filename in filenames:
+            with open_shard(filename) as f:
+                yield from (line for line in f if line.strip())
+    return list(islice(lines(), limit))
+
+
+def held(build, lines):
+    """Bytes allocated per tweet while the tweets decoded by build are held in memory"""
+    gc.collect()
+    tracemalloc.start()
+    kept = [build(line) for line in lines]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / len(lines)
+
+
+def throughput(build, lines):
+    start = perf_counter()
+    batch = TweetBatch()
+    for line in lines:
+        try:
+            batch.add(build(line))
+        except Exception:
+            pass
+    return len(lines) / (perf_counter() - start)
+
+
+def decode_dicts(line):
+    """The old in-memory form: the line decoded and split by separate_children"""
+    return separate_children(loads(line))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('shards', nargs='*')
+    parser.add_argument('--limit', type=int, default=50000, help='Tweets to sample')
+    args = parser.parse_args()
+
+    lines = shard_lines(args.shards, args.limit) if args.shards else sample_lines(args.limit)
+    fallback = 0
+    for line in lines:
+        try:
+            Tweet.decode(line)
+        except Unmodelled:
+            fallback += 1
+    print(f'{len(lines)} tweets, {fallback} not modelled by records (these take the dict path)')
+
+    before, after = held(decode_dicts, lines), held(Tweet.decode, lines)
+    print(f'memory, dicts:    {before:>10,.0f} bytes/tweet')
+    print(f'memory, records:  {after:>10,.0f} bytes/tweet  ({before / after:.2f}x smaller)')
+
+    before = throughput(lambda line: dict_ops(loads(line)), lines)
+    after = throughput(lambda line: tweet_ops(loads(line)), lines)
+    print(f'decode to rows, dicts + Nodes: {before:>10,.0f} tweets/s')
+    print(f'decode to rows, records:       {after:>10,.0f} tweets/s  ({after / before:.2f}x)')
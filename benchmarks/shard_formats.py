@@ -0,0 +1,47 @@
+"""Compare bytes on disk and replay speed of plain and block-compressed shards.
+
+    python benchmarks/shard_formats.py Data/Primary/Tweets-3-3-20-00.jsonl [...]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import ShardReader  # noqa: E402
+from shardstore import convert, zstandard  # noqa: E402
+
+
+def replay(filename):
+    """Return (records, seconds) for reading every tweet of a shard"""
+    start = perf_counter()
+    count = sum(1 for _ in ShardReader(filename))
+    return count, perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('shards', nargs='+')
+    parser.add_argument('--block-lines', type=int, default=1000)
+    args = parser.parse_args()
+
+    codecs = ['', '.gz'] + (['.zst'] if zstandard else [])
+    totals = {codec: [0, 0, 0.0] for codec in codecs}
+    with tempfile.TemporaryDirectory() as tmp:
+        for shard in args.shards:
+            plain = os.path.join(tmp, os.path.basename(shard))
+            with open(shard, 'rb') as src, open(plain, 'wb') as dst:
+                dst.write(src.read())
+            for codec in codecs:
+                filename = convert(plain, codec, args.block_lines) if codec else plain
+                count, seconds = replay(filename)
+                totals[codec][0] += os.path.getsize(filename)
+                totals[codec][1] += count
+                totals[codec][2] += seconds
+
+    base = totals[''][0]
+    print(f"{'format':<12}{'bytes':>14}{'ratio':>8}{'records':>10}{'records/s':>12}")
+    for codec, (size, count, seconds) in totals.items():
+        print(f"{'jsonl' + codec:<12}{size:>14,}{size / base:>8.2f}{count:>10}{count / seconds:>12,.0f}")
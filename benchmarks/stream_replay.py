@@ -0,0 +1,264 @@
+"""Replay captured or synthetic tweets into graphstream.TwitterStreamListener at a controlled rate, offline.
+
+Records of the Data/Primary shards (or benchmarks/synthetic.py statuses) are turned back into Tweepy Status objects,
+with extended_tweet, retweeted_status and quoted_status as the streaming API delivers them, and handed to on_status
+on a schedule: a steady --rate, as fast as possible (--rate 0), with bursts (--burst 20x300@60 multiplies the rate by
+20 for 300 seconds starting 60 seconds in) or ramped until the capture falls behind (--find-max). Shards are written
+to a temporary directory by a real ShardWriter, also feeding a LiveLoader over the fake graph with --live.
+
+Every second a line reports the offered and written rates, on_status latency, queue depth, drops and the delay
+between a status arriving and its shard write. The summary gives the highest rate sustained without drops or a
+growing queue.
+
+    python benchmarks/stream_replay.py --rate 200 --duration 60 --burst 20x30@10
+    python benchmarks/stream_replay.py --rate 0 --duration 20
+    python benchmarks/stream_replay.py --find-max --rate 500 --step 10
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+from itertools import cycle, islice
+from time import perf_counter, sleep, time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+# The repo goes first so its modules win over benchmark scripts of the same name
+sys.path.insert(0, BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+from synthetic import SyntheticStream, TWITTER_TIME  # noqa: E402
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def twitter_time(timestamp):
+    if isinstance(timestamp, str):
+        return timestamp
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(TWITTER_TIME)
+
+
+def raw_status(record):
+    """Rebuild the streaming API JSON of a tweet from its shard record (a status_to_dict dict)"""
+    text = record.get('text') or ''
+    entities = record.get('entities') or {'hashtags': [], 'user_mentions': [], 'urls': []}
+    raw = {'created_at': twitter_time(record.get('timestamp') or 0), 'id': record['id'], 'id_str': str(record['id']),
+           'text': text[:140], 'truncated': len(text) > 140, 'entities': entities, 'lang': record.get('lang'),
+           'in_reply_to_status_id': record.get('in_reply_to_status_id'),
+           'in_reply_to_user_id': record.get('in_reply_to_user_id'), 'retweet_count': record.get('retweet_count', 0),
+           'favorite_count': record.get('favorite_count', 0), 'coordinates': record.get('coordinates'),
+           'is_quote_status': bool(record.get('quoted_status'))}
+    if len(text) > 140:
+        raw['extended_tweet'] = {'full_text': text, 'entities': entities}
+    user = dict(record.get('user') or {'id': record.get('user_id'), 'screen_name': str(record.get('user_id'))})
+    user.setdefault('followers_count', 0)
+    user.setdefault('verified', False)
+    user['created_at'] = twitter_time(user.get('created_at') or 0)
+    user.setdefault('lang', None)
+    raw['user'] = user
+    for key in ('retweeted_status', 'quoted_status'):
+        if record.get(key):
+            raw[key] = raw_status(record[key])
+    return raw
+
+
+def load_statuses(path, count, seed=0):
+    """Up to count Tweepy Status objects from the shards under path, or synthetic ones if there are none"""
+    from tweepy.models import Status
+    from ledger import ShardReader
+    from shardstore import list_shards
+    filenames = list_shards(path) if path else []
+    if filenames:
+        records = (record for filename in filenames for record in ShardReader(filename) if record and record.get('id'))
+        raws = (raw_status(record) for record in records)
+    else:
+        raws = SyntheticStream(seed)
+    return [Status.parse(None, raw) for raw in islice(raws, count)]
+
+
+def parse_burst(spec):
+    """'20x300@60' -> (60, 360, 20.0): the rate is multiplied by 20 from 60 to 360 seconds in"""
+    factor, rest = spec.split('x', 1)
+    length, start = rest.split('@', 1)
+    return float(start), float(start) + float(length), float(factor)
+
+
+class Profile:
+    """Offered tweets/s over time: a base rate, multiplied during bursts, or stepped up by ramp every step seconds"""
+
+    def __init__(self, rate, bursts=(), ramp=1.0, step=10.0):
+        self.rate = rate
+        self.bursts = bursts
+        self.ramp = ramp
+        self.step = step
+
+    def rate_at(self, t):
+        rate = self.rate * self.ramp ** int(t // self.step)
+        for start, end, factor in self.bursts:
+            if start <= t < end:
+                rate *= factor
+        return rate
+
+
+class Replay:
+    """Drives a listener with statuses following a Profile and samples the writer behind it once a second"""
+
+    def __init__(self, listener, writer, statuses, profile, live=None):
+        self.listener = listener
+        self.writer = writer
+        self.statuses = cycle(statuses)
+        self.profile = profile
+        self.live = live
+        self.seconds = []
+
+    def run(self, duration, stop=None):
+        """Offer statuses for duration seconds; stop(second) may end it early after any whole second"""
+        start = perf_counter()
+        due = 0.0
+        sent = 0
+        calls = []
+        last = self.writer.stats()
+        # on_status prints a sample of tweets, which would bury the report
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+            while True:
+                now = perf_counter() - start
+                if now >= len(self.seconds) + 1:
+                    second = self._sample(sent, calls, last)
+                    last = second.pop('_stats')
+                    sent, calls = 0, []
+                    if now >= duration or (stop and stop(second)):
+                        break
+                    continue
+                rate = self.profile.rate_at(now)
+                if rate > 0:
+                    if due > now:
+                        sleep(min(due - now, len(self.seconds) + 1 - now))
+                        continue
+                    # Behind schedule (the listener cannot keep up) the backlog is not sent in a rush
+                    due = max(due, now - 1.0) + 1.0 / rate
+                tick = perf_counter()
+                self.listener.on_status(next(self.statuses))
+                calls.append(perf_counter() - tick)
+                sent += 1
+        return self.seconds
+
+    def _sample(self, sent, calls, last):
+        stats = self.writer.stats()
+        delays = self.writer.take_delays()
+        second = {'t': len(self.seconds) + 1, 'offered': sent, 'written': stats['written'] - last['written'],
+                  'dropped': stats['dropped'] - last['dropped'], 'queue': stats['queue_depth'],
+                  'call_p50_us': (percentile(calls, 0.5) or 0) * 1e6,
+                  'call_p99_us': (percentile(calls, 0.99) or 0) * 1e6,
+                  'delay_p50_ms': (percentile(delays, 0.5) or 0) * 1e3,
+                  'delay_p99_ms': (percentile(delays, 0.99) or 0) * 1e3}
+        if self.live:
+            live = self.live.stats()
+            second['live_queue'], second['spilling'] = live['queue_depth'], live['spilling']
+        self.seconds.append(second)
+        print(' '.join(f'{name} {value:,.0f}' for name, value in second.items()), file=sys.stderr)
+        second['_stats'] = stats
+        return second
+
+
+def make_writer(path, batch_size, maxsize, live):
+    from graphstream import ShardWriter
+
+    class DelayWriter(ShardWriter):
+        """ShardWriter recording how long each status waited between on_status and its shard write"""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.delays = []
+
+        def _shard(self, received):
+            self.delays.append(time() - received)
+            return super()._shard(received)
+
+        def take_delays(self):
+            delays, self.delays = self.delays, []
+            return delays
+
+    return DelayWriter(path, maxsize=maxsize, batch_size=batch_size, live=live)
+
+
+def sustained(seconds, settle=2):
+    """Highest offered rate of a second with no drops, while the queue stayed below what one more second adds"""
+    best = 0
+    for previous, second in zip(seconds[settle - 1:], seconds[settle:]):
+        if second['dropped'] == 0 and second['queue'] <= max(previous['queue'], second['offered'] * 0.1):
+            best = max(best, min(second['offered'], second['written']))
+    return best
+
+
+def summarize(seconds, writer, elapsed):
+    stats = writer.stats()
+    print(f'{stats["received"]:,} statuses in {elapsed:.1f}s: {stats["written"]:,} written, '
+          f'{stats["dropped"]:,} dropped ({stats["dropped"] / max(stats["received"], 1):.2%})')
+    print(f'peak offered {max(s["offered"] for s in seconds):,}/s, '
+          f'peak written {max(s["written"] for s in seconds):,}/s, '
+          f'max queue depth {max(s["queue"] for s in seconds):,}')
+    print(f'on_status p99 {max(s["call_p99_us"] for s in seconds):,.0f}us, '
+          f'write delay p99 {max(s["delay_p99_ms"] for s in seconds):,.0f}ms (worst second)')
+    print(f'max sustainable: {sustained(seconds):,} tweets/s')
+    # While statuses are dropped the writer runs flat out, so what it writes then is its capacity
+    saturated = [s['written'] for s in seconds if s['dropped']]
+    if saturated:
+        print(f'writer capacity while dropping: {sum(saturated) / len(saturated):,.0f} tweets/s')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', default=os.path.join(ROOT, 'Data', 'Primary'),
+                        help='Shards to replay, synthetic statuses if there are none')
+    parser.add_argument('--statuses', type=int, default=20000, help='Distinct statuses loaded and replayed in a loop')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate', type=float, default=100.0, help='Base tweets/s, 0 for as fast as possible')
+    parser.add_argument('--burst', action='append', default=[], type=parse_burst,
+                        help='FACTORxSECONDS@START, e.g. 20x300@60; may be repeated')
+    parser.add_argument('--duration', type=float, default=60.0)
+    parser.add_argument('--find-max', action='store_true',
+                        help='Multiply the rate by --ramp every --step seconds until the capture falls behind')
+    parser.add_argument('--ramp', type=float, default=1.5)
+    parser.add_argument('--step', type=float, default=10.0)
+    parser.add_argument('--queue', type=int, default=10000, help='ShardWriter queue size')
+    parser.add_argument('--batch-size', type=int, default=500, help='ShardWriter batch size')
+    parser.add_argument('--live', action='store_true', help='Also run a LiveLoader against the fake graph')
+    parser.add_argument('--rtt', type=float, default=0.0, help='Seconds the fake graph waits per round trip')
+    args = parser.parse_args()
+
+    statuses = load_statuses(args.path, args.statuses, args.seed)
+    print(f'Replaying {len(statuses):,} statuses', file=sys.stderr)
+    import graphstream
+    with tempfile.TemporaryDirectory() as tmp:
+        live = None
+        if args.live:
+            from bulkload import BulkLoader
+            from fakegraph import RecordingGraph
+            from liveload import LiveLoader
+            live = LiveLoader(BulkLoader(RecordingGraph(args.rtt)), ledger=os.path.join(tmp, 'ledger.db'))
+            live.start()
+        writer = make_writer(tmp + os.sep, args.batch_size, args.queue, live)
+        writer.start()
+        profile = Profile(args.rate, args.burst, args.ramp if args.find_max else 1.0, args.step)
+        replay = Replay(graphstream.TwitterStreamListener(writer), writer, statuses, profile, live)
+        stop = None
+        if args.find_max:
+            # Stop once a whole step has been dropping statuses
+            stop = (lambda second: second['t'] >= args.step and
+                    all(s['dropped'] for s in replay.seconds[-int(args.step):]))
+        start = perf_counter()
+        seconds = replay.run(args.duration if not args.find_max else float('inf'), stop)
+        elapsed = perf_counter() - start
+        writer.close()
+        if live:
+            live.close()
+        summarize(seconds, writer, elapsed)
+        if live:
+            print(f'live loader: {live.stats()}')
@@ -0,0 +1,142 @@
+"""Synthetic Twitter API v1.1 statuses shaped like the candidate stream graphstream captures.
+
+The mix of retweets, quotes, replies and originals, the skew towards candidate accounts and hashtags and the entity
+counts follow what the Data/Primary shards look like. Output is deterministic for a given seed.
+"""
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+import random
+
+CANDIDATES = [(216776631, 'BernieSanders'), (357606935, 'ewarren'), (939091, 'JoeBiden'),
+              (16581604, 'MikeBloomberg'), (226222147, 'PeteButtigieg'), (2228878592, 'AndrewYang'),
+              (33537967, 'amyklobuchar'), (26637348, 'TulsiGabbard')]
+HASHTAGS = ['SuperTuesday', 'Bernie2020', 'Biden2020', 'Warren2020', 'Bloomberg2020', 'DemDebate', 'YangGang',
+            'NotMeUs', 'TeamPete', 'Amy4America', 'Vote', 'Election2020', 'DemocraticPrimary', 'Tulsi2020',
+            'MedicareForAll', 'ClimateChange', 'NevadaCaucus', 'SouthCarolina', 'BernieBeatsTrump', 'KHive']
+WORDS = ('the a to of and in is for on that this it with you be are we not have will about vote voters primary '
+         'debate candidate campaign win tonight polls delegates health care climate plan support rally people '
+         'america president state caucus results super tuesday'.split())
+DOMAINS = ['berniesanders.com', 'joebiden.com', 'elizabethwarren.com', 'nytimes.com', 'cnn.com', 'youtube.com',
+           'washingtonpost.com', 'mikebloomberg.com', 'foxnews.com', 'politico.com']
+TWITTER_TIME = '%a %b %d %H:%M:%S +0000 %Y'
+
+# Share of each kind of status in the stream
+MIX = [('retweet', 0.55), ('quote', 0.12), ('reply', 0.13), ('original', 0.20)]
+
+
+def zipf_weights(n, s=1.1):
+    return list(accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+
+class SyntheticStream:
+    """Iterator of raw status dicts, as Tweepy's Status._json holds them.
+
+    users is the size of the non-candidate population, drawn with a Zipf skew so a few thousand accounts dominate.
+    Statuses longer than 140 characters are truncated and carry an extended_tweet. rate is statuses per second of
+    simulated time, used for created_at.
+    """
+
+    def __init__(self, seed=0, users=50000, start=datetime(2020, 3, 3, 12, tzinfo=timezone.utc), rate=50.0):
+        self.random = random.Random(seed)
+        self.users = users
+        self.user_weights = zipf_weights(users)
+        self.hashtag_weights = zipf_weights(len(HASHTAGS))
+        self.candidate_weights = zipf_weights(len(CANDIDATES), 0.8)
+        self.clock = start
+        self.rate = rate
+        self.next_id = 1233000000000000000
+        self.recent = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        kind = self.random.choices([k for (k, _) in MIX], [w for (_, w) in MIX])[0]
+        self.clock += timedelta(seconds=self.random.expovariate(self.rate))
+        return self.status(kind)
+
+    def take(self, n):
+        return [next(self) for _ in range(n)]
+
+    def _id(self):
+        self.next_id += self.random.randint(1, 5000)
+        return self.next_id
+
+    def user(self, candidate=False):
+        r = self.random
+        if candidate:
+            uid, name = r.choices(CANDIDATES, cum_weights=self.candidate_weights)[0]
+            followers = 1000000 + uid % 9000000
+            verified = True
+        else:
+            rank = r.choices(range(self.users), cum_weights=self.user_weights)[0]
+            uid, name = 10 ** 9 + rank * 7919, f'voter{rank}'
+            followers = max(0, int(r.lognormvariate(5, 2)))
+            verified = False
+        created = datetime(2009, 1, 1) + timedelta(days=uid % 4000)
+        return {'id': uid, 'id_str': str(uid), 'name': name.title(), 'screen_name': name,
+                'followers_count': followers, 'friends_count': r.randint(0, 5000), 'verified': verified,
+                'statuses_count': r.randint(1, 100000), 'favourites_count': r.randint(0, 50000),
+                'created_at': created.strftime(TWITTER_TIME), 'lang': None if r.random() < 0.9 else 'en'}
+
+    def entities(self, text_length):
+        r = self.random
+        hashtags = [{'text': tag, 'indices': [i, i + len(tag) + 1]}
+                    for i, tag in enumerate(r.choices(HASHTAGS, cum_weights=self.hashtag_weights,
+                                                      k=r.choices([0, 1, 2, 3], [50, 30, 15, 5])[0]))]
+        mentions = []
+        for i in range(r.choices([0, 1, 2], [60, 30, 10])[0]):
+            user = self.user(candidate=r.random() < 0.7)
+            mentions.append({'screen_name': user['screen_name'], 'name': user['name'], 'id': user['id'],
+                             'id_str': user['id_str'], 'indices': [i, i + len(user['screen_name']) + 1]})
+        urls = []
+        if r.random() < 0.3:
+            path = r.randint(1, 10 ** 6)
+            domain = r.choice(DOMAINS)
+            urls.append({'url': f'https://t.co/{path:010x}', 'expanded_url': f'https://{domain}/{path % 5000}',
+                         'display_url': f'{domain}/{path % 5000}', 'indices': [text_length - 23, text_length]})
+        return {'hashtags': hashtags, 'user_mentions': mentions, 'urls': urls, 'symbols': []}
+
+    def text(self, entities, prefix=''):
+        words = self.random.choices(WORDS, k=self.random.randint(5, 40))
+        tags = [f"#{tag['text']}" for tag in entities['hashtags']]
+        mentions = [f"@{mention['screen_name']}" for mention in entities['user_mentions']]
+        links = [url['url'] for url in entities['urls']]
+        return prefix + ' '.join(mentions + words + tags + links)
+
+    def status(self, kind, depth=0):
+        r = self.random
+        user = self.user(candidate=depth > 0 and r.random() < 0.6)
+        entities = self.entities(140)
+        text = self.text(entities)
+        status = {'created_at': self.clock.strftime(TWITTER_TIME), 'id': self._id(), 'text': text[:140],
+                  'truncated': False, 'entities': entities, 'lang': 'en' if r.random() < 0.97 else 'es',
+                  'in_reply_to_status_id': None, 'in_reply_to_user_id': None, 'retweet_count': 0,
+                  'favorite_count': 0, 'coordinates': None, 'is_quote_status': False, 'user': user}
+        status['id_str'] = str(status['id'])
+        if len(text) > 140:
+            status['truncated'] = True
+            status['extended_tweet'] = {'full_text': text, 'entities': entities}
+        if depth > 0:
+            status['created_at'] = (self.clock - timedelta(minutes=r.randint(1, 600))).strftime(TWITTER_TIME)
+            status['retweet_count'] = r.randint(0, 20000)
+            status['favorite_count'] = r.randint(0, 80000)
+            self.recent.append((status['id'], user['id']))
+            del self.recent[:-1000]
+            return status
+        if kind == 'retweet':
+            original = self.status('original', 1)
+            status['retweeted_status'] = original
+            status['text'] = f"RT @{original['user']['screen_name']}: {original['text']}"[:140]
+            status['entities'] = original['entities']
+            if r.random() < 0.1:
+                quoted = self.status('original', 1)
+                original['quoted_status'] = quoted
+                original['is_quote_status'] = True
+                status['quoted_status'] = quoted
+        elif kind == 'quote':
+            status['quoted_status'] = self.status('original', 1)
+            status['is_quote_status'] = True
+        elif kind == 'reply' and self.recent:
+            status['in_reply_to_status_id'], status['in_reply_to_user_id'] = r.choice(self.recent)
+        return status
@@ -0,0 +1,72 @@
+"""Time textclean.clean against the six re.sub calls strip_tweets used to make, and check they agree.
+
+    python benchmarks/text_cleaning.py Data/Primary/Tweets-3-3-20-00.jsonl [...]
+"""
+import argparse
+import os
+import re
+import sys
+from itertools import islice
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import ShardReader  # noqa: E402
+from textclean import clean  # noqa: E402
+
+SAMPLE = ['RT @BernieSanders: We are going to win #SuperTuesday https://t.co/abc123XYZ',
+          '@JoeBiden @ewarren what a night for #Biden2020 and #Warren https://t.co/q1w2e3 …',
+          'Mike Bloomberg just spent another $500 million http://bloom.bg/2vXy #Bloomberg2020',
+          'RT: @AndrewYang: #YangGang forever! Watch live https://www.youtube.com/watch?v=x',
+          'pic.twitter.com/abcdef']
+
+
+def legacy_strip_tweets(tweet):
+    """strip_tweets as it was in get_sentiment before textclean"""
+    retweet = r'RT:? ?@\w+:?'
+    tweet = re.sub(retweet, '', tweet)
+    mention = r'@\w+'
+    tweet = re.sub(mention, '', tweet)
+    links = (r'^(http:\/\/www\.|https:\/\/www\.|http:\/\/|https:\/\/)?'
+             r'[a-z0-9]+([\-\.]{1}[a-z0-9]+)*\.[a-z]{2,5}(:[0-9]{1,5})?(\/.*)?$')
+    tweet = re.sub(links, '', tweet)
+    tweet_links = r'https:\/\/t\.co\/\w+|http:\/\/t\.co\/\w+'
+    tweet = re.sub(tweet_links, '', tweet)
+    tweet_link = r'http\S+'
+    tweet = re.sub(tweet_link, '', tweet)
+    hashtag = r'#\w+'
+    hashtags = re.findall(hashtag, tweet)
+    tweet = re.sub(hashtag, '', tweet)
+    return tweet, hashtags
+
+
+def timed(fn, texts, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            fn(text)
+    return (perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('shards', nargs='*')
+    parser.add_argument('--limit', type=int, default=100000, help='Tweets to sample')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.shards:
+        records = (record for shard in args.shards for record in ShardReader(shard))
+        texts = [record['text'] for record in islice((r for r in records if r.get('text')), args.limit)]
+    else:
+        texts = SAMPLE * (args.limit // len(SAMPLE))
+
+    before = timed(legacy_strip_tweets, texts, args.repeat)
+    after = timed(clean, texts, args.repeat)
+    differ = [text for text in texts if legacy_strip_tweets(text) != tuple(clean(text)[:2])]
+    print(f'{len(texts)} tweets')
+    print(f'legacy strip_tweets: {len(texts) / before:>12,.0f} tweets/s')
+    print(f'textclean.clean:     {len(texts) / after:>12,.0f} tweets/s  ({before / after:.2f}x)')
+    print(f'{len(differ)} tweets cleaned differently')
+    for text in differ[:5]:
+        print(f'  {text!r}: {legacy_strip_tweets(text)} != {tuple(clean(text)[:2])}')
@@ -0,0 +1,73 @@
+"""Time CachedTokenizer against process_tweet as it used to be, in tokens/s, and check they agree.
+
+    python benchmarks/tokenizer.py Data/Primary/Tweets-3-3-20-00.jsonl [...] --workers 4
+"""
+import argparse
+import os
+import string
+import sys
+from itertools import islice
+from time import perf_counter
+
+import nltk
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import ShardReader  # noqa: E402
+from textclean import strip  # noqa: E402
+from tokenizer import CachedTokenizer  # noqa: E402
+
+SAMPLE = ['RT @BernieSanders: We are going to win #SuperTuesday https://t.co/abc123XYZ',
+          '@JoeBiden @ewarren what a night for the voters of Virginia and Texas',
+          'Mike Bloomberg just spent another $500 million on ads http://bloom.bg/2vXy #Bloomberg2020',
+          "The debates aren't helping anyone, candidates keep talking over each other"]
+
+lemmatizer = WordNetLemmatizer()
+
+
+def legacy_process_tweet(tweet):
+    """process_tweet as it was in get_sentiment before CachedTokenizer"""
+    stopwords_list = stopwords.words('english') + list(string.punctuation)
+    stopwords_list += ["'", '"', '...', '``', '…', '’', '‘', '“', "''", '""', '”', '”', 'co', "'s'", '\'s', 'n\'t',
+                       '\'m', '\'re', 'amp', 'https']
+    tokens = nltk.word_tokenize(tweet)
+    return [lemmatizer.lemmatize(token).lower() for token in tokens if token not in stopwords_list]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('shards', nargs='*')
+    parser.add_argument('--limit', type=int, default=20000, help='Tweets to sample')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.shards:
+        records = (record for shard in args.shards for record in ShardReader(shard))
+        texts = [record['text'] for record in islice((r for r in records if r.get('text')), args.limit)]
+    else:
+        texts = SAMPLE * (args.limit // len(SAMPLE))
+    texts = [strip(text.lower()) for text in texts]
+
+    start = perf_counter()
+    before = [legacy_process_tweet(text) for text in texts]
+    legacy = perf_counter() - start
+
+    tokenizer = CachedTokenizer()
+    tokenizer.process(texts[0])  # Load the corpora outside the timing, as the legacy version does at import
+    start = perf_counter()
+    after = [tokenizer.process(text) for text in texts]
+    cached = perf_counter() - start
+
+    start = perf_counter()
+    pooled = tokenizer.tokenized(texts, workers=args.workers)
+    parallel = perf_counter() - start
+
+    tokens = sum(len(words) for words in before)
+    print(f'{len(texts)} tweets, {tokens} tokens')
+    print(f'legacy process_tweet:     {tokens / legacy:>12,.0f} tokens/s')
+    print(f'CachedTokenizer.process:  {tokens / cached:>12,.0f} tokens/s  ({legacy / cached:.2f}x)')
+    print(f'tokenized, {args.workers} workers:     {tokens / parallel:>12,.0f} tokens/s  ({legacy / parallel:.2f}x)')
+    print(f'cache: {tokenizer.cache_info()}')
+    print(f'{sum(a != b for (a, b) in zip(before, after))} tweets tokenized differently')
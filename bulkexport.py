@@ -0,0 +1,207 @@
+from collections import defaultdict
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+
+from bulkload import TweetBatch, tweet_ops
+from graphprocess import CONSTRAINTS
+from ledger import ShardReader
+from shardstore import list_shards
+
+logging.basicConfig(filename='neo4j_errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
+
+STAGING = ['''CREATE TABLE IF NOT EXISTS nodes (label TEXT, value, props TEXT, PRIMARY KEY (label, value))
+              WITHOUT ROWID''',
+           '''CREATE TABLE IF NOT EXISTS labels (label TEXT, value, extra TEXT, PRIMARY KEY (label, value, extra))
+              WITHOUT ROWID''',
+           '''CREATE TABLE IF NOT EXISTS rels (type TEXT, slabel TEXT, src, elabel TEXT, dst, props TEXT,
+              PRIMARY KEY (type, slabel, src, elabel, dst)) WITHOUT ROWID''',
+           '''CREATE TABLE IF NOT EXISTS counts (type TEXT, slabel TEXT, src, elabel TEXT, dst, count INTEGER,
+              PRIMARY KEY (type, slabel, src, elabel, dst)) WITHOUT ROWID''']
+NODE_UPSERT = '''INSERT INTO nodes VALUES (?, ?, ?) ON CONFLICT (label, value)
+                 DO UPDATE SET props = json_patch(props, excluded.props)'''
+LABEL_INSERT = '''INSERT OR IGNORE INTO labels VALUES (?, ?, ?)'''
+REL_UPSERT = '''INSERT INTO rels VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (type, slabel, src, elabel, dst) DO UPDATE SET props = excluded.props'''
+COUNT_UPSERT = '''INSERT INTO counts VALUES (?, ?, ?, ?, ?, ?)
+                  ON CONFLICT (type, slabel, src, elabel, dst) DO UPDATE SET count = count + excluded.count'''
+
+# neo4j-admin import type of each Python property type
+NEO4J_TYPES = {bool: 'boolean', int: 'long', float: 'double', str: 'string'}
+KEYS = dict(CONSTRAINTS)
+
+
+def column_type(types):
+    """neo4j-admin type for a property seen with the given set of Python types"""
+    if types <= {int}:
+        return 'long'
+    if types <= {int, float}:
+        return 'double'
+    if len(types) == 1:
+        return NEO4J_TYPES.get(next(iter(types)), 'string')
+    return 'string'
+
+
+def csv_value(value, kind):
+    """Format a property for a neo4j-admin field; missing values stay empty so no property is set"""
+    if value is None:
+        return ''
+    if kind == 'boolean':
+        return 'true' if value else 'false'
+    if kind == 'string':
+        return str(value)
+    return repr(float(value)) if kind == 'double' else str(value)
+
+
+class Exporter:
+    """Turns jsonl shards into the node and relationship CSVs `neo4j-admin import` takes, for initial loads and
+    rebuilds far faster than MERGEs.
+
+    Tweets go through the same tweet_ops as BulkLoader and push_tweet and are collected in TweetBatches, then staged
+    into an on-disk SQLite database keyed by primary key: node properties are merged (like `SET n += props`),
+    relationship properties keep the last write, extra labels are unioned and RETWEETS/BROADCASTS counts summed.
+    Memory is bounded by one batch and SQLite's page cache however many shards are exported; the CSVs are then
+    streamed out of the staging tables.
+    """
+
+    def __init__(self, out='Data/import/', staging=None, batch_size=20000, cache_mb=256):
+        self.out = out
+        os.makedirs(out, exist_ok=True)
+        self.staging = staging or os.path.join(out, 'staging.db')
+        # Staged counts are sums, so every export starts from scratch
+        if os.path.exists(self.staging):
+            os.remove(self.staging)
+        self.conn = sqlite3.connect(self.staging)
+        self.conn.execute('PRAGMA journal_mode = OFF')
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute(f'PRAGMA cache_size = -{cache_mb * 1024}')
+        for statement in STAGING:
+            self.conn.execute(statement)
+        self.batch_size = batch_size
+        self.batch = TweetBatch()
+        # Property name -> set of Python types, per label and per relationship group
+        self.node_types = defaultdict(lambda: defaultdict(set))
+        self.rel_types = defaultdict(lambda: defaultdict(set))
+        self.counters = set()
+        self.tweets = 0
+        self.errors = 0
+
+    def add(self, tweetdict):
+        try:
+            self.batch.add(tweet_ops(tweetdict))
+        except Exception as e:
+            self.errors += 1
+            logging.error(f'Error on export: {e}. Tweet: \n {tweetdict}')
+            return
+        self.tweets += 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def add_shards(self, filenames):
+        """Stage every tweet of the shards, in order so later writes win as they would have live"""
+        for filename in filenames:
+            for line in ShardReader(filename):
+                self.add(line)
+            print(f'{filename} staged, {self.tweets} tweets so far.')
+        self.flush()
+
+    def flush(self):
+        """Merge the pending batch into the staging tables"""
+        batch, self.batch = self.batch, TweetBatch()
+        with self.conn:
+            for (label, _), rows in batch.nodes.items():
+                types = self.node_types[label]
+                for props in rows.values():
+                    for name, value in props.items():
+                        types[name].add(type(value))
+                self.conn.executemany(NODE_UPSERT, ((label, value, json.dumps(props)) for value, props in rows.items()))
+            for (label, _, extra), values in batch.labels.items():
+                self.conn.executemany(LABEL_INSERT, ((label, value, extra) for value in values))
+            for (rtype, (slabel, _), (elabel, _)), rows in batch.rels.items():
+                types = self.rel_types[(rtype, slabel, elabel)]
+                for props in rows.values():
+                    for name, value in props.items():
+                        types[name].add(type(value))
+                self.conn.executemany(REL_UPSERT, ((rtype, slabel, src, elabel, dst, json.dumps(props))
+                                                   for (src, dst), props in rows.items()))
+            for (rtype, (slabel, _), (elabel, _)), pairs in batch.counts.items():
+                self.counters.add((rtype, slabel, elabel))
+                self.rel_types[(rtype, slabel, elabel)]['count'].add(int)
+                self.conn.executemany(COUNT_UPSERT, ((rtype, slabel, src, elabel, dst, n)
+                                                     for (src, dst), n in pairs.items()))
+
+    def write(self):
+        """Write one CSV per node label and per relationship type and end labels. Returns the file names."""
+        files = {'nodes': [], 'relationships': []}
+        for label, types in self.node_types.items():
+            key = KEYS[label]
+            names = [key] + sorted(name for name in types if name != key)
+            kinds = [column_type(types[name]) for name in names]
+            filename = os.path.join(self.out, f'nodes_{label}.csv')
+            rows = self.conn.execute('''SELECT n.value, n.props, group_concat(l.extra, ';') FROM nodes n
+                                        LEFT JOIN labels l ON l.label = n.label AND l.value = n.value
+                                        WHERE n.label = ? GROUP BY n.value''', (label,))
+            with open(filename, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow([f':ID({label})'] + [f'{name}:{kind}' for name, kind in zip(names, kinds)] + [':LABEL'])
+                for value, props, extra in rows:
+                    props = json.loads(props)
+                    writer.writerow([value] + [csv_value(props.get(name), kind) for name, kind in zip(names, kinds)] +
+                                    [label + (';' + extra if extra else '')])
+            files['nodes'].append(filename)
+        for (rtype, slabel, elabel), types in self.rel_types.items():
+            names = sorted(types)
+            kinds = [column_type(types[name]) for name in names]
+            filename = os.path.join(self.out, f'rels_{rtype}_{slabel}_{elabel}.csv')
+            if (rtype, slabel, elabel) in self.counters:
+                rows = self.conn.execute('''SELECT src, dst, count FROM counts
+                                            WHERE type = ? AND slabel = ? AND elabel = ?''', (rtype, slabel, elabel))
+                rows = ((src, dst, {'count': n}) for src, dst, n in rows)
+            else:
+                rows = self.conn.execute('''SELECT src, dst, props FROM rels
+                                            WHERE type = ? AND slabel = ? AND elabel = ?''', (rtype, slabel, elabel))
+                rows = ((src, dst, json.loads(props)) for src, dst, props in rows)
+            with open(filename, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow([f':START_ID({slabel})', f':END_ID({elabel})', ':TYPE'] +
+                                [f'{name}:{kind}' for name, kind in zip(names, kinds)])
+                for src, dst, props in rows:
+                    writer.writerow([src, dst, rtype] + [csv_value(props.get(name), kind)
+                                                         for name, kind in zip(names, kinds)])
+            files['relationships'].append(filename)
+        return files
+
+    def close(self, keep_staging=False):
+        self.conn.close()
+        if not keep_staging:
+            os.remove(self.staging)
+
+
+def import_command(files, database='neo4j'):
+    """The neo4j-admin import invocation for the exported files"""
+    args = [f'--nodes={filename}' for filename in files['nodes']]
+    args += [f'--relationships={filename}' for filename in files['relationships']]
+    return ' '.join(['neo4j-admin import', f'--database={database}', '--multiline-fields=true'] + args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export jsonl shards as CSVs for neo4j-admin import.')
+    parser.add_argument('--path', default='Data/Primary/')
+    parser.add_argument('--out', default='Data/import/')
+    parser.add_argument('--staging', help='SQLite file to stage nodes in, defaults to staging.db in --out')
+    parser.add_argument('--batch-size', type=int, default=20000, help='Tweets deduplicated in memory per flush')
+    parser.add_argument('--cache-mb', type=int, default=256, help='SQLite page cache for staging')
+    parser.add_argument('--database', default='neo4j')
+    parser.add_argument('--keep-staging', action='store_true')
+    args = parser.parse_args()
+
+    exporter = Exporter(args.out, args.staging, args.batch_size, args.cache_mb)
+    exporter.add_shards(list_shards(args.path))
+    files = exporter.write()
+    exporter.close(args.keep_staging)
+    print(f'{exporter.tweets} tweets exported, {exporter.errors} failed.')
+    print('Import into an empty database, then run graphprocess or ingest once to create the constraints:')
+    print(import_command(files, args.database))
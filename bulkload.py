@@ -0,0 +1,340 @@
+from collections import Counter
+from time import monotonic
+from zlib import crc32
+import logging
+
+from graphprocess import (separate_children, ent_parser, user_dtn, dict_to_node, pair_order, count_statements,
+                          RETWEETS, BROADCASTS_USER, BROADCASTS_HASHTAG)
+from metrics import stage, timed
+from records import ABSENT, Tweet, Unmodelled
+
+logging.basicConfig(filename='neo4j_errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
+
+NODE_QUERY = "UNWIND $rows AS row MERGE (n:{label} {{{key}: row.key}}) SET n += row.props"
+LABEL_QUERY = "UNWIND $rows AS row MATCH (n:{label} {{{key}: row}}) SET n:{extra}"
+REL_QUERY = "UNWIND $rows AS row MATCH (a:{slabel} {{{skey}: row.src}}) MATCH (b:{elabel} {{{ekey}: row.dst}}) " \
+            "MERGE (a)-[r:{rtype}]->(b) SET r = row.props"
+SENTIMENT_QUERY = "UNWIND $rows AS row MATCH (t:Tweet {id: row.id}) " \
+                  "SET t.sentiment = row.sentiment, t.embedding = row.embedding"
+QTWEET = frozenset(['Qtweet'])
+
+
+def node_row(label, key, props, extra=frozenset()):
+    """Return a ('node', label, key, value, properties, extra labels) write for properties ready to store"""
+    if props.get(key) is None:
+        raise ValueError(f'{label} node has no value for primary key {key}')
+    return 'node', label, key, props[key], props, extra
+
+
+def node_op(node, primary_key='id'):
+    """Return the node write for a Node built by graphprocess"""
+    label = node.__primarylabel__
+    return node_row(label, node.__primarykey__ or primary_key, dict(node), frozenset(node.labels) - {label})
+
+
+def rel_props(**props):
+    """Drop missing values the same way py2neo does when building a Relationship"""
+    return {k: v for (k, v) in props.items() if v is not None}
+
+
+def tweeted_props(user, tweet):
+    """Properties of the TWEETS relationship between the node writes of a user and their tweet"""
+    uprops, tprops = user[4], tweet[4]
+    return rel_props(timestamp=tprops.get('timestamp'), created_at=tprops.get('created_at'),
+                     usrStatusCount=uprops.get('statuses_count'), usrFollowerCount=uprops.get('followers_count'),
+                     usrFavoritesCount=uprops.get('favourites_count'))
+
+
+def ref(op):
+    """(label, key, value) reference to the node of a node write"""
+    return op[1:4]
+
+
+def status_ops(user, tweet=None, ents=(), retweet=None, rtuser=None, rents=(), quoted=None, qtuser=None, qents=()):
+    """Return the ordered writes push_tweet makes given the node writes of a tweet, its user and the retweeted or
+    quoted status with its user. Entities are lists of (label, [node writes]) as ent_parser groups them."""
+    if retweet is not None:
+        ops = [user, rtuser, retweet, ('rel', 'TWEETS', ref(rtuser), ref(retweet), tweeted_props(rtuser, retweet)),
+               ('count', RETWEETS, ref(user), ref(rtuser))]
+        for label, entities in rents:
+            for entity in entities:
+                ops += [entity, ('rel', 'CONTAINS', ref(retweet), ref(entity), {})]
+                if label == 'User':
+                    ops.append(('count', BROADCASTS_USER, ref(rtuser), ref(entity)))
+                elif label == 'Hashtag':
+                    ops.append(('count', BROADCASTS_HASHTAG, ref(rtuser), ref(entity)))
+        return ops
+
+    ops = [tweet, user, ('rel', 'TWEETS', ref(user), ref(tweet), tweeted_props(user, tweet))]
+    sources = [(tweet, ents)]
+    if quoted is not None:
+        tprops, qprops, qtuprops = tweet[4], quoted[4], qtuser[4]
+        ops += [qtuser, quoted, ('rel', 'TWEETS', ref(qtuser), ref(quoted), tweeted_props(qtuser, quoted)),
+                ('rel', 'QUOTES', ref(tweet), ref(quoted),
+                 rel_props(timestamp=tprops.get('timestamp'), favcount=qprops.get('favourites_count'),
+                           replyCount=qprops.get('reply_count'), sourceFollowers=qtuprops.get('followers_count'),
+                           createdAt=tprops.get('created_at'), retweetCount=qprops.get('retweet_count'),
+                           quoteCount=qprops.get('quote_count')))]
+        sources.append((quoted, qents))
+    for source, groups in sources:
+        for label, entities in groups:
+            for entity in entities:
+                ops += [entity, ('rel', 'CONTAINS', ref(source), ref(entity), {})]
+    return ops
+
+
+def entity_ops(ents):
+    """Node writes of an entities dict, grouped by label like ent_parser"""
+    return [(label, [node_op(entity) for entity in entities]) for (label, entities) in ent_parser(ents).items()]
+
+
+def dict_ops(tweetdict):
+    """tweet_ops through separate_children and py2neo Nodes, as push_tweet builds them. Consumes tweetdict."""
+    dicts = separate_children(tweetdict)
+
+    # Handles case where tweet was deleted (may be deprecated)
+    if not isinstance(dicts['user'], dict):
+        gaffer = node_op(user_dtn(dicts['tweet']['delete']['status']))
+        regret = node_op(dict_to_node(dicts['tweet']['delete']['status'], 'Tweet'))
+        return [gaffer, regret, ('rel', 'DELETES', ref(gaffer), ref(regret),
+                                 rel_props(timestamp=dicts['tweet']['delete']['timestamp_ms']))]
+
+    user = node_op(user_dtn(dicts['user']))
+    if 'retweeted' in dicts.keys():
+        return status_ops(user, retweet=node_op(dict_to_node(dicts['retweeted'], 'Tweet')),
+                          rtuser=node_op(user_dtn(dicts['rtuser'])), rents=entity_ops(dicts['rents']))
+    elif 'quoted' in dicts.keys():
+        tweetnode = dict_to_node(dicts['tweet'], 'Tweet')
+        tweetnode.add_label('Qtweet')
+        return status_ops(user, node_op(tweetnode), entity_ops(dicts['ents']),
+                          quoted=node_op(dict_to_node(dicts['quoted'], 'Tweet')),
+                          qtuser=node_op(user_dtn(dicts['qtuser'])), qents=entity_ops(dicts['qents']))
+    return status_ops(user, node_op(dict_to_node(dicts['tweet'], 'Tweet')), entity_ops(dicts['ents']))
+
+
+def record_ops(record):
+    """tweet_ops for a records.Tweet, building parameter rows straight from its slots"""
+    def entities(groups):
+        return [(label, [node_row(e.label, e.key, e.props) for e in items]) for (label, items) in groups]
+
+    user = node_row('User', 'id', record.user.props())
+    if record.retweeted is not ABSENT:
+        retweet = record.retweeted
+        return status_ops(user, retweet=node_row('Tweet', 'id', retweet.props()),
+                          rtuser=node_row('User', 'id', retweet.user.props()), rents=entities(retweet.entities))
+    elif record.quoted is not ABSENT:
+        quoted = record.quoted
+        return status_ops(user, node_row('Tweet', 'id', record.props(), QTWEET), entities(record.entities),
+                          quoted=node_row('Tweet', 'id', quoted.props()),
+                          qtuser=node_row('User', 'id', quoted.user.props()), qents=entities(quoted.entities))
+    return status_ops(user, node_row('Tweet', 'id', record.props()), entities(record.entities))
+
+
+def tweet_ops(tweetdict):
+    """Take tweet dict and return the ordered list of node, relationship and counter writes push_tweet makes for it
+
+    Writes are tuples of ('node', label, key, value, props, extra_labels), ('rel', type, start, end, props) or
+    ('count', counter, start, end) where start and end are (label, key, value) references and counter is one of
+    graphprocess' RETWEETS, BROADCASTS_USER or BROADCASTS_HASHTAG. Lines are decoded into slotted records.Tweet
+    objects; deletes and other shapes the records don't model go through dict_ops, which consumes tweetdict.
+    """
+    try:
+        record = Tweet.from_dict(tweetdict)
+    except Unmodelled:
+        return dict_ops(tweetdict)
+    return record_ops(record)
+
+
+class TweetBatch:
+    """Collects the writes of many tweets into UNWIND parameter lists.
+
+    Nodes are deduplicated on their keys with their properties merged, the last write of each property winning as in
+    a sequence of `SET n += props`, so properties written outside the batch (sentiment scores, influence) are kept.
+    Relationships keep their last write and counter increments are summed per (start, end) pair.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.nodes = {}
+        self.labels = {}
+        self.rels = {}
+        self.counts = {}
+        self.scores = []
+
+    def __len__(self):
+        return self.size
+
+    def add(self, ops):
+        """Add the writes of a single tweet as returned by tweet_ops"""
+        for op in ops:
+            if op[0] == 'node':
+                _, label, key, value, props, extra = op
+                rows = self.nodes.setdefault((label, key), {})
+                rows[value] = {**rows[value], **props} if value in rows else props
+                for name in extra:
+                    self.labels.setdefault((label, key, name), set()).add(value)
+            elif op[0] == 'rel':
+                _, rtype, start, end, props = op
+                self.rels.setdefault((rtype, start[:2], end[:2]), {})[(start[2], end[2])] = props
+            else:
+                _, counter, start, end = op
+                self.counts.setdefault(counter, Counter())[(start[2], end[2])] += 1
+        self.size += 1
+
+    def score(self, scorer):
+        """Score the text of every Tweet node in the batch with a sentiment.SentimentScorer"""
+        tweets = self.nodes.get(('Tweet', 'id'), {})
+        self.scores = scorer.score((t_id, props['text']) for (t_id, props) in tweets.items() if props.get('text'))
+
+    def skip_cached(self, cache):
+        """Drop node writes a nodecache.NodeCache says the graph already has with the same properties.
+
+        Call after score(), which reads the Tweet nodes. Returns the entries to cache.record() once the remaining
+        nodes have committed.
+        """
+        written = []
+        for group, rows in list(self.nodes.items()):
+            for value, props in list(rows.items()):
+                fingerprint = cache.stale(group[0], value, props)
+                if fingerprint is None:
+                    del rows[value]
+                else:
+                    written.append((group[0], value, fingerprint))
+            if not rows:
+                del self.nodes[group]
+        return written
+
+    def node_statements(self):
+        """Yield (query, rows) pairs that write the nodes, labels and sentiment scores of the batch"""
+        for (label, key), rows in self.nodes.items():
+            yield NODE_QUERY.format(label=label, key=key), [{'key': k, 'props': v} for (k, v) in rows.items()]
+        for (label, key, extra), values in self.labels.items():
+            yield LABEL_QUERY.format(label=label, key=key, extra=extra), list(values)
+        # Written after the nodes, which the MATCH must find
+        if self.scores:
+            yield SENTIMENT_QUERY, self.scores
+
+    def rel_statements(self, counters=True):
+        """Yield (query, rows) pairs that write relationships and, unless counters is False, counters, sorted so
+        locks are taken in key order"""
+        for (rtype, (slabel, skey), (elabel, ekey)), rows in self.rels.items():
+            yield REL_QUERY.format(rtype=rtype, slabel=slabel, skey=skey, elabel=elabel, ekey=ekey), \
+                [{'src': s, 'dst': d, 'props': v} for ((s, d), v) in sorted(rows.items(), key=pair_order)]
+        if counters:
+            yield from self.counter_statements()
+
+    def counter_statements(self):
+        """Yield (query, rows) pairs that add the batch's increments onto counter relationships. Unlike the other
+        writes these are not idempotent, so running them twice counts the batch twice."""
+        yield from count_statements(self.counts)
+
+    def statements(self):
+        """Yield (query, rows) pairs that write the batch; nodes first so relationship MATCHes find them"""
+        yield from self.node_statements()
+        yield from self.rel_statements()
+
+    def split(self, n):
+        """Partition the batch into n batches by primary key: nodes by their own key, relationships by start node"""
+        parts = [TweetBatch() for _ in range(n)]
+
+        def shard(label, value):
+            return parts[crc32(f'{label}:{value}'.encode()) % n]
+
+        for (label, key), rows in self.nodes.items():
+            for value, props in rows.items():
+                shard(label, value).nodes.setdefault((label, key), {})[value] = props
+        for group, values in self.labels.items():
+            for value in values:
+                shard(group[0], value).labels.setdefault(group, set()).add(value)
+        for group, rows in self.rels.items():
+            for (src, dst), props in rows.items():
+                shard(group[1][0], src).rels.setdefault(group, {})[(src, dst)] = props
+        for group, counts in self.counts.items():
+            for (src, dst), count in counts.items():
+                shard(group[1][0], src).counts.setdefault(group, Counter())[(src, dst)] = count
+        for row in self.scores:
+            shard('Tweet', row['id']).scores.append(row)
+        for part in parts:
+            part.size = self.size
+        return parts
+
+
+class BulkLoader:
+    """Drop-in replacement for push_tweet that writes tweets to the graph in batches.
+
+    A batch is flushed in a single transaction once it holds batch_size tweets or its oldest tweet has waited
+    flush_interval seconds (checked as tweets arrive). With a sentiment.SentimentScorer every Tweet node is scored
+    before it is written. With a nodecache.NodeCache nodes already written with the same properties are skipped.
+    Use as a context manager or call close() to flush the rest.
+    """
+
+    def __init__(self, graph, batch_size=500, flush_interval=5.0, scorer=None, cache=None):
+        self.graph = graph
+        self.scorer = scorer
+        self.cache = cache
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batch = TweetBatch()
+        self.started = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @timed('bulk_push')
+    def push(self, tweetdict):
+        """Queue a tweet dict and return its text (or True for deletes) like push_tweet"""
+        text = self.add(tweetdict)
+        if self.due():
+            self.flush()
+        return text
+
+    def add(self, tweetdict):
+        """Queue a tweet dict without flushing, leaving it to the caller to flush() when due()"""
+        try:
+            ops = tweet_ops(tweetdict)
+        except Exception as e:
+            logging.error(f'Error on push: {e}. Tweet: \n {tweetdict}')
+            raise
+        if self.started is None:
+            self.started = monotonic()
+        self.batch.add(ops)
+        return tweetdict.get('text', True)
+
+    def due(self):
+        """True once the pending batch is full or its oldest tweet has waited flush_interval seconds"""
+        return self.started is not None and (len(self.batch) >= self.batch_size or
+                                             monotonic() - self.started >= self.flush_interval)
+
+    def flush(self):
+        """Write the pending batch in one transaction. If it fails the batch is kept, to be retried by the next
+        flush() or dropped with discard()."""
+        if not len(self.batch):
+            return
+        batch = self.batch
+        try:
+            if self.scorer:
+                batch.score(self.scorer)
+            written = batch.skip_cached(self.cache) if self.cache is not None else []
+            stage('neo4j_write')(self.write, batch)
+        except Exception as e:
+            logging.error(f'Error on flush of {len(batch)} tweets: {e}')
+            raise
+        self.discard()
+        if self.cache is not None:
+            self.cache.record(written)
+
+    def discard(self):
+        """Drop the pending batch, e.g. when the caller will load its tweets again from the shards"""
+        self.batch, self.started = TweetBatch(), None
+
+    def write(self, batch):
+        tx = self.graph.begin()
+        for query, rows in batch.statements():
+            tx.run(query, rows=rows)
+        tx.commit()
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,127 @@
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+import argparse
+import json
+import os
+
+# Bump when the look of the clouds changes so every cached PNG is rendered again
+STYLE = 1
+MANIFEST = '.clouds.json'
+
+
+def top_frequencies(frequencies, top=200):
+    """The top words of a {word: count} dict (or (word, count) pairs), highest first, ties by word"""
+    items = frequencies.items() if isinstance(frequencies, dict) else frequencies
+    return sorted(((str(word), float(count)) for word, count in items if count > 0),
+                  key=lambda item: (-item[1], item[0]))[:top]
+
+
+def cloud_key(frequencies, title, top, size):
+    """Content hash of everything that decides what a cloud looks like"""
+    content = json.dumps([STYLE, top, list(size), title, frequencies], ensure_ascii=False)
+    return sha256(content.encode('utf-8')).hexdigest()
+
+
+def make_cloud(frequencies, top=200, size=(800, 400)):
+    """WordCloud laid out from frequencies in the style of create_wordcloud, the same every time for the same input"""
+    from wordcloud import WordCloud
+    cloud = WordCloud(background_color='coral', max_words=top, colormap='Blues', width=size[0], height=size[1],
+                      random_state=0)
+    return cloud.generate_from_frequencies(dict(frequencies))
+
+
+def plot(axes, cloud, tag=False):
+    """Show a cloud on matplotlib axes, titled as create_wordcloud does"""
+    axes.imshow(cloud, interpolation='bilinear')
+    if tag:
+        axes.set_title(f'Most Common words for {tag}')
+    else:
+        axes.set_title('Most Common Words', size='40', pad=20)
+    axes.axis('off')
+
+
+def draw(cloud, tag=False):
+    """Plot a cloud on a new pyplot figure, e.g. in a notebook, and return the figure"""
+    import matplotlib.pyplot as plt
+    figure = plt.figure(figsize=(24, 12))
+    plot(figure.gca(), cloud, tag)
+    return figure
+
+
+def _render(args):
+    """Render one cloud to a PNG on a figure of its own, leaving pyplot and its backend alone (it may run in the
+    caller's process)"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    filename, frequencies, title, top, size = args
+    figure = Figure(figsize=(24, 12))
+    FigureCanvasAgg(figure)
+    plot(figure.add_subplot(), make_cloud(frequencies, top, size), title)
+    figure.savefig(filename + '.tmp.png', bbox_inches='tight')
+    os.replace(filename + '.tmp.png', filename)
+    return filename
+
+
+def render_clouds(clouds, out='plots/', prefix='Cloud', workers=4, top=200, size=(800, 400), force=False):
+    """Render {name: frequencies} to out/{prefix}{name}.png across a process pool. Returns {name: filename}.
+
+    frequencies are {word: count} dicts or (word, count) pairs such as WordCounter.most_common and
+    aggregates.read_terms return, titled with the name. A PNG is only rendered again when its top words, counts or
+    settings have changed since it was written, as recorded by content hash in the out directory's .clouds.json.
+    """
+    os.makedirs(out, exist_ok=True)
+    manifest_file = os.path.join(out, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    jobs = []
+    keys = {}
+    files = {}
+    for name, frequencies in clouds.items():
+        frequencies = top_frequencies(frequencies, top)
+        filename = os.path.join(out, f'{prefix}{name}.png')
+        files[name] = filename
+        key = cloud_key(frequencies, name, top, size)
+        if not frequencies or (not force and manifest.get(os.path.basename(filename)) == key
+                               and os.path.exists(filename)):
+            continue
+        keys[os.path.basename(filename)] = key
+        jobs.append((filename, frequencies, name, top, size))
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            rendered = list(pool.map(_render, jobs))
+    else:
+        rendered = [_render(job) for job in jobs]
+    for filename in rendered:
+        manifest[os.path.basename(filename)] = keys[os.path.basename(filename)]
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    print(f'{len(rendered)} clouds rendered, {len(files) - len(rendered)} unchanged or empty')
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render word clouds of precomputed frequencies to PNGs in parallel.')
+    parser.add_argument('--json', help='File of {name: {word: count}} to render one cloud per name')
+    parser.add_argument('--candidates', action='store_true', help='One cloud per candidate from the aggregates')
+    parser.add_argument('--db', default='Data/aggregates.db')
+    parser.add_argument('--kind', help="'by' or 'about' for the candidate clouds, both by default")
+    parser.add_argument('--term-type', default='word', choices=['word', 'hashtag'])
+    parser.add_argument('--out', default='plots/')
+    parser.add_argument('--prefix', default='Cloud')
+    parser.add_argument('--top', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--force', action='store_true', help='Render even when the frequencies are unchanged')
+    args = parser.parse_args()
+
+    clouds = {}
+    if args.json:
+        with open(args.json) as f:
+            clouds.update(json.load(f))
+    if args.candidates:
+        from aggregates import CANDIDATES, read_terms
+        for candidate in CANDIDATES:
+            clouds[candidate] = read_terms(args.db, candidate, args.kind, args.term_type, args.top)
+    render_clouds(clouds, args.out, args.prefix, args.workers, args.top, force=args.force)
@@ -0,0 +1,83 @@
+from hashlib import sha256
+from itertools import islice
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Columns returned under these names are stored as categoricals or as datetime64 from epoch seconds
+CATEGORIES = ('name', 'screen_name', 'lang', 'hashtag', 'tag', 'candidate')
+DATETIMES = ('timestamp', 'created_at')
+CACHE_DIR = 'Data/cache/cypher/'
+
+
+def query_key(cypher, parameters=None, **options):
+    """Hash of a query, its parameters and the options shaping its DataFrame, used to name cached results"""
+    payload = json.dumps([cypher, parameters or {}, options], sort_keys=True, default=str)
+    return sha256(payload.encode('utf-8')).hexdigest()
+
+
+def typed_column(values, kind):
+    """Convert one page of a column's values to a categorical, datetime64 or inferred numpy array"""
+    if kind == 'category':
+        values = np.array(values, dtype=object)
+        # Object categories on every page, even all-null ones, so the pages can be unioned
+        return pd.Categorical(values, categories=pd.Index(pd.unique(values), dtype=object).dropna())
+    if kind == 'datetime':
+        return pd.to_datetime(np.array(values, dtype='float64'), unit='s').values
+    return pd.Series(values).values
+
+
+def combine(parts, kind):
+    """Join the pages of a column into one"""
+    if not parts:
+        if kind == 'category':
+            return pd.Categorical([])
+        return np.array([], dtype='datetime64[ns]' if kind == 'datetime' else object)
+    if kind == 'category':
+        return union_categoricals(parts)
+    if kind == 'datetime':
+        return np.concatenate(parts)
+    return pd.concat([pd.Series(part) for part in parts], ignore_index=True).values
+
+
+def records_frame(records, keys, page_size=50000, categories=CATEGORIES, datetimes=DATETIMES):
+    """Build a DataFrame from an iterable of record tuples, converting page_size rows at a time.
+
+    Only one page is ever held as Python objects; earlier pages are already packed into typed column arrays.
+    """
+    kinds = ['category' if key in categories else 'datetime' if key in datetimes else None for key in keys]
+    parts = [[] for _ in keys]
+    records = iter(records)
+    while True:
+        page = list(islice(records, page_size))
+        if not page:
+            break
+        for i, values in enumerate(zip(*page)):
+            parts[i].append(typed_column(values, kinds[i]))
+        del page
+    return pd.DataFrame({key: combine(parts[i], kinds[i]) for i, key in enumerate(keys)}, columns=list(keys))
+
+
+def cypher_frame(graph, cypher, parameters=None, page_size=50000, categories=CATEGORIES, datetimes=DATETIMES,
+                 cache_dir=None, refresh=False):
+    """Run a Cypher query and stream its records into a typed DataFrame with a column per returned key.
+
+    With cache_dir the frame is pickled there under a hash of the query, parameters and dtype options and later calls
+    read it back instead of querying the graph, until refresh=True.
+    """
+    path = None
+    if cache_dir:
+        key = query_key(cypher, parameters, categories=sorted(categories), datetimes=sorted(datetimes))
+        path = os.path.join(cache_dir, key + '.pkl')
+        if not refresh and os.path.exists(path):
+            return pd.read_pickle(path)
+    cursor = graph.run(cypher, parameters or {})
+    df = records_frame(cursor, list(cursor.keys()), page_size, categories, datetimes)
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        df.to_pickle(path + '.tmp')
+        os.replace(path + '.tmp', path)
+    return df
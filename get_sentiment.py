@@ -1,28 +1,50 @@
-import tweepy
-import config
-from py2neo import Graph
+from functools import lru_cache
 import logging
-import pandas as pd
-import re
-import nltk
-from nltk import word_tokenize, FreqDist
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from nltk.collocations import BigramCollocationFinder as big_find
-import string
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
-
-# Set up logging, database connection, twitter streamer and NLTK
+from textclean import clean
+from tokenizer import CachedTokenizer
+from wordcount import WordCounter, count_parallel
+
+# Set up logging and the tokenizer. The database connection, Twitter API and plotting libraries are heavy, so they
+# are only loaded on first use and then shared by everything in the process
 logging.basicConfig(filename='errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
-graph = Graph("bolt://localhost:7687", auth=("neo4j", "password"))
 
-auth = tweepy.OAuthHandler(config.consumer_key, config.consumer_secret)
-auth.set_access_token(config.access_token, config.access_token_secret)
-api = tweepy.API(auth, wait_on_rate_limit=True)
+tokenizer = CachedTokenizer()
+
+# What `from get_sentiment import *` gives; the helpers are imported by name where they are used, as in NLP_EDA.ipynb
+__all__ = ['process_tweet', 'tweet_tokens', 'tokenized', 'wordfrequency', 'word_counts', 'create_wordcloud',
+           'strip_tweets', 'read_cypher', 'primary_species', 'get_graph', 'get_api', 'tokenizer', 'pd', 'plt']
+
+
+@lru_cache(maxsize=None)
+def get_graph():
+    """Connection to the local Neo4j database, opened on the first call"""
+    from py2neo import Graph
+    return Graph("bolt://localhost:7687", auth=("neo4j", "password"))
+
 
-nltk.download('wordnet')
-lemmatizer = WordNetLemmatizer()
+@lru_cache(maxsize=None)
+def get_api():
+    """Tweepy API client, authenticated on the first call"""
+    import tweepy
+    import config
+    auth = tweepy.OAuthHandler(config.consumer_key, config.consumer_secret)
+    auth.set_access_token(config.access_token, config.access_token_secret)
+    return tweepy.API(auth, wait_on_rate_limit=True)
+
+
+def __getattr__(name):
+    """Keep graph, api, pd and plt available as module attributes without loading them at import"""
+    if name == 'graph':
+        return get_graph()
+    if name == 'api':
+        return get_api()
+    if name == 'pd':
+        import pandas
+        return pandas
+    if name == 'plt':
+        import matplotlib.pyplot
+        return matplotlib.pyplot
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def process_tweet(tweet):
@@ -32,88 +54,103 @@ def process_tweet(tweet):
     Returns:
         stopwords_removed (list): list of all words in tweet, not including stopwords
     """
-    stopwords_list=stopwords.words('english') +list(string.punctuation)
-    stopwords_list += ["'",'"','...','``','…','’','‘','“',"''",'""','”','”','co',"'s'",'\'s','n\'t','\'m','\'re','amp','https']
-    tokens = nltk.word_tokenize(tweet)
-    stopwords_removed = [lemmatizer.lemmatize(token).lower() for token in tokens if token not in stopwords_list]
-    return stopwords_removed
+    return tokenizer.process(tweet)
+
+
+def tweet_tokens(tweet):
+    """ Takes in a single tweet as a string or list of hashtags and returns its tokens the way tokenized does
+    Parameters:
+        tweet (string or list): text of the tweet, or a list of strings such as hashtags
+
+    Returns:
+        tokens (list): list of the words in the tweet, not including stopwords
+    """
+    return tokenizer.tweet_tokens(tweet)
 
 
-def tokenized(series):
+def tokenized(series, workers=1):
     """ Takes in a series containing strings or lists of strings, and creates a single list of all the words
     Parameters:
         series (series): series of text in the form of strings or lists of string
+        workers (int): Number of processes to tokenize with
 
     Returns:
         tokens (list): list of every word in the series, not including stopwords
     """
+    return tokenizer.tokenized(series, workers)
 
-    corpus = ' '.join(
-        [tweet.lower() if type(tweet) == str else ' '.join([tag.lower() for tag in tweet]) for tweet in series])
-    corpus, tags = strip_tweets(corpus)
-    tokens = process_tweet(corpus)
-    return tokens
 
-
-def wordfrequency(series, top):
+def wordfrequency(series, top, workers=1, sketch=False, dedupe=False):
     """ Returns the frequency of words in a list of strings.
     Parameters:
-        series (iterable): List of strings to be combined and analyzed
+        series (iterable): List of strings to be analyzed, consumed one tweet at a time
         top (int): The number of top words to return.
+        workers (int): Number of processes to count with
+        sketch (bool): Use bounded-memory count-min sketches, counts become estimates
+        dedupe (bool): Tokenize each cluster of near-duplicate strings once, weighted by its size
     Returns:
         list (tuples): List of word and value pairs for the top words in the series.
     """
-    vocab = tokenized(series)
-    big = big_find.from_words(vocab)
-    big_measures = nltk.collocations.BigramAssocMeasures()
-    bestBigrams = big.above_score(score_fn=big_measures.raw_freq, min_score=1.0 / len(tuple(nltk.bigrams(series))))
-    vocab += bestBigrams
-    frequencies = FreqDist(tokenized(series))
-    return frequencies.most_common(top)
+    return word_counts(series, workers, sketch, dedupe, k=max(top, 1000)).most_common(top)
 
 
-def create_wordcloud(series, tag=False, top=200):
+def word_counts(series, workers=1, sketch=False, dedupe=False, **options):
+    """ Returns a WordCounter with the unigram and bigram counts of a list of strings.
+    Parameters:
+        series (iterable): List of strings to be analyzed, consumed one tweet at a time
+        workers (int): Number of processes to count with
+        sketch (bool): Use bounded-memory count-min sketches, counts become estimates
+        dedupe (bool): Collapse near-duplicate strings with neardup.collapse first and count each cluster once,
+            weighted by its size. Counts then come from each cluster's first string.
+    Returns:
+        WordCounter: counts supporting most_common and most_common_bigrams
+    """
+    if dedupe:
+        from neardup import collapse
+        texts, counts, _ = collapse(series)
+        pairs = zip(texts, counts)
+        if workers > 1:
+            return count_parallel(pairs, tweet_tokens, workers=workers, weighted=True, sketch=sketch, **options)
+        return WordCounter(tweet_tokens, sketch=sketch, **options).update_weighted(pairs)
+    if workers > 1:
+        return count_parallel(series, tweet_tokens, workers=workers, sketch=sketch, **options)
+    return WordCounter(tweet_tokens, sketch=sketch, **options).update(series)
+
+
+def create_wordcloud(series, tag=False, top=200, dedupe=False):
     """ Take in a list of lists and create a WordCloud visualization for those terms.
     Parameters:
-            series (iterable): A list of lists containing strings.
+            series (iterable or dict): A list of lists containing strings, or precomputed {word: count}
+                frequencies such as aggregates.read_terms returns
             tag (String): Hashtag being looked at
             top (int): Number of words to include in the WordCloud
+            dedupe (bool): For a list of strings, weight words by near-duplicate cluster as word_counts does
     Returns:
         None: The output is a visualization of the strings in series in terms of the
-            frequency of their occurrence.
+            frequency of their occurrence. cloudrender.render_clouds writes many clouds to PNGs instead.
     """
-    vocab = tokenized(series)
-    cloud = WordCloud(background_color='coral', max_words=top,  colormap='Blues')\
-        .generate(' '.join([word for word in vocab]))
-    plt.figure(figsize=(24, 12))
-    plt.imshow(cloud, interpolation='bilinear')
-    if tag:
-        plt.title(f'Most Common words for {tag}')
+    from wordcloud import WordCloud
+    import matplotlib.pyplot as plt
+    from cloudrender import draw
+    cloud = WordCloud(background_color='coral', max_words=top,  colormap='Blues')
+    if dedupe and not isinstance(series, dict):
+        series = dict(word_counts(series, dedupe=True, bigrams=False).most_common(top))
+    if isinstance(series, dict):
+        cloud.generate_from_frequencies(series)
     else:
-        plt.title(f'Most Common Words', size='40', pad=20)
-    plt.axis('off')
+        vocab = tokenized(series)
+        cloud.generate(' '.join([word for word in vocab]))
+    draw(cloud, tag)
     plt.show();
 
 
 def strip_tweets(tweet):
     """Process tweet text to remove retweets, mentions,links and hashtags."""
-    retweet = r'RT:? ?@\w+:?'
-    tweet = re.sub(retweet, '', tweet)
-    mention = r'@\w+'
-    tweet = re.sub(mention, '', tweet)
-    links = r'^(http:\/\/www\.|https:\/\/www\.|http:\/\/|https:\/\/)?[a-z0-9]+([\-\.]{1}[a-z0-9]+)*\.[a-z]{2,5}(:[0-9]{1,5})?(\/.*)?$'
-    tweet = re.sub(links, '', tweet)
-    tweet_links = r'https:\/\/t\.co\/\w+|http:\/\/t\.co\/\w+'
-    tweet = re.sub(tweet_links, '', tweet)
-    tweet_link = r'http\S+'
-    tweet = re.sub(tweet_link, '', tweet)
-    hashtag = r'#\w+'
-    hashtags = re.findall(hashtag, tweet)
-    tweet = re.sub(hashtag, '', tweet)
-    return tweet, hashtags
-
-
-def read_cypher(cypher, index_col=None):
+    cleaned = clean(tweet)
+    return cleaned.text, cleaned.hashtags
+
+
+def read_cypher(cypher, index_col=None, parameters=None, cache=False, page_size=50000):
     """
     Run a Cypher query against the graph, put the results into a df
 
@@ -121,20 +158,20 @@ def read_cypher(cypher, index_col=None):
     ----------
     cypher : cypher query to be executed, may or may not have parameters to insert
     index_col : which column to use as the index, otherwise none used
+    parameters : dict of values for the query's $parameters
+    cache : True (or a directory) to keep the results on disk and reuse them for the same query and parameters
+    page_size : records converted to typed columns at a time
 
     Returns
     -------
-    df : a DataFrame
+    df : a DataFrame with a column per key the query returns, names and screen names as categoricals and
+         timestamps as datetime64
     """
-    results = graph.run(cypher)
-    resrows = [{'name': i[0], 'followers': i[1], 'text': i[2], 'timestamp': i[3]} for i in results]
-    df = pd.DataFrame(resrows)
+    from cypherframe import cypher_frame, CACHE_DIR
+    cache_dir = (cache if isinstance(cache, str) else CACHE_DIR) if cache else None
+    df = cypher_frame(get_graph(), cypher, parameters, page_size=page_size, cache_dir=cache_dir)
     if index_col is not None:
-        if index_col =='timestamp':
-            df.set_index(pd.to_datetime(df.timestamp)).drop(['timestamp'],axis=1)
-        else:
-            df.set_index(index_col).drop([index_col], axis=1)
-
+        df = df.set_index(index_col)
     return df
 
 
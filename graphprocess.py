@@ -1,32 +1,23 @@
 import numpy as np
 from collections import defaultdict
-from py2neo import Graph, Node, Relationship
-import jsonlines
+from py2neo import Graph, Node
 import re
 import logging
 from datetime import datetime
-import os
 from collections import Counter
-import glob
+import argparse
+from ledger import Ledger, ShardReader
+from shardstore import list_shards
+from textclean import strip
+from trending import hashtags
+from metrics import stage, timed, register_stats, serve
 
 logging.basicConfig(filename='neo4j_errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
 
 
 def strip_tweets(tweet):
     '''Process tweet text to remove retweets, mentions,links and hashtags.'''
-    retweet = r'RT:? ?@\w+:?'
-    tweet = re.sub(retweet, '', tweet)
-    mention = r'@\w+'
-    tweet = re.sub(mention, '', tweet)
-    links = r'^(http:\/\/www\.|https:\/\/www\.|http:\/\/|https:\/\/)?[a-z0-9]+([\-\.]{1}[a-z0-9]+)*\.[a-z]{2,5}(:[0-9]{1,5})?(\/.*)?$'
-    tweet = re.sub(links, '', tweet)
-    tweet_links = r'https:\/\/t\.co\/\w+|http:\/\/t\.co\/\w+'
-    tweet = re.sub(tweet_links, '', tweet)
-    tweet_link = r'http\S+'
-    tweet = re.sub(tweet_link, '', tweet)
-    hashtag = r'#\w+'
-    tweet = re.sub(hashtag, '', tweet)
-    return tweet
+    return strip(tweet)
 
 # Functions to set up and encode sentiment
 
@@ -64,19 +55,61 @@ def strip_tweets(tweet):
 # Connect to local Neo4J DB
 graph = Graph("bolt://localhost:7687", auth=("neo4j", "password"))
 
+# Keys every MERGE looks nodes up by, each backed by a uniqueness constraint (and so an index)
+CONSTRAINTS = [('User', 'id'), ('Tweet', 'id'), ('Hashtag', 'text'), ('Url', 'expanded_url')]
 
-def dict_to_node(datadict, *labels, primarykey=None, primarylabel=None, ):
-    """Take in a dictionary and return an instance of the Node class with associated properties"""
+# Counter relationships are incremented through one fixed parameterized statement per (type, start, end) so Neo4j
+# plans each only once, with the increments of many tweets summed per (start, end) pair into its rows
+COUNT_QUERY = "UNWIND $rows AS row MATCH (a:{slabel} {{{skey}: row.src}}) MATCH (b:{elabel} {{{ekey}: row.dst}}) " \
+              "MERGE (a)-[r:{rtype}]->(b) ON CREATE SET r.count = row.count ON MATCH SET r.count = r.count+row.count"
+RETWEETS = ('RETWEETS', ('User', 'id'), ('User', 'id'))
+BROADCASTS_USER = ('BROADCASTS', ('User', 'id'), ('User', 'id'))
+BROADCASTS_HASHTAG = ('BROADCASTS', ('User', 'id'), ('Hashtag', 'text'))
+
+
+def create_constraints(graph):
+    """Create the uniqueness constraints the MERGEs depend on, falling back to a plain index if existing duplicates
+    prevent one"""
+    for label, key in CONSTRAINTS:
+        if (key,) in graph.schema.get_uniqueness_constraints(label):
+            continue
+        try:
+            graph.schema.create_uniqueness_constraint(label, key)
+        except Exception as e:
+            logging.error(f'Could not create uniqueness constraint on {label}.{key}, indexing it instead: {e}')
+            if (key,) not in graph.schema.get_indexes(label):
+                graph.schema.create_index(label, key)
+
+
+def pair_order(item):
+    """Sort key for ((src, dst), value) items that tolerates mixed key types"""
+    return str(item[0])
+
+
+def count_statements(counts):
+    """Yield (query, rows) pairs that add counts, a dict of (type, (label, key), (label, key)) to Counters of
+    (start, end) values, onto counter relationships. Rows are sorted so locks are taken in key order."""
+    for (rtype, (slabel, skey), (elabel, ekey)), pairs in counts.items():
+        yield COUNT_QUERY.format(rtype=rtype, slabel=slabel, skey=skey, elabel=elabel, ekey=ekey), \
+            [{'src': s, 'dst': d, 'count': n} for ((s, d), n) in sorted(pairs.items(), key=pair_order)]
+
+
+def clean_properties(datadict):
+    """Return a copy of datadict with values coerced into types Neo4j can store as properties"""
     cleandict = {}
     for key, value in datadict.items():
-        if isinstance(datadict[key], np.int64):
-            cleandict[key] = int(datadict[key])
-        elif not isinstance(datadict[key], (int, str, float)):
-            cleandict[key] = str(datadict[key])
+        if isinstance(value, np.int64):
+            cleandict[key] = int(value)
+        elif not isinstance(value, (int, str, float)):
+            cleandict[key] = str(value)
         else:
-            cleandict[key] = datadict[key]
+            cleandict[key] = value
+    return cleandict
 
-    node = Node(*labels, **cleandict)
+
+def dict_to_node(datadict, *labels, primarykey=None, primarylabel=None, ):
+    """Take in a dictionary and return an instance of the Node class with associated properties"""
+    node = Node(*labels, **clean_properties(datadict))
     node.__primarylabel__ = primarylabel or labels[0]
     node.__primarykey__ = primarykey
     return node
@@ -175,185 +208,123 @@ def separate_children(tweet):
     return output
 
 
+@timed('push_tweet')
 def push_tweet(tweetdict):
-    """Take tweet dict and create Nodes and Relationships to be pushed into network DB"""
+    """Take tweet dict and write its Nodes and Relationships into network DB in one transaction.
+
+    The writes are bulkload.dict_ops run as a batch of one tweet, so the graph ends up the same whether tweets go
+    through here, a BulkLoader or bulkexport: nodes are merged with `SET n += props`, which keeps properties written
+    later such as sentiment scores and influence, and RETWEETS/BROADCASTS counts are incremented.
+    """
+    from bulkload import TweetBatch, dict_ops
     try:
-        # Separate into various dictionaries
-        dicts = separate_children(tweetdict)
-        # Start transaction
+        batch = TweetBatch()
+        batch.add(dict_ops(tweetdict))
         tx = graph.begin()
-
-        # Handles case where tweet was deleted (may be deprecated)
-        if isinstance(dicts['user'], dict):
-            user = user_dtn(dicts['user'])
-        else:
-            gaffer = user_dtn(dicts['tweet']['delete']['status'])
-            regret = dict_to_node(dicts['tweet']['delete']['status'], 'Tweet')
-            deleted = Relationship(gaffer, 'DELETES', regret, timestamp=dicts['tweet']['delete']['timestamp_ms'])
-            tx.merge(gaffer, primary_key='id')
-            tx.merge(regret, primary_key='id')
-            tx.merge(deleted)
-            tx.commit()
-            return True
-
-        # Create tweet Node
-        tweet = dict_to_node(dicts['tweet'], 'Tweet')
-
-        # Handle retweet relationships
-        if 'retweeted' in dicts.keys():
-            rtuser = user_dtn(dicts['rtuser'])
-            retweet = dict_to_node(dicts['retweeted'], 'Tweet')
-            tweeted2 = Relationship(rtuser, 'TWEETS', retweet, timestamp=retweet['timestamp'],
-                                    created_at=retweet['created_at'], usrStatusCount=rtuser['statuses_count'],
-                                    usrFollowerCount=rtuser['followers_count'],
-                                    usrFavoritesCount=rtuser['favourites_count'])
-            tx.merge(user, primary_key='id')
-            tx.merge(rtuser, primary_key='id')
-            tx.merge(retweet, primary_key='id')
-            tx.merge(tweeted2)
-            tx.commit()
-            # Creates relationship U->U for a retweet
-            graph.evaluate("MATCH (a:User {id: " + str(user['id']) + "}) \
-                            WITH a \
-                            MATCH (b:User {id: " + str(rtuser['id']) + "}) \
-                            MERGE (a)-[r:RETWEETS]->(b) \
-                            ON CREATE SET r.count = 1 \
-                            ON MATCH SET r.count = r.count+1")
-
-            # Need to update table database with new stats from the time of the retweet
-
-            for label, entities in ent_parser(dicts['rents']).items():
-                # Goes through each entity and creates a relationship from the original tweet that contained it
-                # and from the broadcasting User
-                if entities:
-                    for entity in entities:
-                        contains = Relationship(retweet, 'CONTAINS', entity)
-                        tx.merge(entity, str(label), primary_key=entity.__primarykey__)
-                        tx.merge(contains)
-                        if label == 'User':
-                            query = "MATCH (a:User {id: " + str(rtuser['id']) + "}) " + \
-                                    "WITH a " + \
-                                    "MATCH (b:User {id: '" + str(entity['id']) + "'}) \
-                                        MERGE (a)-[r:BROADCASTS]->(b) \
-                                        ON CREATE SET r.count = 1 \
-                                        ON MATCH SET r.count = r.count+1"
-                            graph.evaluate(query)
-                        elif label == 'Hashtag':
-                            query = "MATCH (b:Hashtag {text: '" + entity['text'] + "'}) " + \
-                                    "WITH b " + \
-                                    "MATCH (a:User {id: " + str(rtuser['id']) + "})  \
-                                        MERGE (a)-[r:BROADCASTS]->(b) \
-                                        ON CREATE SET r.count = 1 \
-                                        ON MATCH SET r.count = r.count+1"
-                            graph.evaluate(query)
-            tx.commit()
-
-        # Handle quoted relationships
-        elif 'quoted' in dicts.keys():
-            tweet.add_label('Qtweet')
-            qtuser = user_dtn(dicts['qtuser'])
-            quoted = dict_to_node(dicts['quoted'], 'Tweet')
-
-            tweeted = Relationship(user, 'TWEETS', tweet, timestamp=tweet['timestamp'],
-                                   created_at=tweet['created_at'], usrStatusCount=user['statuses_count'],
-                                   usrFollowerCount=user['followers_count'], usrFavoritesCount=user['favourites_count'])
-
-            tweeted2 = Relationship(qtuser, 'TWEETS', quoted, timestamp=quoted['timestamp'],
-                                    created_at=quoted['created_at'], usrStatusCount=qtuser['statuses_count'],
-                                    usrFollowerCount=qtuser['followers_count'],
-                                    usrFavoritesCount=qtuser['favourites_count'])
-
-            quotes = Relationship(tweet, 'QUOTES', quoted, timestamp=tweet['timestamp'],
-                                  favcount=quoted['favourites_count'], replyCount=quoted['reply_count'],
-                                  sourceFollowers=qtuser['followers_count'], createdAt=tweet['created_at'],
-                                  retweetCount=quoted['retweet_count'], quoteCount=quoted['quote_count'])
-
-            tx.merge(tweet, primary_key='id')
-            tx.merge(user, primary_key='id')
-            tx.merge(tweeted)
-            tx.merge(qtuser, primary_key='id')
-            tx.merge(quoted, primary_key='id')
-            tx.merge(tweeted2)
-            tx.merge(quotes)
-            tx.commit()
-
-            for label, entities in ent_parser(dicts['ents']).items():
-                if entities:
-                    for entity in entities:
-                        contains = Relationship(tweet, 'CONTAINS', entity)
-                        tx.merge(entity, str(label), primary_key=entity.__primarykey__)
-                        tx.merge(contains)
-
-            for label, entities in ent_parser(dicts['qents']).items():
-                if entities:
-                    for entity in entities:
-                        contains = Relationship(quoted, 'CONTAINS', entity)
-                        tx.merge(entity, str(label), primary_key=entity.__primarykey__)
-                        tx.merge(contains)
-            tx.commit()
-
-        # Handle normal tweet relationship
-        else:
-            tweeted = Relationship(user, 'TWEETS', tweet, timestamp=tweet['timestamp'],
-                                   created_at=tweet['created_at'], usrStatusCount=user['statuses_count'],
-                                   usrFollowerCount=user['followers_count'], usrFavoritesCount=user['favourites_count'])
-            tx.merge(tweet, primary_key='id')
-            tx.merge(user, primary_key='id')
-            tx.merge(tweeted)
-            for label, entities in ent_parser(dicts['ents']).items():
-                if entities:
-                    for entity in entities:
-                        contains = Relationship(tweet, 'CONTAINS', entity)
-                        tx.merge(entity, str(label), primary_key=entity.__primarykey__)
-                        tx.merge(contains)
-            tx.commit()
-        return tweetdict['text']
+        for query, rows in batch.statements():
+            tx.run(query, rows=rows)
+        tx.commit()
+        return tweetdict.get('text', True)
     except Exception as e:
         logging.error(f'Error on push: {e}. Tweet: \n {tweetdict}')
         raise
 
 
-def listen(status):
-    """"""
+def listen(status, push=push_tweet):
+    """Push a tweet with the given writer (push_tweet or a bulkload.BulkLoader) and return its hashtags.
+
+    A tweet that cannot be written is logged and skipped, but a BulkLoader batch that fails to commit raises: its
+    tweets are still pending and the caller must not carry on as if they had been loaded.
+    """
+    loader = None if callable(push) else push
     try:
-        full_text = push_tweet(status)
-        hash_tag = re.search(r'\#\w*', full_text)
-        if hash_tag:
-            if isinstance(hash_tag, list):
-                hash_tags = hash_tag
-            else:
-                hash_tags = [hash_tag]
-            return hash_tags
-        return []
+        # Taken first as the writer may consume the dict
+        hash_tags = hashtags(status)
+        if loader is None:
+            push(status)
+        else:
+            loader.add(status)
     except Exception as e:
         print(e)
+        stage('listen').error(e)
         logging.error(f'Error on Listen: {e}\nFailed tweet: {status}')
+        return None
+    if loader is not None and loader.due():
+        loader.flush()
+    return hash_tags
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load captured tweet shards into Neo4j.')
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help='Tweets per UNWIND batch, 0 pushes one transaction per tweet')
+    parser.add_argument('--flush-interval', type=float, default=5.0,
+                        help='Seconds a partial batch may wait before it is written')
+    parser.add_argument('--sentiment', action='store_true',
+                        help='Score tweets with VADER (and spaCy vectors) as they are loaded, needs --batch-size')
+    parser.add_argument('--node-cache', type=int, default=100000,
+                        help='Nodes remembered to skip unchanged MERGEs with --batch-size, 0 disables the cache')
+    parser.add_argument('--node-ttl', type=float, default=None, help='Seconds before a cached node is rewritten')
+    parser.add_argument('--metrics-port', type=int, default=0, help='Serve Prometheus metrics on this port')
+    args = parser.parse_args()
+    if args.sentiment and args.batch_size <= 0:
+        parser.error('--sentiment needs --batch-size')
+    create_constraints(graph)
+    if args.batch_size > 0:
+        from bulkload import BulkLoader
+        scorer = None
+        if args.sentiment:
+            from sentiment import SentimentScorer
+            scorer = SentimentScorer()
+        from nodecache import NodeCache
+        cache = NodeCache(args.node_cache, args.node_ttl) if args.node_cache > 0 else None
+        loader = BulkLoader(graph, batch_size=args.batch_size, flush_interval=args.flush_interval, scorer=scorer,
+                            cache=cache)
+        push = loader
+        if cache is not None:
+            register_stats('node_cache', cache.stats)
+    else:
+        loader = None
+        push = push_tweet
+
+    if args.metrics_port:
+        serve(args.metrics_port)
+
     rn = datetime.now()
     RunTime = (datetime.now().minute/10-1)*10
     path = 'Data/Primary/'
     tags = Counter()
-    # Loop through jsonl files in the above path
-    list_of_files = glob.glob(os.path.join(path, '*.jsonl'))
-    latest_file = max(list_of_files, key=os.path.getctime)
-    for filename in list_of_files:
-        print(f'{filename} being processed.')
-        if filename != latest_file:
-            with jsonlines.open(filename, mode='r') as reader:
-                for line in reader:
-                    try:
-                        if re.match(rf'Data/Primary/Tweets-{rn.month}-{rn.day}-{rn.hour}.*', filename):
-                            recent = listen(line)
-                            if recent:
-                                tags.update(recent)
-                        else:
-                            listen(line)
-                    except Exception as e:
-                        logging.error(f'Error on Read: {e}\nFailed tweet: {line}')
-                print(f'{filename} processed in {datetime.now()-rn} seconds.')
-            # shutil.move(filename, filename[:12]+'_Processed'+filename[12:])
+    ledger = Ledger()
+    # Loop through jsonl files in the above path, resuming each where the last run stopped
+    list_of_files = list_shards(path)
+    latest_file = list_of_files[-1] if list_of_files else None
+    for filename, offset in ledger.pending(list_of_files):
+        print(f'{filename} being processed from byte {offset}.')
+        # The latest file is still being written by graphstream so only its complete lines are read
+        reader = ShardReader(filename, offset, final=filename != latest_file)
+        # listen skips tweets that cannot be written but raises when a batch fails to commit, which stops the run
+        # with the ledger at the last commit. It is checkpointed after every commit (every tweet without a loader) so
+        # a restart never writes a committed tweet, and increments its counters, again
+        try:
+            for line in reader:
+                if re.match(rf'Data/Primary/Tweets-{rn.month}-{rn.day}-{rn.hour}.*', filename):
+                    recent = listen(line, push)
+                    if recent:
+                        tags.update(recent)
+                else:
+                    listen(line, push)
+                if loader is None or not len(loader.batch):
+                    ledger.checkpoint(filename, reader.offset)
+            if loader:
+                loader.flush()
+        except Exception as e:
+            logging.error(f'Stopped loading {filename}, a batch failed to commit: {e}')
+            print(f'A batch failed to commit, stopping. {filename} resumes from byte {ledger.offset(filename)[0]}.')
+            raise
+        ledger.checkpoint(filename, reader.offset, complete=filename != latest_file)
+        print(f'{filename} processed in {datetime.now()-rn} seconds.')
+        if loader and loader.cache is not None:
+            print(f'Node cache: {loader.cache.stats()}')
     with open(f'Data/Tags/{rn.month}-{rn.day}-{rn.hour}.txt', 'w') as f:
         for tag in tags.most_common(10):
             f.write(tag[0]+'\n')
@@ -1,26 +1,215 @@
 from py2neo import Graph
-import jsonlines
 import tweepy
 import logging
 import config
+from shardstore import BlockWriter
+from metrics import stage, timed, register_stats, serve
+from trending import TrendingTags, hashtags
 from math import floor
-# import glob
+from datetime import datetime
+from queue import Queue, Full, Empty
+from time import time, monotonic
+import threading
+import argparse
+import glob
+import os
 
 # Set up logging
 logging.basicConfig(filename='errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
 graph = Graph("bolt://localhost:7687", auth=("neo4j", "password"))
+convert = stage('status_to_dict')
+
+
+class ShardWriter(threading.Thread):
+    """ Background thread that appends captured statuses to the current 10 minute jsonl shard.
+        The listener only enqueues; conversion, encoding and disk writes happen here in batches, keeping the rotated
+        file open and fsyncing periodically. Each status is filed under the shard for the time it was received, so
+        rotation neither drops nor duplicates records. When the bounded queue is full new statuses are dropped and
+        counted rather than blocking the stream. With codec '.gz' or '.zst' every batch is written as one compressed
+        block. With a liveload.LiveLoader every record written is also handed to it for loading into the graph, and
+        with a trending.TrendingTags its hashtags are counted.
+    """
+
+    def __init__(self, path='Data/Primary/', maxsize=10000, batch_size=500, fsync_interval=1.0, codec='', live=None,
+                 trending=None):
+        super().__init__(name='ShardWriter', daemon=True)
+        self.path = path
+        self.codec = codec
+        self.live = live
+        self.trending = trending
+        self.queue = Queue(maxsize)
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.rotations = 0
+        self._bucket = None
+        self._file = None
+        self._synced = monotonic()
+
+    def put(self, status, received=None):
+        """Queue a status without blocking; returns False if it had to be dropped"""
+        self.received += 1
+        try:
+            self.queue.put_nowait((received or time(), status))
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+
+    def stats(self):
+        """Counters for monitoring the writer"""
+        return {'received': self.received, 'written': self.written, 'dropped': self.dropped, 'errors': self.errors,
+                'queue_depth': self.queue.qsize(), 'rotations': self.rotations}
+
+    def close(self):
+        """Write everything queued so far, then stop the thread and close the shard"""
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                pass
+            for item in batch:
+                if item is None:
+                    stop = True
+                    continue
+                received, status = item
+                # A status that cannot be written is logged and counted, the writer carries on with the next one
+                try:
+                    tweet = convert(status_to_dict, status)
+                    if tweet:
+                        shard = self._shard(received)
+                        start = shard.offset
+                        shard.write(tweet)
+                        self.written += 1
+                        if self.live:
+                            self.live.put(shard.filename, start, shard.offset, tweet)
+                        if self.trending:
+                            self.trending.add(hashtags(tweet), received)
+                except Exception as e:
+                    self.errors += 1
+                    stage('shard_write').error(e)
+                    logging.error(f'Error on shard write: {e}\nFailed status: {getattr(status, "id", status)}')
+            try:
+                if self._file:
+                    self._file.flush()
+                    if stop or monotonic() - self._synced >= self.fsync_interval:
+                        os.fsync(self._file.fileno())
+                        self._synced = monotonic()
+            except Exception as e:
+                self.errors += 1
+                stage('shard_write').error(e)
+                logging.error(f'Error on shard flush: {e}')
+        self._close_shard()
+
+    def _shard(self, received):
+        """Return the writer for the shard covering the time a status was received"""
+        bucket = int(received // 600)
+        if bucket != self._bucket:
+            self._close_shard()
+            rn = datetime.fromtimestamp(received)
+            self._file = BlockWriter(self.path + 'Tweets-%s-%s-%s-%s.jsonl' %
+                                     (rn.month, rn.day, rn.hour, "{:02d}".format(floor(rn.minute/10)*10)) + self.codec)
+            self._bucket = bucket
+            self.rotations += 1
+        return self._file
+
+    def _close_shard(self):
+        if self._file:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+
+class TrackRefresher(threading.Thread):
+    """ Background thread that writes the trending hashtags to Data/Tags/ every interval seconds and, with extra > 0,
+        restarts the stream filter to also track up to extra tags scoring at least threshold. Reconnects are at
+        least min_reconnect seconds apart since the streaming API throttles clients that reconnect too often.
+    """
+
+    def __init__(self, trending, watch_list, extra=0, threshold=3.0, interval=60.0, min_reconnect=900.0,
+                 tags_path='Data/Tags/'):
+        super().__init__(name='TrackRefresher', daemon=True)
+        self.trending = trending
+        self.watch_list = list(watch_list)
+        self.extra = extra
+        self.threshold = threshold
+        self.interval = interval
+        self.min_reconnect = min_reconnect
+        self.tags_path = tags_path
+        self.track = list(watch_list)
+        self.stream = None
+        self.restart = False
+        self.reconnects = 0
+        self._connected = monotonic()
+        self._stop = threading.Event()
+
+    def seed(self, tags):
+        """Start out tracking tags, e.g. those of the last trending tags file"""
+        self.track = self._track(tags)
+
+    def stats(self):
+        return {'tracked': len(self.track), 'reconnects': self.reconnects}
+
+    def close(self):
+        self._stop.set()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            top = self.trending.top(10)
+            self.write_tags(top)
+            if not self.extra or self.stream is None:
+                continue
+            track = self._track([tag for tag, score, _ in top if score >= self.threshold][:self.extra])
+            if set(track) != set(self.track) and monotonic() - self._connected >= self.min_reconnect:
+                print(f'Tracking {sorted(set(track) - set(self.watch_list))}')
+                self.track = track
+                self.reconnect()
+
+    def reconnect(self):
+        """Disconnect the stream so the main thread reconnects with the current track list"""
+        self.restart = True
+        self.reconnects += 1
+        self._connected = monotonic()
+        self.stream.disconnect()
+
+    def write_tags(self, top):
+        if not top or not os.path.isdir(self.tags_path):
+            return
+        rn = datetime.now()
+        with open(f'{self.tags_path}{rn.month}-{rn.day}-{rn.hour}.txt', 'w') as f:
+            for tag, _, _ in top:
+                f.write(tag + '\n')
+
+    def _track(self, tags):
+        watched = {term.lower() for term in self.watch_list}
+        return self.watch_list + [tag for tag in tags if tag.lower() not in watched]
 
 
 class TwitterStreamListener(tweepy.StreamListener):
     """ A listener handles tweets as they are received from the stream.
-        Prints tweets received to terminal and to a jsonl file, new jsonl file created every 10 minutes.
+        Prints tweets received to terminal and hands them to a ShardWriter, new jsonl file created every 10 minutes.
     """
 
+    def __init__(self, writer, api=None):
+        super().__init__(api)
+        self.writer = writer
+
+    @timed('on_status')
     def on_status(self, status):
-        from datetime import datetime
-        rn = datetime.now()
+        received = time()
         # Checks if tweet has been truncated and tries to print out the text to terminal every 5 seconds
-        if rn.second % 5 == 0:
+        if int(received) % 5 == 0:
             try:
                 if 'extended_tweet' in status._json.keys():
                     text = status.extended_tweet.full_text
@@ -30,17 +219,13 @@ class TwitterStreamListener(tweepy.StreamListener):
                 print(text+'\n\n')
             except:
                 print('\n\nSIREN !?!?! Failure on TVStream !?!?! SIREN\n\n')
-        # Converts status to dictionary and appends to a json
-        with jsonlines.open('Data/Primary/Tweets-%s-%s-%s-%s.jsonl' %
-                            (rn.month, rn.day, rn.hour, "{:02d}".format(floor(rn.minute/10)*10)), mode='a') as writer:
-            tweet = status_to_dict(status)
-            if tweet:
-                writer.write(tweet)
+        # Converted to a dictionary and appended to the current jsonl shard by the writer thread
+        self.writer.put(status, received)
 
     def on_error(self, status_code):
         # Logs errors and prints out error message
-        from datetime import datetime
         print(f'Error being processed. Code: {status_code}')
+        stage('stream').error(f'http_{status_code}')
         if status_code == 420:
             logging.error(f"{datetime.now()}: The request is understood, but it has been \
             refused or access is not allowed. Limit is maybe reached.\n")
@@ -89,6 +274,7 @@ def status_to_dict(tweet):
         tweet_['id'] = int(tweet.id)
     except Exception as e:
         print(e)
+        convert.error(e)
         logging.error(f'Error on status_to_dict[Tweet]: {e}\nFailed tweet: {tweet._json}\n')
 
     try:
@@ -103,12 +289,33 @@ def status_to_dict(tweet):
         tweet_['user'] = user
     except Exception as e:
         print(e)
+        convert.error(e)
         logging.error(f'Error on status_to_dict[User]: {e}\nFailed tweet: {tweet._json}\n')
         tweet_['user'] = None
     return tweet_
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Capture candidate tweets into rotating jsonl shards.')
+    parser.add_argument('--codec', default='', choices=['', '.gz', '.zst'],
+                        help='Compress shards in blocks with gzip or zstd')
+    parser.add_argument('--metrics-port', type=int, default=0, help='Serve Prometheus metrics on this port')
+    parser.add_argument('--live', action='store_true',
+                        help='Also load tweets into Neo4j as they arrive (do not run graphprocess or ingest meanwhile)')
+    parser.add_argument('--batch-size', type=int, default=500, help='Tweets per UNWIND batch in live mode')
+    parser.add_argument('--flush-interval', type=float, default=2.0,
+                        help='Seconds a partial batch may wait before it is written in live mode')
+    parser.add_argument('--live-queue', type=int, default=20000,
+                        help='Records held in memory for the live loader before it reads them back from the shards')
+    parser.add_argument('--node-cache', type=int, default=100000,
+                        help='Nodes remembered to skip unchanged MERGEs in live mode, 0 disables the cache')
+    parser.add_argument('--ledger', default='Data/ledger.db', help='SQLite file recording loaded offsets')
+    parser.add_argument('--track-trending', type=int, default=0,
+                        help='Also track up to this many trending hashtags, reconnecting when they change')
+    parser.add_argument('--trend-threshold', type=float, default=3.0, help='Burst z-score for a hashtag to be tracked')
+    parser.add_argument('--min-reconnect', type=float, default=900.0, help='Seconds between filter reconnects')
+    args = parser.parse_args()
+
     # Construct watch list from names and usernames
     name_list = ['Joe Biden', 'Bernie Sanders', 'Elizabeth Warren', 'Amy Klobuchar', 'Michael Bloomberg',
                 'Andrew Yang', 'Tulsi Gabbard', 'Pete Buttigieg']
@@ -120,23 +327,60 @@ if __name__ == "__main__":
     user_ids = ['939091', '216776631', '357606935', '33537967', '16581604', '2228878592', '26637348', '226222147']
     watch_list = name_list+user_list
 
-    # Eventually want to add in dynamic detection of trending hashtags based on last hour's activity
-    # list_of_files = glob.glob('/Data/Tag/*.txt')
-    # if list_of_files:
-    #     latest_file = max(list_of_files, key=os.path.getctime)
-    #     with open(latest_file, 'r') as f:
-    #         watch_list += [tag for tag in f.readlines()]
-    # tag_list = set(result['text'] for result in graph.run("""MATCH (n:Hashtag) RETURN n.text as text"""))
-    # watch_list = set(name_list+user_list)#.union(tag_list)
+    # Trending hashtags are detected from the captured tweets and, with --track-trending, added to the filter
+    trending = TrendingTags()
+    refresher = TrackRefresher(trending, watch_list, extra=args.track_trending, threshold=args.trend_threshold,
+                               min_reconnect=args.min_reconnect)
+    list_of_files = glob.glob('Data/Tags/*.txt')
+    if list_of_files and args.track_trending:
+        latest_file = max(list_of_files, key=os.path.getctime)
+        with open(latest_file, 'r') as f:
+            refresher.seed([tag.strip() for tag in f.readlines() if tag.strip()][:args.track_trending])
 
     # Set up Tweepy Stream
     auth = tweepy.OAuthHandler(config.consumer_key, config.consumer_secret)
     auth.set_access_token(config.access_token, config.access_token_secret)
     api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True, retry_count=10, retry_delay=5,
                      retry_errors=5)
-    myStreamListener = TwitterStreamListener()
+    live = None
+    if args.live:
+        from bulkload import BulkLoader
+        from graphprocess import create_constraints
+        from liveload import LiveLoader
+        from nodecache import NodeCache
+        create_constraints(graph)
+        cache = NodeCache(args.node_cache) if args.node_cache > 0 else None
+        live = LiveLoader(BulkLoader(graph, batch_size=args.batch_size, flush_interval=args.flush_interval,
+                                     cache=cache), ledger=args.ledger, maxsize=args.live_queue)
+        live.start()
+    writer = ShardWriter(codec=args.codec, live=live, trending=trending)
+    writer.start()
+    refresher.start()
+    if args.metrics_port:
+        register_stats('stream', writer.stats)
+        register_stats('trending', trending.stats)
+        register_stats('track', refresher.stats)
+        if live:
+            register_stats('live', live.stats)
+            if cache is not None:
+                register_stats('node_cache', cache.stats)
+        serve(args.metrics_port)
+    myStreamListener = TwitterStreamListener(writer)
     myStream = tweepy.Stream(auth=api.auth, listener=myStreamListener)
+    refresher.stream = myStream
 
-    # Start the stream
-    myStream.filter(track=watch_list, languages=['en'], is_async=False)
+    # Start the stream, reconnecting whenever the refresher changes the track list
+    try:
+        while True:
+            refresher.restart = False
+            myStream.filter(track=refresher.track, languages=['en'], is_async=False)
+            if not refresher.restart:
+                break
+    finally:
+        refresher.close()
+        writer.close()
+        print(f'Writer stats: {writer.stats()}')
+        if live:
+            live.close()
+            print(f'Live loader stats: {live.stats()}')
 
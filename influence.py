@@ -0,0 +1,298 @@
+from itertools import islice
+import argparse
+import json
+import logging
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from bulkload import TweetBatch, tweet_ops
+from graphprocess import RETWEETS, BROADCASTS_USER, BROADCASTS_HASHTAG
+from ledger import ShardReader
+from shardstore import list_shards, shard_key
+
+logging.basicConfig(filename='neo4j_errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
+
+# Projected counter relationships: name -> (counter key, id map of the end node)
+EDGES = {'retweets': (RETWEETS, 'users'), 'mentions': (BROADCASTS_USER, 'users'),
+         'hashtags': (BROADCASTS_HASHTAG, 'hashtags')}
+EDGE_QUERY = "MATCH (a:{slabel})-[r:{rtype}]->(b:{elabel}) RETURN a.{skey} AS src, b.{ekey} AS dst, r.count AS count"
+WRITE_QUERY = "UNWIND $rows AS row MATCH (u:User {id: row.id}) SET u += row.props"
+
+
+class IdMap:
+    """Compact integer ids 0..n-1 for external keys (user ids, hashtag texts) in order of first appearance"""
+
+    def __init__(self, keys=()):
+        self.keys = []
+        self.index = {}
+        self.ids(keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def ids(self, keys):
+        """Return the integer ids of keys as an array, assigning new ones to keys not seen before"""
+        index = self.index
+        out = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            j = index.get(key)
+            if j is None:
+                j = index[key] = len(self.keys)
+                self.keys.append(key)
+            out[i] = j
+        return out
+
+    def to_array(self):
+        """The keys as an int64 array if they are all ints (user ids), else as strings, so hashtags like #2020 stay
+        strings when loaded back"""
+        if all(isinstance(key, int) for key in self.keys):
+            return np.array(self.keys, dtype=np.int64)
+        return np.array([str(key) for key in self.keys])
+
+
+def grow(matrix, shape):
+    """Return a CSR matrix padded with empty rows and columns up to shape"""
+    rows = shape[0] - matrix.shape[0]
+    indptr = np.concatenate([matrix.indptr, np.full(rows, matrix.indptr[-1], dtype=matrix.indptr.dtype)])
+    return sp.csr_matrix((matrix.data, matrix.indices, indptr), shape=shape)
+
+
+class Projection:
+    """The weighted RETWEETS and BROADCASTS edges of the graph as scipy CSR matrices over compact integer ids.
+
+    Rows are users (IdMap users); 'retweets' and 'mentions' are user by user, 'hashtags' is user by hashtag (IdMap
+    hashtags). Entries are the r.count of each edge. A projection is built either in bulk from the graph, or from the
+    shards with the offsets of every shard folded in kept alongside it (by shard_key, so a converted shard is not
+    read twice), so refresh() only reads what graphstream has written since and the cache can be refreshed
+    incrementally.
+    """
+
+    def __init__(self):
+        self.users = IdMap()
+        self.hashtags = IdMap()
+        self.matrices = {name: sp.csr_matrix((0, 0), dtype=np.float64) for name in EDGES}
+        self.offsets = {}
+
+    def shape(self, name):
+        return len(self.users), len(getattr(self, EDGES[name][1]))
+
+    def matrix(self, name):
+        """The CSR matrix of one edge type, sized to every id assigned so far"""
+        if self.matrices[name].shape != self.shape(name):
+            self.matrices[name] = grow(self.matrices[name], self.shape(name))
+        return self.matrices[name]
+
+    def add(self, name, src, dst, counts):
+        """Add counts to edges given as sequences of source user keys and end keys"""
+        if not len(counts):
+            return
+        rows = self.users.ids(src)
+        cols = getattr(self, EDGES[name][1]).ids(dst)
+        update = sp.coo_matrix((np.asarray(counts, dtype=np.float64), (rows, cols)), shape=self.shape(name)).tocsr()
+        self.matrices[name] = self.matrix(name) + update
+
+    def load_graph(self, graph, page_size=100000):
+        """Pull every projected edge from the graph in pages of page_size records"""
+        for name, ((rtype, (slabel, skey), (elabel, ekey)), _) in EDGES.items():
+            cursor = iter(graph.run(EDGE_QUERY.format(rtype=rtype, slabel=slabel, skey=skey, elabel=elabel,
+                                                      ekey=ekey)))
+            for page in iter(lambda: list(islice(cursor, page_size)), []):
+                src, dst, counts = zip(*page)
+                self.add(name, src, dst, [count or 0 for count in counts])
+        return self
+
+    def refresh(self, path='Data/Primary/', batch_size=20000):
+        """Fold in the counter writes of every shard line not read yet. Returns the number of tweets read."""
+        list_of_files = list_shards(path)
+        latest_file = list_of_files[-1] if list_of_files else None
+        read = 0
+        for filename in list_of_files:
+            offset, complete = self.offsets.get(shard_key(filename), (0, False))
+            if complete:
+                continue
+            reader = ShardReader(filename, offset, final=filename != latest_file)
+            batch = TweetBatch()
+            for line in reader:
+                try:
+                    batch.add([op for op in tweet_ops(line) if op[0] == 'count'])
+                except Exception as e:
+                    logging.error(f'Error on projection: {e}\nFailed tweet: {line}')
+                if len(batch) >= batch_size:
+                    read += len(batch)
+                    self._add_counts(batch)
+                    batch = TweetBatch()
+            read += len(batch)
+            self._add_counts(batch)
+            self.offsets[shard_key(filename)] = (reader.offset, filename != latest_file)
+        return read
+
+    def _add_counts(self, batch):
+        for name, (counter, _) in EDGES.items():
+            pairs = batch.counts.get(counter)
+            if pairs:
+                (src, dst), counts = zip(*pairs.keys()), list(pairs.values())
+                self.add(name, src, dst, counts)
+
+    def users_graph(self, retweets=1.0, mentions=0.0):
+        """Square user by user matrix weighting retweets and the mentions broadcast by retweets"""
+        matrix = self.matrix('retweets') * retweets
+        if mentions:
+            matrix = matrix + self.matrix('mentions') * mentions
+        return matrix.tocsr()
+
+    def save(self, filename):
+        """Write the projection and its shard offsets to one .npz, replaced atomically"""
+        arrays = {'users': self.users.to_array(), 'hashtags': self.hashtags.to_array(),
+                  'offsets': np.array(json.dumps(self.offsets))}
+        for name in EDGES:
+            matrix = self.matrix(name)
+            arrays.update({f'{name}_data': matrix.data, f'{name}_indices': matrix.indices,
+                           f'{name}_indptr': matrix.indptr, f'{name}_shape': np.array(matrix.shape)})
+        with open(filename + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(filename + '.tmp', filename)
+
+    @classmethod
+    def load(cls, filename):
+        projection = cls()
+        with np.load(filename) as arrays:
+            projection.users = IdMap(arrays['users'].tolist())
+            projection.hashtags = IdMap(arrays['hashtags'].tolist())
+            # Caches saved before offsets were kept by shard_key can hold compressed filenames
+            for key, (offset, complete) in json.loads(str(arrays['offsets'])).items():
+                before = projection.offsets.get(shard_key(key), (0, False))
+                projection.offsets[shard_key(key)] = (max(offset, before[0]), complete or before[1])
+            for name in EDGES:
+                projection.matrices[name] = sp.csr_matrix((arrays[f'{name}_data'], arrays[f'{name}_indices'],
+                                                           arrays[f'{name}_indptr']),
+                                                          shape=tuple(arrays[f'{name}_shape']))
+        return projection
+
+    @classmethod
+    def cached(cls, filename='Data/projection.npz', path='Data/Primary/'):
+        """Load the cached projection (or start one), bring it up to date with the shards and save it"""
+        projection = cls.load(filename) if os.path.exists(filename) else cls()
+        if projection.refresh(path):
+            projection.save(filename)
+        return projection
+
+
+def pagerank(matrix, alpha=0.85, personalization=None, tol=1e-10, max_iter=100):
+    """PageRank of a weighted adjacency matrix whose entry (i, j) is an edge from i to j; scores sum to 1.
+
+    Dangling nodes link to the personalization vector (uniform by default), as networkx does.
+    """
+    n = matrix.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    out = np.asarray(matrix.sum(axis=1)).ravel()
+    dangling = out == 0
+    inverse = np.zeros(n)
+    inverse[~dangling] = 1.0 / out[~dangling]
+    transition = (sp.diags(inverse) @ matrix).T.tocsr()
+    v = np.full(n, 1.0 / n) if personalization is None else personalization / personalization.sum()
+    rank = v.copy()
+    for _ in range(max_iter):
+        previous = rank
+        rank = alpha * (transition @ rank + rank[dangling].sum() * v) + (1 - alpha) * v
+        if np.abs(rank - previous).sum() < n * tol:
+            break
+    return rank
+
+
+def hits(matrix, tol=1e-10, max_iter=100):
+    """Hub and authority scores of a weighted adjacency matrix, each summing to 1.
+
+    The matrix may be rectangular: for the user by hashtag projection hubs are users and authorities hashtags.
+    """
+    transpose = matrix.T.tocsr()
+    hubs = np.full(matrix.shape[0], 1.0 / max(matrix.shape[0], 1))
+    authorities = np.zeros(matrix.shape[1])
+    for _ in range(max_iter):
+        previous = hubs
+        authorities = transpose @ hubs
+        authorities /= authorities.max() or 1.0
+        hubs = matrix @ authorities
+        hubs /= hubs.max() or 1.0
+        if np.abs(hubs - previous).sum() < len(hubs) * tol:
+            break
+    return hubs / (hubs.sum() or 1.0), authorities / (authorities.sum() or 1.0)
+
+
+def label_propagation(matrix, max_iter=30, seed=0):
+    """Community id per node by weighted label propagation on the undirected version of a square matrix.
+
+    Each round every node in a random half of them takes the label carrying the most edge weight among its
+    neighbours, computed for all nodes at once as one sparse product. Updating half at a time stops labels from
+    oscillating between the two sides of bipartite structures. Communities are numbered from 0 by size.
+    """
+    n = matrix.shape[0]
+    rng = np.random.RandomState(seed)
+    undirected = (matrix + matrix.T).tocsr()
+    connected = np.diff(undirected.indptr) > 0
+    labels = np.arange(n)
+    for _ in range(max_iter):
+        weights = undirected @ sp.csr_matrix((np.ones(n), (np.arange(n), labels)), shape=(n, n))
+        best = np.asarray(weights.argmax(axis=1)).ravel()
+        update = connected & (rng.rand(n) < 0.5)
+        changed = update & (best != labels)
+        labels[changed] = best[changed]
+        if not changed.any() and not (connected & (best != labels)).any():
+            break
+    _, labels, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    order = np.argsort(-sizes, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[labels]
+
+
+def write_properties(graph, keys, properties, batch_size=10000):
+    """Set User properties from arrays aligned with keys, e.g. {'pagerank': ranks}, batch_size users per transaction.
+
+    Users are merged with `SET n += props` when they are loaded again, so the properties are kept.
+    """
+    names = list(properties)
+    columns = [np.asarray(properties[name]).tolist() for name in names]
+    for start in range(0, len(keys), batch_size):
+        rows = [{'id': keys[i], 'props': {name: column[i] for name, column in zip(names, columns)}}
+                for i in range(start, min(start + batch_size, len(keys)))]
+        tx = graph.begin()
+        tx.run(WRITE_QUERY, rows=rows)
+        tx.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='PageRank, HITS and communities of users from RETWEETS/BROADCASTS.')
+    parser.add_argument('--cache', default='Data/projection.npz', help='Projection cache, refreshed from the shards')
+    parser.add_argument('--path', default='Data/Primary/')
+    parser.add_argument('--from-graph', action='store_true', help='Rebuild the projection from Neo4j instead')
+    parser.add_argument('--mentions', type=float, default=0.5, help='Weight of broadcast mentions against retweets')
+    parser.add_argument('--write', action='store_true', help='Store the scores as User properties')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.from_graph:
+        from graphprocess import graph
+        projection = Projection().load_graph(graph)
+    else:
+        projection = Projection.cached(args.cache, args.path)
+    users = projection.users_graph(mentions=args.mentions)
+    print(f'{len(projection.users)} users, {len(projection.hashtags)} hashtags, {users.nnz} user edges')
+
+    ranks = pagerank(users)
+    hubs, authorities = hits(users)
+    tag_hubs, tag_authorities = hits(projection.matrix('hashtags'))
+    communities = label_propagation(users)
+    for title, scores, keys in (('PageRank', ranks, projection.users.keys),
+                                ('Authorities', authorities, projection.users.keys),
+                                ('Hashtags', tag_authorities, projection.hashtags.keys)):
+        print(f'{title}: {[(keys[i], round(float(scores[i]), 6)) for i in np.argsort(-scores)[:args.top]]}')
+    print(f'{communities.max() + 1 if len(communities) else 0} communities, '
+          f'largest {np.bincount(communities)[:5].tolist() if len(communities) else []}')
+    if args.write:
+        from graphprocess import graph
+        write_properties(graph, projection.users.keys,
+                         {'pagerank': ranks, 'hub': hubs, 'authority': authorities, 'hashtag_hub': tag_hubs,
+                          'community': communities})
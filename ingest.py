@@ -0,0 +1,194 @@
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from random import random
+from time import monotonic, sleep
+import argparse
+import logging
+import os
+import re
+
+from py2neo.database import TransientError
+
+from bulkload import TweetBatch, tweet_ops
+from graphprocess import graph, create_constraints
+from ledger import Ledger, ShardReader
+from metrics import stage, timed, register_stats, serve
+from nodecache import NodeCache
+from shardstore import list_shards
+from trending import hashtags
+
+logging.basicConfig(filename='neo4j_errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
+
+scorer = None
+# Running totals for the metrics endpoint
+totals = Counter()
+
+
+def parse_shard(filename, batch_size=2000, recent=False, offset=0, final=True, sentiment=False):
+    """Read a jsonl shard from a byte offset and transform it into TweetBatches of at most batch_size tweets
+
+    With sentiment every batch is scored in the worker by a SentimentScorer kept for the life of the process.
+
+    Returns a list of (batch, offset after its last line) pairs, the number of lines that failed, the hashtags seen
+    (only counted for recent shards) and the seconds spent parsing.
+    """
+    start = monotonic()
+    batches = [(TweetBatch(), offset)]
+    tags = Counter()
+    errors = 0
+    reader = ShardReader(filename, offset, final=final)
+    for line in reader:
+        try:
+            found = hashtags(line) if recent else ()
+            ops = tweet_ops(line)
+        except Exception as e:
+            errors += 1
+            logging.error(f'Error on Read: {e}\nFailed tweet: {line}')
+            continue
+        if len(batches[-1][0]) >= batch_size:
+            batches.append((TweetBatch(), offset))
+        batches[-1][0].add(ops)
+        batches[-1] = (batches[-1][0], reader.offset)
+        if recent:
+            tags.update(found)
+    # Lines skipped after the last tweet still count as read
+    batches[-1] = (batches[-1][0], reader.offset)
+    if sentiment:
+        global scorer
+        if scorer is None:
+            from sentiment import SentimentScorer
+            scorer = SentimentScorer()
+        for batch, _ in batches:
+            batch.score(scorer)
+    return batches, errors, tags, monotonic() - start
+
+
+@timed('neo4j_write')
+def write_statements(statements, retries=5):
+    """Run statements in one transaction, retrying transient failures such as deadlocks. Returns the retry count."""
+    for attempt in range(retries + 1):
+        tx = graph.begin()
+        try:
+            for query, rows in statements:
+                tx.run(query, rows=rows)
+            tx.commit()
+            return attempt
+        except TransientError as e:
+            stage('neo4j_retry').error(e)
+            if not tx.finished():
+                tx.rollback()
+            if attempt == retries:
+                logging.error(f'Giving up after {retries} retries: {e}')
+                raise
+            sleep(0.05 * 2 ** attempt * (1 + random()))
+
+
+def write_batch(batch, writers, sessions, retries=5, cache=None):
+    """Write a batch through a pool of sessions and return the number of retried transactions.
+
+    Nodes are partitioned by primary key so no two sessions MERGE the same User or Hashtag. Relationships are written
+    once every node shard has committed, partitioned by start node with rows in key order; the deadlocks that can
+    still occur on shared end nodes roll back the whole shard transaction and are retried. Nodes a NodeCache has
+    already seen committed with the same properties are not written again.
+
+    Node and relationship writes are idempotent, so a batch that fails part way through is simply written again when
+    the shard is resumed. Counters are not: they are added last, all in one transaction, so a batch's counts are
+    committed either completely or not at all.
+    """
+    written = batch.skip_cached(cache) if cache is not None else []
+    parts = batch.split(sessions)
+    retried = 0
+    futures = [writers.submit(write_statements, list(part.node_statements()), retries) for part in parts]
+    retried += sum(future.result() for future in futures)
+    if cache is not None:
+        cache.record(written)
+    futures = [writers.submit(write_statements, list(part.rel_statements(counters=False)), retries) for part in parts]
+    retried += sum(future.result() for future in futures)
+    counters = list(batch.counter_statements())
+    if counters:
+        retried += write_statements(counters, retries)
+    return retried
+
+
+def ingest(filenames, ledger, workers=4, sessions=4, batch_size=2000, recent=lambda filename: False,
+           sentiment=False, cache=None):
+    """Parse shards in a process pool and write them, in file order, through a bounded pool of Neo4j sessions.
+
+    Every shard resumes from the offset in the ledger; the last filename is treated as still being written, so only
+    its complete lines are loaded and it is not marked complete. Shards are parsed ahead of the writer by at most two
+    per worker. Returns a Counter of hashtags from recent shards.
+    """
+    tags = Counter()
+    latest = filenames[-1] if filenames else None
+    with ProcessPoolExecutor(max_workers=workers) as parsers, ThreadPoolExecutor(max_workers=sessions) as writers:
+        pending = deque()
+        for filename, offset in ledger.pending(filenames):
+            final = filename != latest
+            future = parsers.submit(parse_shard, filename, batch_size, recent(filename), offset, final, sentiment)
+            pending.append((filename, final, future))
+            if len(pending) < 2 * workers:
+                continue
+            tags.update(write_shard(*pending.popleft(), ledger, writers, sessions, cache))
+        while pending:
+            tags.update(write_shard(*pending.popleft(), ledger, writers, sessions, cache))
+    return tags
+
+
+def write_shard(filename, final, future, ledger, writers, sessions, cache=None):
+    """Write a parsed shard, checkpointing the ledger after every batch, and report its throughput"""
+    try:
+        batches, errors, tags, parsed = future.result()
+    except Exception as e:
+        logging.error(f'Error on Read: {e}\nFailed file: {filename}')
+        print(f'{filename} failed: {e}')
+        stage('parse').error(e)
+        return Counter()
+    start = monotonic()
+    retried = 0
+    for i, (batch, offset) in enumerate(batches):
+        retried += write_batch(batch, writers, sessions, cache=cache)
+        ledger.checkpoint(filename, offset, complete=final and i == len(batches) - 1)
+    written = monotonic() - start
+    count = sum(len(batch) for (batch, offset) in batches)
+    totals.update(tweets=count, parse_errors=errors, retries=retried, shards=1)
+    print(f'{filename}: {count} tweets parsed in {parsed:.1f}s, written in {written:.1f}s '
+          f'({count / max(written, 1e-9):.0f} tweets/s, {errors} errors, {retried} retries)')
+    if cache is not None:
+        print(f'Node cache: {cache.stats()}')
+    return tags
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load captured tweet shards into Neo4j in parallel.')
+    parser.add_argument('--path', default='Data/Primary/')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes parsing shards')
+    parser.add_argument('--sessions', type=int, default=4, help='Concurrent Neo4j write transactions')
+    parser.add_argument('--batch-size', type=int, default=2000, help='Tweets per write transaction')
+    parser.add_argument('--sentiment', action='store_true', help='Score tweets in the parse workers')
+    parser.add_argument('--ledger', default='Data/ledger.db', help='SQLite file recording loaded offsets')
+    parser.add_argument('--node-cache', type=int, default=100000,
+                        help='Nodes remembered to skip unchanged MERGEs, 0 disables the cache')
+    parser.add_argument('--node-ttl', type=float, default=None, help='Seconds before a cached node is rewritten')
+    parser.add_argument('--metrics-port', type=int, default=0, help='Serve Prometheus metrics on this port')
+    args = parser.parse_args()
+
+    create_constraints(graph)
+    cache = NodeCache(args.node_cache, args.node_ttl) if args.node_cache > 0 else None
+    if args.metrics_port:
+        register_stats('ingest', lambda: dict(totals))
+        if cache is not None:
+            register_stats('node_cache', cache.stats)
+        serve(args.metrics_port)
+    rn = datetime.now()
+    # The newest shard is still being written by graphstream and is tailed up to its last complete line
+    list_of_files = list_shards(args.path)
+    current = re.compile(rf'.*Tweets-{rn.month}-{rn.day}-{rn.hour}-.*')
+    tags = ingest(list_of_files, Ledger(args.ledger), workers=args.workers, sessions=args.sessions,
+                  batch_size=args.batch_size, recent=lambda filename: bool(current.match(filename)),
+                  sentiment=args.sentiment, cache=cache)
+    with open(f'Data/Tags/{rn.month}-{rn.day}-{rn.hour}.txt', 'w') as f:
+        for tag in tags.most_common(10):
+            f.write(tag[0]+'\n')
+    print(f'~~~~{datetime.now()}~~~~')
+    print(f"Tags from listening: {tags.most_common(10)}\n")
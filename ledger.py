@@ -0,0 +1,99 @@
+import logging
+import sqlite3
+from datetime import datetime
+
+from shardstore import open_shard, seek_shard, loads, shard_key
+
+logging.basicConfig(filename='neo4j_errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
+
+
+class Ledger:
+    """Persistent record of how many bytes of each shard have been loaded into the graph.
+
+    A shard is marked complete once graphstream has rotated past it and every line has been loaded, after which
+    it is never read again. Offsets are only advanced after the tweets before them have been committed to Neo4j, so
+    a crash replays at most the tweets between the last commit and the last checkpoint. Shards are tracked by
+    shardstore.shard_key, so a shard converted to a compressed copy carries on from the same offset.
+    """
+
+    def __init__(self, path='Data/ledger.db'):
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS shards (
+                                     filename TEXT PRIMARY KEY,
+                                     offset INTEGER NOT NULL,
+                                     complete INTEGER NOT NULL DEFAULT 0,
+                                     updated TEXT)''')
+            # Ledgers written before shards were tracked by shard_key have rows for compressed filenames
+            for filename, offset, complete in self.conn.execute(
+                    "SELECT filename, offset, complete FROM shards WHERE filename LIKE '%.gz' OR filename LIKE '%.zst'"
+            ).fetchall():
+                self.conn.execute('''INSERT INTO shards (filename, offset, complete, updated) VALUES (?, ?, ?, ?)
+                                     ON CONFLICT(filename) DO UPDATE SET offset = MAX(offset, excluded.offset),
+                                         complete = MAX(complete, excluded.complete)''',
+                                  (shard_key(filename), offset, complete, datetime.now().isoformat()))
+                self.conn.execute('DELETE FROM shards WHERE filename = ?', (filename,))
+
+    def offset(self, filename):
+        """Return (byte offset, complete) recorded for a shard, (0, False) if it has never been seen"""
+        row = self.conn.execute('SELECT offset, complete FROM shards WHERE filename = ?',
+                                (shard_key(filename),)).fetchone()
+        if row is None:
+            return 0, False
+        return row[0], bool(row[1])
+
+    def checkpoint(self, filename, offset, complete=False):
+        """Record that everything in a shard before offset has been loaded"""
+        with self.conn:
+            self.conn.execute('''INSERT INTO shards (filename, offset, complete, updated) VALUES (?, ?, ?, ?)
+                                 ON CONFLICT(filename) DO UPDATE SET offset = excluded.offset,
+                                     complete = excluded.complete, updated = excluded.updated''',
+                              (shard_key(filename), offset, int(complete), datetime.now().isoformat()))
+
+    def pending(self, filenames):
+        """Return (filename, offset) for every shard that still has data to load"""
+        out = []
+        for filename in filenames:
+            offset, complete = self.offset(filename)
+            if not complete:
+                out.append((filename, offset))
+        return out
+
+    def close(self):
+        self.conn.close()
+
+
+class ShardReader:
+    """Iterate the tweets of a shard starting at a byte offset, tracking the offset of the next unread line.
+
+    Offsets count bytes of uncompressed jsonl, so plain and block-compressed shards are tracked the same way. While
+    a shard is still being appended to (final=False) a trailing line without its newline, or a compressed block
+    that is only partly written, is left for the next run instead of being parsed half written.
+    """
+
+    def __init__(self, filename, offset=0, final=True):
+        self.filename = filename
+        self.offset = offset
+        self.final = final
+        self.lines = 0
+
+    def __iter__(self):
+        with open_shard(self.filename) as f:
+            seek_shard(f, self.offset)
+            try:
+                for line in f:
+                    if not line.endswith(b'\n') and not self.final:
+                        break
+                    self.offset += len(line)
+                    self.lines += 1
+                    if not line.strip():
+                        continue
+                    try:
+                        record = loads(line)
+                    except ValueError as e:
+                        logging.error(f'Error on Read: {e}\nFailed line {self.lines} of {self.filename}: {line}')
+                        continue
+                    yield record
+            except EOFError as e:
+                if self.final:
+                    logging.error(f'Error on Read: {e}\nTruncated block after line {self.lines} of {self.filename}')
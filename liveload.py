@@ -0,0 +1,259 @@
+from queue import Queue, Full, Empty
+from time import monotonic, sleep
+import logging
+import threading
+
+from ledger import Ledger, ShardReader
+from metrics import stage
+
+logging.basicConfig(filename='neo4j_errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
+
+
+class LiveLoader(threading.Thread):
+    """Loads tweets into the graph as graphstream's ShardWriter logs them, in the same process.
+
+    Records arrive through a bounded queue together with where they were written in their shard, and are written
+    in batches by a bulkload.BulkLoader. When Neo4j falls behind and the queue fills, new records are only logged to
+    the shards: the loader reads them back from disk until it has caught up with the writer and then switches back
+    to the queue, so neither the stream thread nor memory grows with the backlog. A batch that fails to commit is
+    read back from the shards the same way. After max_retries failed commits of a batch while the graph still
+    answers, the batch is committed in halves to find the tweets it rejects, which are logged to neo4j_errors.log and
+    skipped. The ledger is checkpointed after every commit, so graphprocess and ingest resume exactly where live
+    loading stopped (but must not run while it does).
+    """
+
+    def __init__(self, loader, ledger='Data/ledger.db', maxsize=20000, poll_interval=0.5, retry_delay=5.0,
+                 max_retries=3):
+        super().__init__(name='LiveLoader', daemon=True)
+        self.loader = loader
+        self.ledger_path = ledger
+        self.queue = Queue(maxsize)
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.spilling = False
+        # Filenames in the order the writer opened them and (filename, end offset) of the last record it logged
+        self.shards = []
+        self.head = None
+        # (filename, end offset) of the last record added to a batch and of the last one committed
+        self.position = None
+        self.committed = None
+        self._finished = []
+        # (filename, offset) where each tweet of the pending batch starts and ends in its shard
+        self._pending = []
+        self.queued = 0
+        self.spilled = 0
+        self.loaded = 0
+        self.replayed = 0
+        self.errors = 0
+        self.failed_commits = 0
+        self.skipped = 0
+        self._stopping = threading.Event()
+        self._gave_up = False
+        self._retries = 0
+
+    def put(self, filename, start, end, record):
+        """Hand over a record logged between byte offsets start and end of filename; never blocks.
+
+        Returns False if the record was spilled, i.e. will be read back from the shard instead.
+        """
+        with self.lock:
+            if self.head is None or self.head[0] != filename:
+                self.shards.append(filename)
+            self.head = (filename, end)
+            if not self.spilling:
+                try:
+                    self.queue.put_nowait((filename, start, end, record))
+                    self.queued += 1
+                    return True
+                except Full:
+                    self.spilling = True
+            self.spilled += 1
+            return False
+
+    def stats(self):
+        """Counters for monitoring the loader"""
+        return {'queued': self.queued, 'spilled': self.spilled, 'loaded': self.loaded, 'replayed': self.replayed,
+                'errors': self.errors, 'failed_commits': self.failed_commits, 'skipped': self.skipped,
+                'queue_depth': self.queue.qsize(),
+                'spilling': int(self.spilling)}
+
+    def close(self):
+        """Load everything logged so far, then stop the thread. Close the ShardWriter first."""
+        self._stopping.set()
+        self.join()
+
+    def run(self):
+        self.ledger = Ledger(self.ledger_path)
+        try:
+            while not self._gave_up:
+                if self.spilling:
+                    self._catch_up()
+                    continue
+                try:
+                    filename, start, end, record = self.queue.get(timeout=self.poll_interval)
+                except Empty:
+                    if self._flush(force=True) and self._stopping.is_set() and self.position == self.head:
+                        break
+                    continue
+                if self.position is None or self.position[0] != filename:
+                    self._open(filename)
+                if self._behind((filename, start)) and not self._replay((filename, start)):
+                    continue
+                if self._behind((filename, end)):
+                    self._push(record, (filename, end))
+        finally:
+            self.ledger.close()
+
+    def _catch_up(self):
+        """Load the records the queue had no room for by reading them back from the shards"""
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+        with self.lock:
+            head = self.head
+        if self.position is None:
+            self._open(self.shards[0])
+        if not self._replay(head):
+            return False
+        with self.lock:
+            if self.position == self.head:
+                self.spilling = False
+        return True
+
+    def _replay(self, until):
+        """Push records from the shards up to the (filename, offset) until, returning False if it gave up"""
+        stalled = monotonic()
+        while self._behind(until) and not self._gave_up:
+            filename, offset = self.position
+            reader = ShardReader(filename, offset, final=False)
+            for record in reader:
+                if not self._push(record, (filename, reader.offset)):
+                    break
+                self.replayed += 1
+                if not self._behind(until):
+                    break
+            if self.position[0] != filename:
+                # A failed commit rewound the position
+                continue
+            if filename != until[0] and reader.offset == offset:
+                # Earlier shards were closed by the writer before it opened the next one
+                with self.lock:
+                    following = self.shards[self.shards.index(filename) + 1]
+                self._open(following)
+            elif reader.offset == offset:
+                if self._stopping.is_set() and monotonic() - stalled > self.retry_delay:
+                    logging.error(f'Live load stopped at byte {offset} of {filename}, expected {until[1]}')
+                    self._gave_up = True
+                    return False
+                # The writer has not flushed the block holding the rest yet
+                sleep(self.poll_interval)
+            else:
+                stalled = monotonic()
+        return not self._gave_up
+
+    def _open(self, filename):
+        """Move the position to the start of a shard, from where the ledger says earlier runs stopped"""
+        if self.position is not None:
+            self._finished.append(self.position)
+        self.position = (filename, self.ledger.offset(filename)[0])
+        if self.committed is None:
+            self.committed = self.position
+
+    def _behind(self, until):
+        if self.position[0] != until[0]:
+            return True
+        return self.position[1] < until[1]
+
+    def _push(self, record, position):
+        """Add a record to the batch and commit it when due. Returns False if a commit failed."""
+        try:
+            self.loader.add(record)
+            self._pending.append((self.position, position))
+        except Exception as e:
+            self.errors += 1
+            stage('live_load').error(e)
+        self.position = position
+        self.loaded += 1
+        return self._flush()
+
+    def _flush(self, force=False):
+        """Commit the pending batch when due and checkpoint the ledger. Returns False if the commit failed."""
+        if not (self.loader.due() or force and len(self.loader.batch)):
+            return True
+        try:
+            self.loader.flush()
+        except Exception as e:
+            self.loader.discard()
+            self.failed_commits += 1
+            stage('live_load').error(e)
+            self._retries += 1
+            if self._retries < self.max_retries or not self._reachable() or not self._isolate(self._pending):
+                return self._rewind()
+        self._retries = 0
+        self._pending = []
+        self._checkpoint(self.position)
+        return True
+
+    def _rewind(self):
+        """Drop the pending batch, which is still in the shards, to read it back from the last commit after a delay.
+        Returns False."""
+        with self.lock:
+            self.spilling = True
+        self.position = self.committed
+        self._finished = []
+        self._pending = []
+        # When stopping, whatever is left is picked up from the ledger by the next graphprocess or ingest run
+        self._gave_up = self._stopping.is_set() and self._retries > self.max_retries
+        if not self._gave_up:
+            sleep(self.retry_delay)
+        return False
+
+    def _reachable(self):
+        """Whether the graph answers a trivial query, i.e. failed commits are down to the batch and not an outage"""
+        try:
+            self.loader.graph.run('RETURN 1')
+            return True
+        except Exception:
+            return False
+
+    def _isolate(self, pending):
+        """Commit the halves of a batch that failed to commit, splitting the halves that fail again until the tweets
+        the graph rejects are found, which are logged and skipped. Returns False if the graph stopped answering."""
+        middle = len(pending) // 2
+        for part in (pending[:middle], pending[middle:]):
+            if not part:
+                continue
+            for start, _ in part:
+                self.loader.add(self._read(start))
+            try:
+                self.loader.flush()
+            except Exception as e:
+                self.loader.discard()
+                if not self._reachable():
+                    return False
+                if len(part) > 1:
+                    if not self._isolate(part):
+                        return False
+                    continue
+                self.skipped += 1
+                stage('live_load').error(e)
+                logging.error(f'Live load skipped a tweet that failed to commit: {e}\n'
+                              f'Failed tweet: {self._read(part[0][0])}')
+            self._checkpoint(part[-1][1])
+        return True
+
+    def _read(self, position):
+        """Read back the tweet logged at a (filename, offset) position, as tweet_ops consumes the records it is given"""
+        return next(iter(ShardReader(position[0], position[1], final=False)))
+
+    def _checkpoint(self, position):
+        """Record in the ledger that everything up to the (filename, offset) position has committed"""
+        while self._finished and self._finished[0][0] != position[0]:
+            filename, offset = self._finished.pop(0)
+            self.ledger.checkpoint(filename, offset, complete=True)
+        self.ledger.checkpoint(*position)
+        self.committed = position
@@ -0,0 +1,121 @@
+from collections import Counter
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+import logging
+import os
+
+try:
+    from prometheus_client import Histogram, REGISTRY, start_http_server
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:
+    Histogram = None
+
+# Time one call in SAMPLE_EVERY per stage; call and error counts are always exact
+SAMPLE_EVERY = int(os.environ.get('TWEETS_METRICS_SAMPLE', 16))
+BUCKETS = (.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+LATENCY = Histogram('tweets_stage_seconds', 'Sampled latency of pipeline stages', ['stage'],
+                    buckets=BUCKETS) if Histogram else None
+
+
+class Stage:
+    """Calls, errors by exception type and sampled latency of one hot-path stage (on_status, push_tweet, ...).
+
+    Counts are plain ints read when the endpoint is scraped. Ingest writer threads share stages, so each update holds
+    the stage's lock, an uncontended acquire that costs far less than the calls being counted.
+    """
+    stages = {}
+
+    def __init__(self, name, every=SAMPLE_EVERY):
+        self.name = name
+        self.every = max(1, every)
+        self.calls = 0
+        self.errors = Counter()
+        self.lock = Lock()
+        self.latency = LATENCY.labels(name) if LATENCY else None
+        Stage.stages[name] = self
+
+    def __call__(self, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs) as one occurrence of this stage"""
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        try:
+            if self.latency is None or calls % self.every:
+                return fn(*args, **kwargs)
+            start = perf_counter()
+            result = fn(*args, **kwargs)
+            self.latency.observe(perf_counter() - start)
+            return result
+        except Exception as e:
+            self.error(e)
+            raise
+
+    def wrap(self, fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            return self(fn, *args, **kwargs)
+        return wrapper
+
+    def error(self, e):
+        """Count an error the stage handled itself, e.g. one that was only logged, by exception or by name"""
+        kind = e if isinstance(e, str) else type(e).__name__
+        with self.lock:
+            self.errors[kind] += 1
+
+
+def stage(name):
+    """Return the Stage called name, creating it on first use"""
+    return Stage.stages.get(name) or Stage(name)
+
+
+def timed(name):
+    """Decorator counting calls and errors of a function and sampling its latency as the stage called name"""
+    return stage(name).wrap
+
+
+class PipelineCollector:
+    """Exposes stage counters and the stats() dicts of registered objects (queue depths, cache hit rates, ...)"""
+
+    def __init__(self):
+        self.sources = {}
+
+    def collect(self):
+        calls = CounterMetricFamily('tweets_stage_calls', 'Calls of each pipeline stage', labels=['stage'])
+        errors = CounterMetricFamily('tweets_stage_errors', 'Errors in each pipeline stage by exception type',
+                                     labels=['stage', 'type'])
+        for each in list(Stage.stages.values()):
+            calls.add_metric([each.name], each.calls)
+            for kind, n in list(each.errors.items()):
+                errors.add_metric([each.name, kind], n)
+        yield calls
+        yield errors
+        for name, stats in list(self.sources.items()):
+            try:
+                values = stats()
+            except Exception as e:
+                logging.error(f'Could not collect {name} metrics: {e}')
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    yield GaugeMetricFamily(f'tweets_{name}_{key}', f'{key} reported by {name}', value=value)
+
+
+collector = PipelineCollector()
+if Histogram:
+    REGISTRY.register(collector)
+
+
+def register_stats(name, stats):
+    """Publish every number in the dict returned by stats() as a gauge named tweets_<name>_<key>"""
+    collector.sources[name] = stats
+
+
+def serve(port, addr='127.0.0.1'):
+    """Start the Prometheus endpoint on a background thread. Returns False if prometheus_client is missing."""
+    if Histogram is None:
+        logging.error('prometheus_client is not installed, metrics endpoint not started')
+        return False
+    start_http_server(port, addr)
+    return True
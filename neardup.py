@@ -0,0 +1,231 @@
+from hashlib import blake2b
+from zlib import crc32
+import argparse
+import logging
+import re
+
+import numpy as np
+
+from ledger import Ledger, ShardReader
+from shardstore import list_shards
+from textclean import strip
+
+logging.basicConfig(filename='neo4j_errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
+
+PRIME = (1 << 31) - 1
+NON_WORD = re.compile(r'\W+')
+
+SCHEMA = ['''CREATE TABLE IF NOT EXISTS dedupe_settings (name TEXT PRIMARY KEY, value)''',
+          '''CREATE TABLE IF NOT EXISTS clusters (cluster INTEGER PRIMARY KEY, representative INTEGER, text TEXT,
+                                                  count INTEGER NOT NULL, signature BLOB NOT NULL)''',
+          '''CREATE TABLE IF NOT EXISTS fingerprints (fingerprint BLOB PRIMARY KEY, cluster INTEGER NOT NULL)
+             WITHOUT ROWID''',
+          '''CREATE TABLE IF NOT EXISTS members (tweet INTEGER PRIMARY KEY, cluster INTEGER NOT NULL)''']
+
+
+def normalize(text):
+    """Lowercase words of the stripped text, so case, punctuation and spacing edits do not matter"""
+    return NON_WORD.sub(' ', strip(text).lower()).strip()
+
+
+def tweet_text(tweet):
+    """Full text of a shard record, the retweeted original's for retweets"""
+    return (tweet.get('retweeted_status') or tweet).get('text') or ''
+
+
+class NearDuplicates:
+    """Groups texts into clusters of near-duplicates, each with a representative and a count.
+
+    Texts are normalized after textclean.strip (the strip_tweets output) and shingled into overlapping character
+    shingles. Exact repeats, most retweets, are matched by a fingerprint of the normalized text. Other texts get a
+    num_perm MinHash signature, split into bands for LSH: a text is compared with the representatives sharing any
+    band with it and joins the first whose estimated Jaccard similarity is at least threshold, otherwise it starts a
+    new cluster. Only representatives are indexed, so clusters never chain into one another.
+
+    State lives in memory; load() and flush() read it from and add the changes since to the tables of an sqlite3
+    connection, so signatures persist and new tweets are checked against every cluster seen before.
+    """
+
+    def __init__(self, num_perm=64, bands=16, threshold=0.8, shingle=5, seed=1):
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.settings = {'num_perm': num_perm, 'bands': bands, 'threshold': threshold, 'shingle': shingle,
+                         'seed': seed}
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        self.shingle = shingle
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, PRIME, num_perm).astype(np.uint64)[:, None]
+        self.b = rng.randint(0, PRIME, num_perm).astype(np.uint64)[:, None]
+        self.signatures = np.zeros((1024, num_perm), dtype=np.uint32)
+        self.counts = []
+        self.buckets = {}
+        self.fingerprints = {}
+        self._new = []
+        self._grown = {}
+        self._members = []
+        self._fingerprints = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def signature(self, text):
+        """MinHash signature of a normalized text"""
+        n = self.shingle
+        grams = {text[i:i + n] for i in range(max(len(text) - n + 1, 1))}
+        hashes = np.fromiter((crc32(gram.encode('utf-8')) & PRIME for gram in grams), np.uint64, len(grams))
+        return ((self.a * hashes + self.b) % PRIME).min(axis=1).astype(np.uint32)
+
+    def _bands(self, signature):
+        return [(band, hash(chunk.tobytes())) for band, chunk in enumerate(np.split(signature, self.bands))]
+
+    def add(self, text, tweet_id=None, count=1):
+        """Cluster a tweet's text, returning its cluster id"""
+        normalized = normalize(text)
+        fingerprint = blake2b(normalized.encode('utf-8'), digest_size=8).digest()
+        cluster = self.fingerprints.get(fingerprint)
+        if cluster is None:
+            signature = self.signature(normalized)
+            keys = self._bands(signature)
+            cluster = self._match(signature, keys)
+            if cluster is None:
+                cluster = self._create(signature, keys, tweet_id, text)
+            self.fingerprints[fingerprint] = cluster
+            self._fingerprints.append((fingerprint, cluster))
+        self.counts[cluster] += count
+        self._grown[cluster] = self._grown.get(cluster, 0) + count
+        if tweet_id is not None:
+            self._members.append((tweet_id, cluster))
+        return cluster
+
+    def _match(self, signature, keys):
+        seen = set()
+        for key in keys:
+            for cluster in self.buckets.get(key, ()):
+                if cluster in seen:
+                    continue
+                seen.add(cluster)
+                if np.mean(self.signatures[cluster] == signature) >= self.threshold:
+                    return cluster
+        return None
+
+    def _create(self, signature, keys, tweet_id, text):
+        cluster = len(self.counts)
+        if cluster == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.zeros_like(self.signatures)])
+        self.signatures[cluster] = signature
+        self.counts.append(0)
+        for key in keys:
+            self.buckets.setdefault(key, []).append(cluster)
+        self._new.append((cluster, tweet_id, text, signature.tobytes()))
+        return cluster
+
+    def load(self, conn):
+        """Restore the clusters stored in an sqlite3 connection's tables, which must use the same settings"""
+        for statement in SCHEMA:
+            conn.execute(statement)
+        stored = dict(conn.execute('SELECT name, value FROM dedupe_settings'))
+        if stored and stored != self.settings:
+            raise ValueError(f'Clusters were built with {stored}, not {self.settings}')
+        for cluster, count, signature in conn.execute('SELECT cluster, count, signature FROM clusters '
+                                                      'ORDER BY cluster'):
+            signature = np.frombuffer(signature, dtype=np.uint32)
+            self._create(signature, self._bands(signature), None, None)
+            self.counts[cluster] = count
+        self._new = []
+        self.fingerprints = dict(conn.execute('SELECT fingerprint, cluster FROM fingerprints'))
+        return self
+
+    def flush(self, conn):
+        """Add the clusters, counts and members since the last flush to the tables, without committing"""
+        conn.executemany('INSERT OR IGNORE INTO dedupe_settings VALUES (?, ?)', self.settings.items())
+        conn.executemany('INSERT INTO clusters VALUES (?, ?, ?, 0, ?)', self._new)
+        conn.executemany('UPDATE clusters SET count = count + ? WHERE cluster = ?',
+                         [(count, cluster) for cluster, count in self._grown.items()])
+        conn.executemany('INSERT OR IGNORE INTO fingerprints VALUES (?, ?)', self._fingerprints)
+        conn.executemany('INSERT OR REPLACE INTO members VALUES (?, ?)', self._members)
+        self._new, self._grown, self._members, self._fingerprints = [], {}, [], []
+
+
+def collapse(texts, counts=None, **options):
+    """Cluster an iterable of texts in memory. Returns (representative texts, cluster counts, cluster of each text).
+
+    Weighting each representative by its count reproduces totals over the texts while processing every cluster
+    once, e.g. WordCounter.add_tokens(tokens, count).
+    """
+    dedupe = NearDuplicates(**options)
+    representatives = []
+    labels = []
+    for text, count in zip(texts, counts if counts is not None else iter(lambda: 1, None)):
+        cluster = dedupe.add(text, count=count)
+        if cluster == len(representatives):
+            representatives.append(text)
+        labels.append(cluster)
+    return representatives, list(dedupe.counts), np.array(labels, dtype=np.int64)
+
+
+def dedupe_shards(path, db, checkpoint=5000, **options):
+    """Cluster every shard line not yet clustered into the tables of db. Returns (tweets, clusters created).
+
+    Offsets are kept in db and committed with the clusters, as aggregates does, so each line is counted once.
+    """
+    ledger = Ledger(db)
+    dedupe = NearDuplicates(**options).load(ledger.conn)
+    before = len(dedupe)
+    tweets = 0
+    list_of_files = list_shards(path)
+    latest_file = list_of_files[-1] if list_of_files else None
+    for filename, offset in ledger.pending(list_of_files):
+        reader = ShardReader(filename, offset, final=filename != latest_file)
+        for line in reader:
+            try:
+                dedupe.add(tweet_text(line), line.get('id'))
+                tweets += 1
+            except Exception as e:
+                logging.error(f'Error on dedupe: {e}\nFailed tweet: {line}')
+            if reader.lines % checkpoint == 0:
+                dedupe.flush(ledger.conn)
+                ledger.checkpoint(filename, reader.offset)
+        dedupe.flush(ledger.conn)
+        ledger.checkpoint(filename, reader.offset, complete=filename != latest_file)
+    ledger.close()
+    return tweets, len(dedupe) - before
+
+
+def read_clusters(db='Data/neardup.db', min_count=1):
+    """DataFrame of clusters (representative tweet id, text, count) largest first"""
+    import sqlite3
+    import pandas as pd
+    with sqlite3.connect(db) as conn:
+        return pd.read_sql_query('SELECT cluster, representative, text, count FROM clusters WHERE count >= ? '
+                                 'ORDER BY count DESC', conn, params=[min_count], index_col='cluster')
+
+
+def clusters_of(tweet_ids, db='Data/neardup.db'):
+    """{tweet id: cluster} for clustered tweets, e.g. to collapse a read_cypher frame"""
+    import sqlite3
+    tweet_ids = list(tweet_ids)
+    found = {}
+    with sqlite3.connect(db) as conn:
+        for start in range(0, len(tweet_ids), 900):
+            chunk = tweet_ids[start:start + 900]
+            found.update(conn.execute(f'SELECT tweet, cluster FROM members WHERE tweet IN '
+                                      f'({", ".join("?" for _ in chunk)})', chunk))
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cluster near-duplicate tweets of the shards with MinHash LSH.')
+    parser.add_argument('--path', default='Data/Primary/')
+    parser.add_argument('--db', default='Data/neardup.db', help='SQLite file holding signatures and clusters')
+    parser.add_argument('--threshold', type=float, default=0.8, help='Estimated Jaccard similarity to join a cluster')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    tweets, created = dedupe_shards(args.path, args.db, threshold=args.threshold)
+    print(f'{tweets} tweets clustered, {created} new clusters')
+    clusters = read_clusters(args.db)
+    print(f'{len(clusters)} clusters for {clusters["count"].sum()} tweets')
+    for _, row in clusters.head(args.top).iterrows():
+        print(f'{row["count"]:>8} {row["text"]!r}')
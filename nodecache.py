@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class NodeCache:
+    """LRU record of the nodes already written to the graph and a fingerprint of the properties they were given.
+
+    Entries are keyed by (label, primary key value). A node whose properties match its entry needs no MERGE at all,
+    one that is missing, expired or changed (e.g. a new followers_count) is written again. Only record nodes once
+    the transaction that wrote them has committed. With ttl, entries older than ttl seconds are treated as missing so
+    nodes deleted or edited outside the loader are eventually rewritten.
+    """
+
+    def __init__(self, maxsize=100000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def fingerprint(props):
+        return hash(frozenset(props.items()))
+
+    def stale(self, label, value, props):
+        """Return the fingerprint to record if the node needs writing, or None if the graph already has it"""
+        fingerprint = self.fingerprint(props)
+        with self.lock:
+            entry = self.entries.get((label, value))
+            if entry is None or (self.ttl is not None and monotonic() - entry[1] > self.ttl):
+                self.misses += 1
+                return fingerprint
+            if entry[0] != fingerprint:
+                self.updates += 1
+                return fingerprint
+            self.entries.move_to_end((label, value))
+            self.hits += 1
+            return None
+
+    def record(self, written):
+        """Remember (label, value, fingerprint) entries for nodes that have been committed"""
+        now = monotonic()
+        with self.lock:
+            for label, value, fingerprint in written:
+                self.entries[(label, value)] = (fingerprint, now)
+                self.entries.move_to_end((label, value))
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Counters for sizing the cache: hits are MERGEs skipped, updates are known nodes whose properties changed"""
+        lookups = self.hits + self.misses + self.updates
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'updates': self.updates,
+                'evictions': self.evictions, 'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
@@ -0,0 +1,162 @@
+from shardstore import loads
+
+
+class Absent:
+    """Marks a field the line did not have, which stays out of the node's properties (unlike a null)"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'ABSENT'
+
+
+ABSENT = Absent()
+SCALARS = frozenset([int, str, float, bool])
+
+
+def scalar_props(data, skip=()):
+    """Coerce property values the way graphprocess.clean_properties does for values decoded from JSON"""
+    return {k: v if type(v) in SCALARS else str(v) for (k, v) in data.items() if k not in skip}
+
+
+# Entity list, node label, primary key and the keys ent_parser drops
+ENTITY_KINDS = [('hashtags', 'Hashtag', 'text', ()), ('user_mentions', 'User', 'id', ('indices',)),
+                ('urls', 'Url', 'expanded_url', ('indices',))]
+
+
+class Unmodelled(ValueError):
+    """Raised for lines that don't have the shape status_to_dict writes, which take the dict path instead"""
+
+
+class Entity:
+    """A Hashtag, mentioned User or Url, already reduced to the properties of its node"""
+    __slots__ = ('label', 'key', 'props')
+
+    def __init__(self, label, key, props):
+        self.label = label
+        self.key = key
+        self.props = props
+
+    @classmethod
+    def parse(cls, entities):
+        """Return (label, [Entity]) pairs for the hashtags, mentions and urls of an entities dict, as ent_parser does"""
+        if not isinstance(entities, dict):
+            raise Unmodelled('entities is not a dict')
+        out = []
+        for name, label, key, skip in ENTITY_KINDS:
+            items = entities.get(name)
+            if not items:
+                continue
+            if type(items) is not list:
+                raise Unmodelled(f'{name} is not a list')
+            parsed = []
+            for item in items:
+                if type(item) is not dict or (skip and skip[0] not in item):
+                    raise Unmodelled(f'unexpected item in {name}')
+                parsed.append(cls(label, key, scalar_props(item, skip)))
+            out.append((label, parsed))
+        return out
+
+
+class User:
+    """Slotted record of the user dict status_to_dict writes, any other keys are kept in extra"""
+    __slots__ = ('screen_name', 'followers_count', 'verified', 'created_at', 'id', 'lang', 'extra')
+    FIELDS = __slots__[:-1]
+    KNOWN = frozenset(FIELDS)
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise Unmodelled('user is not a dict')
+        user = cls()
+        get = data.get
+        user.screen_name = get('screen_name', ABSENT)
+        user.followers_count = get('followers_count', ABSENT)
+        user.verified = get('verified', ABSENT)
+        user.created_at = get('created_at', ABSENT)
+        user.id = get('id', ABSENT)
+        user.lang = get('lang', ABSENT)
+        extra = data.keys() - cls.KNOWN
+        user.extra = {k: data[k] for k in extra} if extra else None
+        return user
+
+    def props(self):
+        """Node properties, as user_dtn would set them"""
+        props = {}
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            if value is not ABSENT:
+                props[name] = value if type(value) in SCALARS else str(value)
+        if self.extra:
+            props.update(scalar_props(self.extra))
+        return props
+
+
+class Tweet:
+    """Slotted record of one line written by graphstream.status_to_dict.
+
+    Top-level records own their user, entities and any retweeted or quoted Tweet. Nested records (the retweeted or
+    quoted status) keep a further retweeted_status or quoted_status as an ordinary property, as the dict path does.
+    """
+    __slots__ = ('timestamp', 'text', 'lang', 'in_reply_to_status_id', 'in_reply_to_user_id', 'retweet_count',
+                 'favorite_count', 'user_id', 'coordinates', 'id', 'user', 'entities', 'retweeted', 'quoted', 'extra')
+    FIELDS = __slots__[:10]
+    KNOWN = frozenset(FIELDS + ('user', 'entities', 'retweeted_status', 'quoted_status'))
+    NESTED = frozenset(FIELDS + ('user', 'entities'))
+
+    @classmethod
+    def from_dict(cls, data, nested=False):
+        """Decode a tweet dict without modifying it. Raises Unmodelled for deletes and other unexpected shapes."""
+        if not isinstance(data, dict) or 'delete' in data:
+            raise Unmodelled('not a status')
+        tweet = cls()
+        get = data.get
+        tweet.timestamp = get('timestamp', ABSENT)
+        tweet.text = get('text', ABSENT)
+        tweet.lang = get('lang', ABSENT)
+        tweet.in_reply_to_status_id = get('in_reply_to_status_id', ABSENT)
+        tweet.in_reply_to_user_id = get('in_reply_to_user_id', ABSENT)
+        tweet.retweet_count = get('retweet_count', ABSENT)
+        tweet.favorite_count = get('favorite_count', ABSENT)
+        tweet.user_id = get('user_id', ABSENT)
+        tweet.coordinates = get('coordinates', ABSENT)
+        tweet.id = get('id', ABSENT)
+        if nested:
+            # A retweeted or quoted status always has its user and entities split off
+            if 'user' not in data or 'entities' not in data:
+                raise Unmodelled('nested status without user or entities')
+            tweet.user = User.from_dict(data['user'])
+            tweet.entities = Entity.parse(data['entities'])
+            tweet.retweeted = tweet.quoted = ABSENT
+            extra = data.keys() - cls.NESTED
+        else:
+            if 'user' not in data:
+                raise Unmodelled('no user')
+            tweet.user = User.from_dict(data['user'])
+            tweet.entities = Entity.parse(data['entities']) if get('entities', []) != [] else []
+            retweeted, quoted = get('retweeted_status'), get('quoted_status')
+            tweet.retweeted = cls.from_dict(retweeted, True) if isinstance(retweeted, dict) else ABSENT
+            tweet.quoted = cls.from_dict(quoted, True) if isinstance(quoted, dict) else ABSENT
+            if tweet.retweeted is not ABSENT and tweet.quoted is not ABSENT:
+                # The copy of the quoted status inside the retweeted one is dropped
+                if 'quoted_status' not in retweeted:
+                    raise Unmodelled('retweeted status missing its quoted status')
+                del tweet.retweeted.extra['quoted_status']
+            extra = data.keys() - cls.KNOWN
+        tweet.extra = {k: data[k] for k in extra} if extra else None
+        return tweet
+
+    @classmethod
+    def decode(cls, line):
+        """Decode a raw jsonl line straight into a Tweet"""
+        return cls.from_dict(loads(line))
+
+    def props(self):
+        """Node properties, as dict_to_node would set them from the dict left after separate_children"""
+        props = {}
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            if value is not ABSENT:
+                props[name] = value if type(value) in SCALARS else str(value)
+        if self.extra:
+            props.update(scalar_props(self.extra))
+        return props
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+import argparse
+import logging
+
+import nltk
+
+from bulkload import SENTIMENT_QUERY
+from graphprocess import graph
+from textclean import strip
+
+logging.basicConfig(filename='neo4j_errors.log', filemode='a+', format='%(asctime)s: %(message)s', level=logging.ERROR)
+
+UNSCORED_QUERY = """MATCH (t:Tweet) WHERE t.sentiment IS NULL AND t.text IS NOT NULL AND t.id > $after
+                    RETURN t.id AS id, t.text AS text ORDER BY t.id LIMIT $limit"""
+
+
+class SentimentScorer:
+    """Scores batches of tweets with VADER's compound polarity and, when a spaCy model is installed, embeds them.
+
+    Text is cleaned with textclean.strip first, as graph_sentiment did. Scores are cached by tweet id so a tweet that
+    is merged again (e.g. every time it is retweeted) is not rescored.
+    """
+
+    def __init__(self, model='en_core_web_md', batch_size=256, n_process=1, cache_size=10000):
+        self.model = model
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._analyzer = None
+        self._nlp = None
+
+    @property
+    def analyzer(self):
+        if self._analyzer is None:
+            from nltk.sentiment.vader import SentimentIntensityAnalyzer
+            try:
+                nltk.data.find('sentiment/vader_lexicon.zip')
+            except LookupError:
+                nltk.download('vader_lexicon', quiet=True)
+            self._analyzer = SentimentIntensityAnalyzer()
+        return self._analyzer
+
+    @property
+    def nlp(self):
+        """spaCy pipeline used for embeddings, or False if spaCy or the model is unavailable"""
+        if self._nlp is None:
+            try:
+                import spacy
+                self._nlp = spacy.load(self.model, disable=['parser', 'ner', 'tagger'])
+            except (ImportError, OSError) as e:
+                logging.error(f'No embeddings, could not load spaCy model {self.model}: {e}')
+                self._nlp = False
+        return self._nlp
+
+    def score(self, tweets):
+        """Take an iterable of (id, text) pairs and return rows of {'id', 'sentiment', 'embedding'}"""
+        rows = {}
+        todo = []
+        for t_id, text in tweets:
+            if t_id in self.cache:
+                self.cache.move_to_end(t_id)
+                rows[t_id] = self.cache[t_id]
+                self.hits += 1
+            elif t_id not in rows:
+                rows[t_id] = None
+                todo.append((t_id, strip(text)))
+        self.misses += len(todo)
+        texts = [text for (_, text) in todo]
+        sentiments = [float(self.analyzer.polarity_scores(text)['compound']) for text in texts]
+        if self.nlp:
+            embeddings = [doc.vector.tolist()
+                          for doc in self.nlp.pipe(texts, batch_size=self.batch_size, n_process=self.n_process)]
+        else:
+            embeddings = [None] * len(texts)
+        for (t_id, _), sentiment, embedding in zip(todo, sentiments, embeddings):
+            rows[t_id] = {'id': t_id, 'sentiment': sentiment, 'embedding': embedding}
+            self.cache[t_id] = rows[t_id]
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return list(rows.values())
+
+
+def backfill(graph, scorer, page_size=5000, index=None):
+    """Score every Tweet node without a sentiment, a page at a time in id order. Returns the number scored.
+    With a vectorindex.VectorIndex the new embeddings are appended to it as well."""
+    after = -1
+    scored = 0
+    while True:
+        page = [(record['id'], record['text']) for record in graph.run(UNSCORED_QUERY, after=after, limit=page_size)]
+        if not page:
+            return scored
+        rows = scorer.score(page)
+        graph.run(SENTIMENT_QUERY, rows=rows)
+        if index is not None:
+            index.add_rows(rows)
+        scored += len(rows)
+        after = page[-1][0]
+        print(f'{scored} tweets scored, up to id {after}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Score Tweet nodes that have no sentiment yet.')
+    parser.add_argument('--page-size', type=int, default=5000)
+    parser.add_argument('--processes', type=int, default=1, help='Processes used by spaCy for embeddings')
+    parser.add_argument('--model', default='en_core_web_md')
+    parser.add_argument('--index', help='Also append the embeddings to the vectorindex in this directory')
+    args = parser.parse_args()
+
+    index = None
+    if args.index:
+        from vectorindex import VectorIndex
+        index = VectorIndex(args.index)
+    backfill(graph, SentimentScorer(args.model, n_process=args.processes), args.page_size, index)
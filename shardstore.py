@@ -0,0 +1,203 @@
+from datetime import datetime
+import argparse
+import glob
+import gzip
+import io
+import json
+import os
+import re
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+SUFFIXES = ('.jsonl', '.jsonl.gz', '.jsonl.zst')
+# graphstream names shards Tweets-{month}-{day}-{hour}-{minute}.jsonl after the 10 minutes they cover
+SHARD_TIME = re.compile(r'-(\d+)-(\d+)-(\d+)-(\d+)\.jsonl(?:\.gz|\.zst)?$')
+
+
+def codec_of(filename):
+    """Return the compression suffix of a shard ('' for plain jsonl)"""
+    for suffix in ('.gz', '.zst'):
+        if filename.endswith(suffix):
+            return suffix
+    return ''
+
+
+def shard_key(filename):
+    """Name a shard is tracked by, the same for its plain and compressed copies"""
+    return os.path.normpath(filename[:len(filename) - len(codec_of(filename))])
+
+
+def shard_time(filename):
+    """(month, day, hour, minute, second) a shard starts at, from its name, else from when the file was created.
+    Unlike the file's ctime this does not change when a shard is converted."""
+    match = SHARD_TIME.search(os.path.basename(filename))
+    if match:
+        return tuple(int(part) for part in match.groups()) + (0,)
+    created = datetime.fromtimestamp(os.path.getctime(filename))
+    return created.month, created.day, created.hour, created.minute, created.second
+
+
+def list_shards(path):
+    """Return every shard under path, plain or compressed, oldest first.
+
+    A plain shard that has been converted is left out in favour of its compressed copy, so no shard is listed twice.
+    """
+    files = []
+    for suffix in SUFFIXES:
+        files += glob.glob(os.path.join(path, '*' + suffix))
+    present = set(files)
+    files = [filename for filename in files
+             if codec_of(filename) or not any(filename + codec in present for codec in ('.gz', '.zst'))]
+    return sorted(files, key=lambda filename: (shard_time(filename), filename))
+
+
+def open_shard(filename):
+    """Open a shard for reading as a binary stream of jsonl lines, decompressing it if needed"""
+    codec = codec_of(filename)
+    if codec == '.gz':
+        return gzip.open(filename, 'rb')
+    if codec == '.zst':
+        if zstandard is None:
+            raise ImportError(f'zstandard is required to read {filename}')
+        raw = open(filename, 'rb')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True,
+                                                                            closefd=True))
+    return open(filename, 'rb')
+
+
+def seek_shard(f, offset):
+    """Move a stream from open_shard to an offset in the uncompressed jsonl"""
+    if f.seekable():
+        f.seek(offset)
+        return
+    while offset > 0:
+        chunk = f.read(min(offset, 1 << 20))
+        if not chunk:
+            break
+        offset -= len(chunk)
+
+
+def iter_records(filename):
+    """Yield every tweet dict in a shard"""
+    with open_shard(filename) as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
+
+def shard_length(filename):
+    """Return the number of bytes of uncompressed jsonl in a shard, i.e. the ledger offset of its end"""
+    if not codec_of(filename):
+        return os.path.getsize(filename)
+    length = 0
+    with open_shard(filename) as f:
+        try:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                length += len(chunk)
+        except EOFError:
+            pass
+    return length
+
+
+def load_frame(filenames):
+    """Read shards into a pandas DataFrame, e.g. for the notebook"""
+    import pandas as pd
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    return pd.DataFrame.from_records(record for filename in filenames for record in iter_records(filename))
+
+
+class BlockWriter:
+    """Append jsonl to a shard in independently compressed blocks.
+
+    Every flush() compresses the lines written since the last one into a complete gzip member or zstd frame, so
+    readers can stream the file while it grows and a crash loses at most the unflushed block. Lines are written
+    byte for byte, so offsets into the uncompressed stream match those of the equivalent plain jsonl shard; offset
+    is that of the end of the last line written.
+    """
+
+    def __init__(self, filename, level=None):
+        self.filename = filename
+        self.codec = codec_of(filename)
+        self.offset = shard_length(filename) if os.path.exists(filename) else 0
+        if self.codec == '.zst':
+            if zstandard is None:
+                raise ImportError(f'zstandard is required to write {filename}')
+            self._compress = zstandard.ZstdCompressor(level=level or 3).compress
+        elif self.codec == '.gz':
+            self._compress = lambda data: gzip.compress(data, compresslevel=level or 6)
+        else:
+            self._compress = bytes
+        self._file = open(filename, 'ab')
+        self._block = []
+
+    def write(self, record):
+        self.write_line((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+
+    def write_line(self, line):
+        """Append an already encoded jsonl line"""
+        self._block.append(line)
+        self.offset += len(line)
+
+    def flush(self):
+        if self._block:
+            self._file.write(self._compress(b''.join(self._block)))
+            self._block = []
+        self._file.flush()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def convert(filename, codec='.gz', block_lines=1000, remove=False):
+    """Rewrite a plain jsonl shard as a block-compressed one and return the new filename.
+
+    Lines are copied without being decoded, so offsets into the old shard are valid for the new one; ledgers track
+    both under the same shard_key, so every reader of the shards resumes where it was. The copy is written under a
+    temporary name and renamed once complete, so the compressed shard (which list_shards then lists in place of the
+    plain one) is never seen half written, and converting a shard again leaves an existing copy as it is.
+    """
+    target = filename + codec
+    if not os.path.exists(target):
+        partial = filename + '.part' + codec
+        if os.path.exists(partial):
+            os.remove(partial)
+        writer = BlockWriter(partial)
+        with open(filename, 'rb') as f:
+            for i, line in enumerate(f, 1):
+                writer.write_line(line)
+                if i % block_lines == 0:
+                    writer.flush()
+        writer.close()
+        os.replace(partial, target)
+    if remove:
+        os.remove(filename)
+    return target
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert finished jsonl shards into block-compressed shards.')
+    parser.add_argument('--path', default='Data/Primary/')
+    parser.add_argument('--codec', default='.gz', choices=['.gz', '.zst'])
+    parser.add_argument('--block-lines', type=int, default=1000)
+    parser.add_argument('--remove', action='store_true', help='Delete the plain shard once converted')
+    args = parser.parse_args()
+
+    # The newest shard is still being written by graphstream
+    for filename in list_shards(args.path)[:-1]:
+        if codec_of(filename):
+            continue
+        print(f'{filename} -> {convert(filename, args.codec, args.block_lines, args.remove)}')
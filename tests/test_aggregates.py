@@ -0,0 +1,71 @@
+"""aggregates.materialize counts every shard line exactly once, however the shards are stored.
+
+    python -m pytest tests
+"""
+import json
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregates import materialize, prune_terms, read_terms  # noqa: E402
+from shardstore import convert  # noqa: E402
+
+
+def tweet(i, start=1583280000):
+    return {'id': 10 ** 18 + i, 'timestamp': start + 60 * i, 'user_id': 1000 + i % 7,
+            'user': {'id': 1000 + i % 7, 'screen_name': f'user{i % 7}'},
+            'text': f'Bernie Sanders and Joe Biden #SuperTuesday #Vote{i % 3} tweet {i}',
+            'entities': {'hashtags': [{'text': 'SuperTuesday'}, {'text': f'Vote{i % 3}'}], 'user_mentions': [],
+                         'urls': []}}
+
+
+def write_shard(path, name, tweets):
+    filename = os.path.join(path, name)
+    with open(filename, 'w') as f:
+        for t in tweets:
+            f.write(json.dumps(t) + '\n')
+        # Blank lines are skipped but still read
+        f.write('\n')
+    return filename
+
+
+def totals(db):
+    with sqlite3.connect(db) as conn:
+        return (conn.execute('SELECT candidate, kind, SUM(tweets) FROM buckets GROUP BY candidate, kind '
+                             'ORDER BY candidate, kind').fetchall(),
+                conn.execute('SELECT SUM(count) FROM terms').fetchone()[0])
+
+
+def test_materialize_counts_each_line_once(tmp_path):
+    path, db = str(tmp_path), str(tmp_path / 'aggregates.db')
+    first = write_shard(path, 'Tweets-3-3-20-00.jsonl', [tweet(i) for i in range(30)])
+    write_shard(path, 'Tweets-3-3-20-10.jsonl', [tweet(i) for i in range(30, 40)])
+    assert materialize(path, db, sentiment=False, words=False, checkpoint=7) == 40
+    counted = totals(db)
+    assert counted[0] == [('BernieSanders', 'about', 40), ('JoeBiden', 'about', 40)]
+    assert read_terms(db, 'JoeBiden', term_type='hashtag', top=1) == {'#supertuesday': 40}
+
+    # Nothing new: running again counts nothing
+    assert materialize(path, db, sentiment=False, words=False) == 0
+    # Compressing a shard that has been counted does not count it again
+    convert(first, '.gz', block_lines=4, remove=True)
+    assert materialize(path, db, sentiment=False, words=False) == 0
+    assert totals(db) == counted
+
+
+def test_prune_terms_drops_rare_terms_of_old_buckets(tmp_path):
+    path, db = str(tmp_path), str(tmp_path / 'aggregates.db')
+    write_shard(path, 'Tweets-3-3-20-00.jsonl', [tweet(i) for i in range(30)])
+    write_shard(path, 'Tweets-3-5-20-00.jsonl', [tweet(i, start=1583452800) for i in range(30, 33)])
+    materialize(path, db, sentiment=False, words=False)
+    old = {'#supertuesday': 30, '#vote0': 10, '#vote1': 10, '#vote2': 10}
+    assert read_terms(db, 'JoeBiden', term_type='hashtag', end=1583280000 + 3600) == old
+
+    # The #voteN terms of the old bucket go, the newer bucket keeps every term
+    assert prune_terms(db, min_count=20) == 2 * 3
+    assert read_terms(db, 'JoeBiden', term_type='hashtag', end=1583280000 + 3600) == {'#supertuesday': 30}
+    assert read_terms(db, 'JoeBiden', term_type='hashtag', start=1583452800) == {'#supertuesday': 3, '#vote0': 1,
+                                                                                    '#vote1': 1, '#vote2': 1}
+    assert prune_terms(db, min_count=20) == 0
@@ -0,0 +1,27 @@
+"""influence.Projection caches load back with the same user and hashtag keys they were saved with.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from influence import IdMap, Projection  # noqa: E402
+
+
+def test_keys_round_trip(tmp_path):
+    filename = str(tmp_path / 'projection.npz')
+    projection = Projection()
+    projection.users = IdMap([10 ** 18, 12, 7])
+    projection.hashtags = IdMap(['2020', '46'])
+    projection.save(filename)
+
+    loaded = Projection.load(filename)
+    assert loaded.users.keys == [10 ** 18, 12, 7]
+    assert loaded.hashtags.keys == ['2020', '46']
+    assert loaded.hashtags.ids(['46', '2020']).tolist() == [1, 0]
+
+
+def test_mixed_hashtags_stay_strings():
+    assert IdMap(['supertuesday', '2020']).to_array().tolist() == ['supertuesday', '2020']
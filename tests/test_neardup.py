@@ -0,0 +1,45 @@
+"""neardup.dedupe_shards clusters every shard line once, however the shards are stored.
+
+    python -m pytest tests
+"""
+import json
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from neardup import collapse, dedupe_shards  # noqa: E402
+from shardstore import convert  # noqa: E402
+
+
+def write_shard(filename, texts, start=0):
+    with open(filename, 'w') as f:
+        for i, text in enumerate(texts, start):
+            f.write(json.dumps({'id': i, 'text': text}) + '\n')
+    return filename
+
+
+TEXTS = ['Bernie wins Nevada by a mile, what a night for the campaign',
+         'RT @someone: Bernie wins Nevada by a mile, what a night for the campaign!!',
+         'Biden takes South Carolina and the race is wide open again',
+         'Warren had the best debate performance of anyone on stage tonight']
+
+
+def test_collapse_groups_near_duplicates():
+    representatives, counts, labels = collapse(TEXTS)
+    assert len(representatives) == 3
+    assert labels.tolist()[:2] == [0, 0]
+    assert sum(counts) == len(TEXTS)
+
+
+def test_converted_shard_is_not_clustered_again(tmp_path):
+    db = str(tmp_path / 'neardup.db')
+    first = write_shard(str(tmp_path / 'Tweets-3-3-20-00.jsonl'), TEXTS * 5)
+    write_shard(str(tmp_path / 'Tweets-3-3-20-10.jsonl'), TEXTS[:1], start=100)
+    assert dedupe_shards(str(tmp_path), db) == (21, 3)
+
+    convert(first, '.gz', block_lines=3, remove=True)
+    assert dedupe_shards(str(tmp_path), db) == (0, 0)
+    with sqlite3.connect(db) as conn:
+        assert conn.execute('SELECT SUM(count) FROM clusters').fetchone()[0] == 21
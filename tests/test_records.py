@@ -0,0 +1,76 @@
+"""The slotted records.Tweet path must write exactly what the dict/py2neo Node path writes.
+
+    python -m pytest tests
+"""
+import copy
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bulkload import dict_ops, record_ops, TweetBatch  # noqa: E402
+from records import Tweet  # noqa: E402
+
+
+def user(i):
+    return {'id': 100 + i, 'screen_name': f'user{i}', 'name': f'User {i}', 'followers_count': 10 * i,
+            'statuses_count': 5, 'favourites_count': 2, 'verified': i % 2 == 0, 'created_at': 1.5e9, 'lang': 'en'}
+
+
+def entities(*mentioned, tags=('SuperTuesday',), urls=('https://berniesanders.com',)):
+    return {'hashtags': [{'text': tag, 'indices': [0, len(tag) + 1]} for tag in tags],
+            'user_mentions': [{'screen_name': f'user{i}', 'name': f'User {i}', 'id': 100 + i, 'id_str': str(100 + i),
+                               'indices': [15, 29]} for i in mentioned],
+            'urls': [{'url': 'https://t.co/abc', 'expanded_url': url, 'display_url': url[8:], 'indices': [30, 53]}
+                     for url in urls],
+            'symbols': []}
+
+
+def status(i, author, ents, **extra):
+    tweet = {'timestamp': 1.583e9 + i, 'text': f'#SuperTuesday @user1 https://t.co/abc tweet {i}', 'lang': 'en',
+             'in_reply_to_status_id': None, 'in_reply_to_user_id': None, 'retweet_count': i, 'favorite_count': 0,
+             'user_id': author['id'], 'coordinates': None, 'id': 10 ** 18 + i, 'user': author, 'entities': ents,
+             'reply_count': 1, 'quote_count': 2, 'favourites_count': 3}
+    tweet.update(extra)
+    return tweet
+
+
+SAMPLES = {
+    'plain': status(1, user(1), entities(2, 3)),
+    'no entities': status(2, user(2), entities(tags=(), urls=())),
+    'retweet': status(3, user(3), entities(1), retweeted_status=status(4, user(4), entities(1, 5, tags=('Biden',)))),
+    'quote': status(5, user(5), entities(6), quoted_status=status(6, user(6), entities(7, tags=('Warren', 'Yang')))),
+    'self mention': status(7, user(7), entities(7)),
+}
+
+
+def statements(ops):
+    """{query: rows} of a batch holding one tweet's writes, with rows in a fixed order"""
+    batch = TweetBatch()
+    batch.add(ops)
+    return {query: sorted(rows, key=repr) for query, rows in batch.statements()}
+
+
+@pytest.mark.parametrize('name', sorted(SAMPLES))
+def test_record_ops_match_dict_ops(name):
+    tweet = SAMPLES[name]
+    # dict_ops consumes its tweet dict, Tweet.from_dict leaves it alone
+    expected = statements(dict_ops(copy.deepcopy(tweet)))
+    assert statements(record_ops(Tweet.from_dict(copy.deepcopy(tweet)))) == expected
+
+
+def test_record_ops_match_dict_ops_in_one_batch():
+    dicts, records = TweetBatch(), TweetBatch()
+    for tweet in SAMPLES.values():
+        dicts.add(dict_ops(copy.deepcopy(tweet)))
+        records.add(record_ops(Tweet.from_dict(copy.deepcopy(tweet))))
+    assert list(records.statements()) == list(dicts.statements())
+
+
+def test_counters():
+    ops = record_ops(Tweet.from_dict(copy.deepcopy(SAMPLES['retweet'])))
+    counts = [op for op in ops if op[0] == 'count']
+    # A RETWEETS from the retweeter to the author and a BROADCASTS of each entity of the original tweet
+    assert len(counts) == 1 + 2 + 1
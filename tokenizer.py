@@ -0,0 +1,111 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+import string
+
+from textclean import strip
+
+EXTRA_STOPWORDS = ["'", '"', '...', '``', '…', '’', '‘', '“', "''", '""', '”', '”', 'co', "'s'", '\'s', 'n\'t', '\'m',
+                   '\'re', 'amp', 'https']
+
+
+class CachedTokenizer:
+    """Reusable replacement for get_sentiment.process_tweet and tokenized.
+
+    Stopwords are loaded once into a frozenset and each distinct token is lemmatized once, through a bounded LRU
+    cache keyed on the raw token. NLTK and its corpora are only loaded when the first tweet is tokenized.
+    """
+
+    def __init__(self, cache_size=200000):
+        self.cache_size = cache_size
+        self._stopwords = None
+        self._lemmatizer = None
+        self._word_tokenize = None
+        self.normalize = lru_cache(maxsize=cache_size)(self._normalize)
+
+    def __getstate__(self):
+        # Workers build their own corpora and cache
+        return {'cache_size': self.cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def stopwords(self):
+        if self._stopwords is None:
+            from nltk.corpus import stopwords
+            self._stopwords = frozenset(stopwords.words('english') + list(string.punctuation) + EXTRA_STOPWORDS)
+        return self._stopwords
+
+    @property
+    def lemmatizer(self):
+        if self._lemmatizer is None:
+            import nltk
+            from nltk.stem import WordNetLemmatizer
+            try:
+                nltk.data.find('corpora/wordnet')
+            except LookupError:
+                nltk.download('wordnet', quiet=True)
+            self._lemmatizer = WordNetLemmatizer()
+        return self._lemmatizer
+
+    @property
+    def word_tokenize(self):
+        if self._word_tokenize is None:
+            from nltk import word_tokenize
+            self._word_tokenize = word_tokenize
+        return self._word_tokenize
+
+    def _normalize(self, token):
+        """Lemmatized, lower-cased token or None for stopwords"""
+        if token in self.stopwords:
+            return None
+        return self.lemmatizer.lemmatize(token).lower()
+
+    def process(self, tweet):
+        """Same output as process_tweet: the lemmatized words of a string that aren't stopwords"""
+        normalize = self.normalize
+        return [word for word in map(normalize, self.word_tokenize(tweet)) if word is not None]
+
+    def tweet_tokens(self, tweet):
+        """Tokens of a single tweet given as a string or a list of hashtags, lower-cased and stripped first"""
+        if type(tweet) == str:
+            tweet = tweet.lower()
+        else:
+            tweet = ' '.join([tag.lower() for tag in tweet])
+        return self.process(strip(tweet))
+
+    def map(self, series, workers=1, chunk_size=5000):
+        """Yield the tokens of every tweet in order, tokenizing chunks across a process pool when workers > 1"""
+        if workers <= 1:
+            for tweet in series:
+                yield self.tweet_tokens(tweet)
+            return
+        tweets = iter(series)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for chunk in iter(lambda: list(islice(tweets, chunk_size)), []):
+                pending.append(pool.submit(_tokens_chunk, self.cache_size, chunk))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def tokenized(self, series, workers=1):
+        """Same output as tokenized: one list of every word in the series"""
+        return [token for tokens in self.map(series, workers) for token in tokens]
+
+    def cache_info(self):
+        return self.normalize.cache_info()
+
+
+_worker_tokenizer = None
+
+
+def _tokens_chunk(cache_size, chunk):
+    # One tokenizer per worker process so its cache lives across chunks
+    global _worker_tokenizer
+    if _worker_tokenizer is None:
+        _worker_tokenizer = CachedTokenizer(cache_size)
+    return [_worker_tokenizer.tweet_tokens(tweet) for tweet in chunk]
@@ -0,0 +1,109 @@
+from collections import Counter, deque
+from math import sqrt
+from threading import Lock
+from time import time
+import re
+
+HASHTAG = re.compile(r'#\w+')
+
+
+def hashtags(tweet):
+    """Return the distinct hashtags of a tweet dict as '#tag' strings, from its entities where it has them.
+
+    Retweets are counted with the hashtags of the original, whose entities are not truncated.
+    """
+    source = tweet.get('retweeted_status') or tweet
+    entities = source.get('entities')
+    if entities and entities.get('hashtags') is not None:
+        tags = ['#' + tag['text'] for tag in entities['hashtags']]
+    else:
+        tags = HASHTAG.findall(source.get('text') or '')
+    return list(dict.fromkeys(tags))
+
+
+class TrendingTags:
+    """Sliding-window hashtag counts with burst detection, in bounded memory.
+
+    Counts are kept per bucket_seconds time bucket for the last window buckets. A tag scores the z-score of its
+    count over the latest `recent` buckets against its mean and variance per bucket over the rest of the window
+    (floored at the Poisson variance), so tags that are always busy do not trend but one that takes off does. When a
+    bucket is closed only its max_tags most frequent tags are kept, so memory is bounded by about
+    window * max_tags entries whatever the rate of the stream. Safe to feed and query from different threads.
+    """
+
+    def __init__(self, bucket_seconds=60, window=60, recent=5, max_tags=2000, min_count=5):
+        if not 0 < recent < window:
+            raise ValueError('recent must be between 0 and window buckets')
+        self.bucket_seconds = bucket_seconds
+        self.window = window
+        self.recent = recent
+        self.max_tags = max_tags
+        self.min_count = min_count
+        self.lock = Lock()
+        # Newest bucket last; the last `recent` of them are the recent part, the rest the history
+        self.buckets = deque()
+        self.bucket = None
+        self.current = Counter()
+        self.history = 0
+        self.totals = Counter()
+        self.squares = Counter()
+        self.added = 0
+
+    def add(self, tags, timestamp=None):
+        """Count the hashtags of one tweet seen at timestamp (default now)"""
+        with self.lock:
+            self._advance(int((time() if timestamp is None else timestamp) // self.bucket_seconds))
+            self.current.update(tags)
+            self.added += 1
+
+    def top(self, k=10, timestamp=None):
+        """Return up to k (tag, z-score, recent count) of tags seen at least min_count times recently, best first"""
+        with self.lock:
+            if timestamp is not None:
+                self._advance(int(timestamp // self.bucket_seconds))
+            counts = self.current.copy()
+            for bucket in list(self.buckets)[max(0, len(self.buckets) - self.recent + 1):]:
+                counts.update(bucket)
+            scored = []
+            for tag, count in counts.items():
+                if count < self.min_count:
+                    continue
+                mean = self.totals[tag] / self.history if self.history else 0.0
+                variance = self.squares[tag] / self.history - mean * mean if self.history else 0.0
+                expected = mean * self.recent
+                scored.append((tag, (count - expected) / sqrt(self.recent * max(variance, mean) + 1), count))
+        scored.sort(key=lambda item: (-item[1], -item[2]))
+        return scored[:k]
+
+    def stats(self):
+        return {'tweets': self.added, 'buckets': len(self.buckets) + 1, 'history_tags': len(self.totals),
+                'current_tags': len(self.current)}
+
+    def _advance(self, bucket):
+        if self.bucket is None:
+            self.bucket = bucket
+        # Late tweets are counted in the current bucket
+        for _ in range(min(bucket - self.bucket, self.window)):
+            self._close()
+        self.bucket = max(self.bucket, bucket)
+
+    def _close(self):
+        """Move the current bucket into the window, one older bucket into the history and expire the oldest"""
+        counts = Counter(dict(self.current.most_common(self.max_tags)))
+        self.current = Counter()
+        self.buckets.append(counts)
+        if len(self.buckets) >= self.recent:
+            older = self.buckets[len(self.buckets) - self.recent]
+            for tag, count in older.items():
+                self.totals[tag] += count
+                self.squares[tag] += count * count
+            self.history += 1
+        if len(self.buckets) >= self.window:
+            expired = self.buckets.popleft()
+            for tag, count in expired.items():
+                self.totals[tag] -= count
+                self.squares[tag] -= count * count
+                if self.totals[tag] <= 0:
+                    del self.totals[tag]
+                    del self.squares[tag]
+            self.history -= 1
@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+EMBEDDED_QUERY = """MATCH (t:Tweet) WHERE t.embedding IS NOT NULL AND t.id > $after
+                    RETURN t.id AS id ORDER BY t.id LIMIT $limit"""
+EMBEDDING_QUERY = """UNWIND $ids AS id MATCH (t:Tweet {id: id}) RETURN t.id AS id, t.embedding AS embedding"""
+CANDIDATE_QUERY = """MATCH (u:User {screen_name: $name})-[:TWEETS]->(t:Tweet) WHERE t.embedding IS NOT NULL
+                     RETURN t.id AS id"""
+
+
+class VectorIndex:
+    """Cosine similarity search over tweet embeddings, kept on disk as memory-mapped float32 rows.
+
+    The directory holds vectors.f32 (unit length rows, appended in place), ids.i64 (the tweet id of each row) and
+    meta.json, which records the row count and is replaced last on every append, so rows written by an interrupted
+    append are ignored and overwritten. Searches scan the matrix in blocks of block_rows with one matrix product per
+    block of queries; after train() an inverted file (IVF) of k-means lists lets search(nprobe=...) score only the
+    rows of the lists nearest each query, an approximate search much faster on large indexes.
+    """
+
+    def __init__(self, path='Data/vectors/', dim=None, block_rows=65536):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.block_rows = block_rows
+        self.meta = {'dim': dim, 'count': 0, 'nlist': 0}
+        if os.path.exists(self._file('meta.json')):
+            with open(self._file('meta.json')) as f:
+                self.meta = json.load(f)
+        self.centroids = np.load(self._file('centroids.npy')) if self.meta['nlist'] else None
+        self._vectors = None
+        self._ids = None
+        self._rows = None
+        self._lists = None
+
+    def __len__(self):
+        return self.meta['count']
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def dim(self):
+        return self.meta['dim']
+
+    @property
+    def vectors(self):
+        """(count, dim) float32 memmap of the unit length embeddings"""
+        if self._vectors is None or len(self._vectors) != len(self):
+            self._vectors = (np.memmap(self._file('vectors.f32'), np.float32, 'r', shape=(len(self), self.dim))
+                             if len(self) else np.zeros((0, self.dim or 0), np.float32))
+        return self._vectors
+
+    @property
+    def ids(self):
+        if self._ids is None or len(self._ids) != len(self):
+            self._ids = (np.fromfile(self._file('ids.i64'), np.int64, count=len(self)) if len(self)
+                         else np.zeros(0, np.int64))
+        return self._ids
+
+    @property
+    def rows(self):
+        """Tweet id -> row"""
+        if self._rows is None:
+            self._rows = {tweet_id: row for row, tweet_id in enumerate(self.ids.tolist())}
+        return self._rows
+
+    def add(self, ids, vectors):
+        """Append embeddings of tweets not in the index yet. Returns the number added."""
+        vectors = np.array(vectors, dtype=np.float32).reshape(len(ids), -1)
+        if self.dim is None:
+            self.meta['dim'] = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f'Embeddings have {vectors.shape[1]} dimensions, the index {self.dim}')
+        rows = self.rows
+        keep = []
+        for i, tweet_id in enumerate(ids):
+            if tweet_id not in rows:
+                rows[tweet_id] = len(self) + len(keep)
+                keep.append(i)
+        if not keep:
+            return 0
+        vectors = normalize(vectors[keep])
+        ids = np.asarray(ids, dtype=np.int64)[keep]
+        offset = len(self)
+        for name, array in (('vectors.f32', vectors), ('ids.i64', ids)):
+            with open(self._file(name), 'r+b' if os.path.exists(self._file(name)) else 'wb') as f:
+                f.seek(offset * array.itemsize * (array.shape[1] if array.ndim > 1 else 1))
+                f.write(array.tobytes())
+                f.truncate()
+        if self.centroids is not None:
+            with open(self._file('lists.i32'), 'r+b' if os.path.exists(self._file('lists.i32')) else 'wb') as f:
+                f.seek(offset * 4)
+                f.write(self.assign(vectors).astype(np.int32).tobytes())
+                f.truncate()
+            self._lists = None
+        self.meta['count'] = offset + len(keep)
+        self._save_meta()
+        return len(keep)
+
+    def add_rows(self, rows):
+        """Append the {'id', 'embedding'} rows SentimentScorer.score returns, skipping those without an embedding"""
+        rows = [row for row in rows if row.get('embedding')]
+        if not rows:
+            return 0
+        return self.add([row['id'] for row in rows], [row['embedding'] for row in rows])
+
+    def sync(self, graph, page_size=20000, after=-1):
+        """Append the embeddings of Tweet nodes not in the index yet. Pages through the ids of embedded tweets above
+        after (default all of them) and fetches only the embeddings of ids missing from the index, so tweets scored
+        after higher ids were indexed are still picked up. Returns the number added."""
+        added = 0
+        while True:
+            page = [record['id'] for record in graph.run(EMBEDDED_QUERY, after=after, limit=page_size)]
+            if not page:
+                return added
+            missing = [tweet_id for tweet_id in page if tweet_id not in self.rows]
+            if missing:
+                rows = [(record['id'], record['embedding']) for record in graph.run(EMBEDDING_QUERY, ids=missing)]
+                ids, vectors = zip(*rows)
+                added += self.add(ids, vectors)
+            after = page[-1]
+
+    def _save_meta(self):
+        with open(self._file('meta.json.tmp'), 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(self._file('meta.json.tmp'), self._file('meta.json'))
+
+    def train(self, nlist=256, sample=100000, iterations=10, seed=0):
+        """Build the inverted file: spherical k-means centroids from a sample of rows, and every row's nearest list"""
+        rng = np.random.RandomState(seed)
+        picked = np.sort(rng.choice(len(self), min(sample, len(self)), replace=False))
+        if len(picked) < nlist:
+            raise ValueError(f'Cannot train {nlist} lists on a sample of {len(picked)} rows, '
+                             'use a larger sample or fewer lists')
+        data = np.asarray(self.vectors[picked])
+        centroids = data[rng.choice(len(data), nlist, replace=False)]
+        for _ in range(iterations):
+            nearest = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, data)
+            empty = ~sums.any(axis=1)
+            # Lists left empty restart at random rows so all nlist stay in use
+            sums[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+            centroids = normalize(sums)
+        self.centroids = centroids.astype(np.float32)
+        np.save(self._file('centroids.npy'), self.centroids)
+        lists = np.concatenate([self.assign(self.vectors[start:start + self.block_rows])
+                                for start in range(0, len(self), self.block_rows)]).astype(np.int32)
+        lists.tofile(self._file('lists.i32'))
+        self._lists = None
+        self.meta['nlist'] = nlist
+        self._save_meta()
+
+    def assign(self, vectors):
+        return np.argmax(np.asarray(vectors) @ self.centroids.T, axis=1)
+
+    @property
+    def lists(self):
+        """(rows sorted by list, start of each list in them) for the inverted file"""
+        if self._lists is None:
+            lists = np.fromfile(self._file('lists.i32'), np.int32, count=len(self))
+            order = np.argsort(lists, kind='stable')
+            self._lists = order, np.searchsorted(lists[order], np.arange(self.meta['nlist'] + 1))
+        return self._lists
+
+    def search(self, queries, k=10, nprobe=None, batch_size=1024):
+        """The k most similar tweets to each query vector, as (tweet ids, cosine similarities) arrays of shape
+        (queries, k) ordered best first. Exact unless nprobe is given and the index is trained, in which case only
+        the nprobe lists nearest each query are scored. Missing results have id -1 and similarity -inf."""
+        queries = normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        found = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for start in range(0, len(queries), batch_size):
+            block = queries[start:start + batch_size]
+            if nprobe and self.centroids is not None:
+                rows, sims = self._probe(block, k, nprobe)
+            else:
+                rows, sims = self._scan(block, k)
+            found[start:start + len(block)] = np.where(rows >= 0, self.ids[np.maximum(rows, 0)], -1)
+            scores[start:start + len(block)] = sims
+        return found, scores
+
+    def _scan(self, queries, k):
+        """Exact top k rows by brute force, merging the best of each block of the matrix"""
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            block = queries @ np.asarray(self.vectors[start:start + self.block_rows]).T
+            rows, sims = merge_top(rows, sims, block, np.arange(start, start + block.shape[1]), k)
+        return rows, sims
+
+    def _probe(self, queries, k, nprobe):
+        """Approximate top k rows, scoring each probed list once against every query probing it"""
+        order, starts = self.lists
+        nearest = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for probe in np.unique(nearest):
+            members = np.sort(order[starts[probe]:starts[probe + 1]])
+            if not len(members):
+                continue
+            asking = np.flatnonzero((nearest == probe).any(axis=1))
+            block = queries[asking] @ np.asarray(self.vectors[members]).T
+            rows[asking], sims[asking] = merge_top(rows[asking], sims[asking], block, members, k)
+        return rows, sims
+
+    def similar(self, tweet_ids, k=10, nprobe=None):
+        """{tweet id: [(similar tweet id, similarity)]} for indexed tweets, leaving out the tweet itself"""
+        tweet_ids = [tweet_id for tweet_id in tweet_ids if tweet_id in self.rows]
+        if not tweet_ids:
+            return {}
+        queries = np.asarray(self.vectors[[self.rows[tweet_id] for tweet_id in tweet_ids]])
+        found, scores = self.search(queries, k + 1, nprobe)
+        return {tweet_id: [(int(other), float(score)) for other, score in zip(ids, sims)
+                           if other != tweet_id and other >= 0][:k]
+                for tweet_id, ids, sims in zip(tweet_ids, found, scores)}
+
+
+def normalize(vectors):
+    """Rows scaled to unit length; zero rows (texts without known words) stay zero"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms > 0, norms, 1)).astype(np.float32)
+
+
+def merge_top(rows, sims, block, block_rows, k):
+    """Merge the current top k (rows, sims) with a (queries, n) block of similarities for block_rows"""
+    if block.shape[1] > k:
+        best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        block = np.take_along_axis(block, best, axis=1)
+        block_rows = block_rows[best]
+    else:
+        block_rows = np.broadcast_to(block_rows, block.shape)
+    sims = np.concatenate([sims, block], axis=1)
+    rows = np.concatenate([rows, block_rows], axis=1)
+    best = np.argsort(-sims, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(rows, best, axis=1), np.take_along_axis(sims, best, axis=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Index tweet embeddings from Neo4j and find similar tweets.')
+    parser.add_argument('--path', default='Data/vectors/')
+    parser.add_argument('--sync', action='store_true', help='Append embeddings scored since the last sync')
+    parser.add_argument('--newer', action='store_true',
+                        help='Only sync ids above the highest indexed, faster but misses older tweets scored later')
+    parser.add_argument('--train', type=int, default=0, help='Build an inverted file with this many lists')
+    parser.add_argument('--nprobe', type=int, default=0, help='Lists searched per query, 0 for exact search')
+    parser.add_argument('--candidate', nargs='*', default=[], help='Screen names whose tweets to find neighbours of')
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--min-similarity', type=float, default=0.9)
+    args = parser.parse_args()
+
+    index = VectorIndex(args.path)
+    graph = None
+    if args.sync or args.candidate:
+        from graphprocess import graph
+    if args.sync:
+        after = int(index.ids.max()) if args.newer and len(index) else -1
+        print(f'{index.sync(graph, after=after)} embeddings added, {len(index)} indexed')
+    if args.train:
+        index.train(args.train)
+    for name in args.candidate:
+        tweet_ids = [record['id'] for record in graph.run(CANDIDATE_QUERY, name=name)]
+        neighbours = index.similar(tweet_ids, args.k, args.nprobe or None)
+        clusters = sorted(((tweet_id, [other for other, score in similar if score >= args.min_similarity])
+                           for tweet_id, similar in neighbours.items()), key=lambda cluster: -len(cluster[1]))
+        print(f'{name}: {len(neighbours)} tweets indexed')
+        for tweet_id, others in clusters[:10]:
+            print(f'  {tweet_id}: {len(others)} similar tweets {others[:5]}')
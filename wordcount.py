@@ -0,0 +1,189 @@
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from hashlib import blake2b
+
+import numpy as np
+
+
+class CountMinTopK:
+    """Count-min sketch of token frequencies that also tracks the k heaviest tokens.
+
+    Memory is fixed at depth * width counters plus about 2k candidate tokens. Estimates never undercount and
+    overcount by at most total / width with probability 1 - exp(-depth). Row i hashes a token to h1 + i * h2 from one
+    128 bit blake2b digest, so rows are independent of each other and sketches built in different processes (which
+    randomize Python's own hash) can be merged.
+    """
+
+    def __init__(self, k=1000, width=2 ** 20, depth=4):
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.rows = np.arange(depth)
+        self.candidates = {}
+        # Smallest count kept by the last prune, anything below it cannot be in the top k
+        self.floor = 0
+
+    def _cells(self, tokens):
+        cells = np.empty((len(tokens), self.depth), dtype=np.int64)
+        for i, token in enumerate(tokens):
+            digest = int.from_bytes(blake2b(repr(token).encode('utf-8'), digest_size=16).digest(), 'little')
+            h1, h2 = digest & 0xFFFFFFFFFFFFFFFF, digest >> 64 | 1
+            cells[i] = [(h1 + row * h2) % self.width for row in range(self.depth)]
+        return cells
+
+    def estimate(self, token):
+        return int(self.table[self.rows, self._cells([token])[0]].min())
+
+    def update(self, tokens, count=1):
+        """Count every token in a list, count times"""
+        if not tokens:
+            return
+        cells = self._cells(tokens)
+        np.add.at(self.table, (self.rows, cells), count)
+        estimates = self.table[self.rows, cells].min(axis=1)
+        for token, estimate in zip(tokens, estimates.tolist()):
+            if estimate > self.floor or token in self.candidates:
+                self.candidates[token] = estimate
+        if len(self.candidates) > 2 * self.k:
+            self._prune()
+
+    def add(self, token):
+        self.update([token])
+
+    def _prune(self):
+        self.candidates = dict(Counter(self.candidates).most_common(self.k))
+        if len(self.candidates) >= self.k:
+            self.floor = min(self.candidates.values())
+
+    def merge(self, other):
+        """Add the counts of a sketch with the same shape into this one"""
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError('Can only merge sketches of the same width and depth')
+        self.table += other.table
+        for token in set(self.candidates) | set(other.candidates):
+            self.candidates[token] = self.estimate(token)
+        self._prune()
+        return self
+
+    def most_common(self, top=None):
+        return Counter(self.candidates).most_common(top)
+
+
+class WordCounter:
+    """Streaming unigram and bigram counts over tweets.
+
+    Tweets are tokenized one at a time by tokenize, so nothing is ever joined into one corpus string. Tokens are
+    interned to ints and bigrams are packed into a single int key. With sketch=True counts go into CountMinTopK
+    sketches instead, bounding memory at the cost of approximate counts. Bigrams never cross tweet boundaries.
+    Counters from parallel workers can be combined with merge().
+    """
+
+    def __init__(self, tokenize, bigrams=True, sketch=False, k=1000, width=2 ** 20, depth=4):
+        self.tokenize = tokenize
+        self.bigrams = bigrams
+        self.sketch = sketch
+        self.tweets = 0
+        if sketch:
+            self.unigram_counts = CountMinTopK(k, width, depth)
+            self.bigram_counts = CountMinTopK(k, width, depth) if bigrams else None
+        else:
+            self.vocab = {}
+            self.words = []
+            self.unigram_counts = Counter()
+            self.bigram_counts = Counter() if bigrams else None
+
+    def _id(self, token):
+        try:
+            return self.vocab[token]
+        except KeyError:
+            self.vocab[token] = len(self.words)
+            self.words.append(token)
+            return self.vocab[token]
+
+    def add_tokens(self, tokens, count=1):
+        """Count an already tokenized tweet, as count tweets when it stands for a cluster of near-duplicates"""
+        self.tweets += count
+        if self.sketch:
+            self.unigram_counts.update(tokens, count)
+            if self.bigrams:
+                self.bigram_counts.update(list(zip(tokens, tokens[1:])), count)
+            return
+        ids = [self._id(token) for token in tokens]
+        bigrams = (a << 32 | b for (a, b) in zip(ids, ids[1:])) if self.bigrams else ()
+        if count == 1:
+            self.unigram_counts.update(ids)
+            if self.bigrams:
+                self.bigram_counts.update(bigrams)
+            return
+        for key in ids:
+            self.unigram_counts[key] += count
+        for key in bigrams:
+            self.bigram_counts[key] += count
+
+    def update(self, tweets):
+        """Tokenize and count every tweet in an iterable or pandas Series"""
+        for tweet in tweets:
+            self.add_tokens(self.tokenize(tweet))
+        return self
+
+    def update_weighted(self, pairs):
+        """Tokenize and count (tweet, count) pairs, such as neardup.collapse representatives and their counts"""
+        for tweet, count in pairs:
+            self.add_tokens(self.tokenize(tweet), count)
+        return self
+
+    def merge(self, other):
+        """Add the counts of another WordCounter, e.g. one built by a parallel worker"""
+        self.tweets += other.tweets
+        if self.sketch:
+            self.unigram_counts.merge(other.unigram_counts)
+            if self.bigrams:
+                self.bigram_counts.merge(other.bigram_counts)
+            return self
+        remap = [self._id(word) for word in other.words]
+        for i, count in other.unigram_counts.items():
+            self.unigram_counts[remap[i]] += count
+        if self.bigrams:
+            for key, count in other.bigram_counts.items():
+                self.bigram_counts[remap[key >> 32] << 32 | remap[key & 0xFFFFFFFF]] += count
+        return self
+
+    def most_common(self, top=None):
+        """Return (word, count) pairs like FreqDist.most_common"""
+        if self.sketch:
+            return self.unigram_counts.most_common(top)
+        return [(self.words[i], count) for (i, count) in self.unigram_counts.most_common(top)]
+
+    def most_common_bigrams(self, top=None):
+        """Return ((word, word), count) pairs for the most frequent bigrams"""
+        if self.sketch:
+            return self.bigram_counts.most_common(top)
+        return [((self.words[key >> 32], self.words[key & 0xFFFFFFFF]), count)
+                for (key, count) in self.bigram_counts.most_common(top)]
+
+
+def _count_chunk(args):
+    tokenize, chunk, weighted, options = args
+    counter = WordCounter(tokenize, **options)
+    return counter.update_weighted(chunk) if weighted else counter.update(chunk)
+
+
+def count_parallel(tweets, tokenize, workers=4, chunk_size=10000, weighted=False, **options):
+    """Count an iterable of tweets in a process pool, merging worker counts in order. tokenize must be picklable.
+    With weighted=True the iterable holds (tweet, count) pairs.
+
+    At most two chunks per worker are in flight, so the iterable is never held in memory at once.
+    """
+    tweets = iter(tweets)
+    total = WordCounter(tokenize, **options)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in iter(lambda: list(islice(tweets, chunk_size)), []):
+            pending.append(pool.submit(_count_chunk, (tokenize, chunk, weighted, options)))
+            if len(pending) >= 2 * workers:
+                total.merge(pending.popleft().result())
+        while pending:
+            total.merge(pending.popleft().result())
+    return total